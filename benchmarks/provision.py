@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+""" Benchmarks provisioning of task working directories
+
+  Builds a synthetic solver directory (binaries, mesh databases, parameter
+  files), then times fanning it out into NTASK task directories for each
+  combination of linking mode and thread count. The serial copy each task
+  directory would otherwise receive is timed as a baseline.
+
+  Should be run on the filesystem of interest, for example:
+      python benchmarks/provision.py /scratch/gpfs/$USER/bench --ntask 1000
+
+  Results do not carry over between filesystems. On a local ext4 disk with a
+  single core, which has no reflinks, none of the modes was faster than
+  serial copying.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import time
+
+from os.path import join
+from seisflows.system.lib import provision
+
+
+def make_source(path, nbin=4, binsize=8, nmesh=64, meshsize=1, ndata=10):
+    """ Creates synthetic solver directory; sizes are in MB
+    """
+    for subdir, nfile, size in [('bin', nbin, binsize),
+                                ('DATABASES_MPI', nmesh, meshsize),
+                                ('DATA', ndata, 0)]:
+        os.makedirs(join(path, subdir))
+        for i in range(nfile):
+            with open(join(path, subdir, 'file%03d' % i), 'wb') as f:
+                f.write(os.urandom(max(int(size*2**20), 1024)))
+    os.makedirs(join(path, 'OUTPUT_FILES'))
+
+
+def timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def serial_copy(source, dirnames):
+    for dirname in dirnames:
+        shutil.copytree(source, dirname, symlinks=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='working directory on filesystem under test')
+    parser.add_argument('--ntask', type=int, default=1000)
+    parser.add_argument('--nthreads', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--modes', nargs='+', default=['hardlink', 'reflink', 'copy'])
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='multiplies size of synthetic binaries and mesh')
+    parser.add_argument('--baseline', action='store_true',
+                        help='also time serial copying')
+    args = parser.parse_args()
+
+    source = join(args.path, 'source')
+    template = join(args.path, 'template')
+    make_source(source, binsize=8*args.scale, meshsize=args.scale)
+    provision.template(source, template)
+
+    print('%-10s %8s %10s %10s' % ('mode', 'threads', 'seconds', 'dirs/s'))
+
+    if args.baseline:
+        dirnames = [join(args.path, 'baseline', str(i)) for i in range(args.ntask)]
+        t = timeit(serial_copy, source, dirnames)
+        print('%-10s %8d %10.2f %10.1f' % ('serial', 1, t, args.ntask/t))
+        shutil.rmtree(join(args.path, 'baseline'))
+
+    for mode in args.modes:
+        for nthreads in args.nthreads:
+            tasks = join(args.path, 'tasks')
+            dirnames = [join(tasks, str(i)) for i in range(args.ntask)]
+            t = timeit(provision.fanout, template, dirnames,
+                       provision.WRITABLE, mode, nthreads)
+            print('%-10s %8d %10.2f %10.1f' % (mode, nthreads, t, args.ntask/t))
+            shutil.rmtree(tasks)
+
+    shutil.rmtree(source)
+    shutil.rmtree(template)
@@ -15,12 +15,19 @@ PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
 
 
-class chinook_lg(custom_import('system', 'slurm_lg')):
+class chinook_lg(custom_import('system', 'slurm_lg_hpc')):
     """ System interface for University of Alaska Fairbanks CHINOOK
 
       If you are using more than 48 cores per task, then add the following to
       your parameter file:
-          SLURMARGS='--partition=t1standard'      
+          PARTITION='t1standard'
+
+      Alternatively, to let each job go to whichever partition is expected to
+      start it first:
+          PARTITIONS=['t1small', 't1standard']
+
+      A partition named in SLURMARGS, as in older parameter files, takes
+      precedence over both.
 
       For more informations, see 
       http://seisflows.readthedocs.org/en/latest/manual/manual.html#system-interfaces
@@ -43,7 +50,11 @@ class chinook_lg(custom_import('system', 'slurm_lg')):
 
         # optional additional SLURM arguments
         if 'SLURMARGS' not in PAR:
-            setattr(PAR, 'SLURMARGS', '--partition=t1small')
+            setattr(PAR, 'SLURMARGS', '')
+
+        # SLURM resource partition
+        if 'PARTITION' not in PAR:
+            setattr(PAR, 'PARTITION', 't1small')
 
         # optional environment variable list VAR1=val1,VAR2=val2,...
         if 'ENVIRONS' not in PAR:
@@ -56,37 +67,10 @@ class chinook_lg(custom_import('system', 'slurm_lg')):
         super(chinook_lg, self).check()
 
 
-    def submit(self, workflow):
-        """ Submits workflow
-        """
-        # create scratch directories
-        unix.mkdir(PATH.SCRATCH)
-        unix.mkdir(PATH.SYSTEM)
-
-        # create output directories
-        unix.mkdir(PATH.OUTPUT)
-        unix.mkdir(PATH.WORKDIR+'/'+'output.slurm')
-
-        if not exists('./scratch'): 
-            unix.ln(PATH.SCRATCH, PATH.WORKDIR+'/'+'scratch')
-
-        workflow.checkpoint()
-
-        # prepare sbatch arguments
-        call('sbatch '
-                + '%s ' % PAR.SLURMARGS
-                + '--partition=%s ' % 't1small' # overloads SLURMARGS 
-                + '--job-name=%s ' % PAR.TITLE
-                + '--output %s ' % (PATH.WORKDIR+'/'+'output.log')
-                + '--ntasks-per-node=%d ' % PAR.NODESIZE
-                + '--nodes=%d ' % 1
-                + '--time=%d ' % PAR.WALLTIME
-                + findpath('seisflows.system') +'/'+ 'wrappers/submit '
-                + PATH.OUTPUT)
-
-
-    def mpiexec(self):
+    def mpiexec(self, nproc=None):
         """ Specifies MPI exectuable; used to invoke solver
         """
-        return 'mpirun -np %d ' % PAR.NPROC
+        if nproc is None:
+            nproc = PAR.NPROC
+        return 'mpirun -np %d ' % nproc
 
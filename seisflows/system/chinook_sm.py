@@ -9,6 +9,7 @@ from os.path import abspath, basename, join
 from seisflows.tools import unix
 from seisflows.tools.tools import call, findpath, saveobj
 from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import planner, scheduler
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
@@ -17,6 +18,10 @@ PATH = sys.modules['seisflows_paths']
 class chinook_sm(custom_import('system', 'slurm_sm')):
     """ System interface for University of Alaska Fairbanks CHINOOK
 
+      If a list of PARTITIONS is given, the job goes to whichever of them
+      'sbatch --test-only' expects to start it first, rather than to PARTITION.
+      A partition named in SLURMARGS takes precedence over both.
+
       For important additional information, please see 
       http://seisflows.readthedocs.org/en/latest/manual/manual.html#system-configuration
     """
@@ -53,10 +58,17 @@ class chinook_sm(custom_import('system', 'slurm_sm')):
         if 'PARTITION' not in PAR:
             setattr(PAR, 'PARTITION', 't1small')
 
+        # optional list of candidate partitions
+        if 'PARTITIONS' not in PAR:
+            setattr(PAR, 'PARTITIONS', [])
+
         # optional environment variable list VAR1=val1,VAR2=val2,...
         if 'ENVIRONS' not in PAR:
             setattr(PAR, 'ENVIRONS', '')
 
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
         # level of detail in output messages
         if 'VERBOSE' not in PAR:
             setattr(PAR, 'VERBOSE', 1)
@@ -93,14 +105,31 @@ class chinook_sm(custom_import('system', 'slurm_sm')):
         workflow.checkpoint()
 
         # prepare sbatch arguments
-        call('sbatch '
-                + '%s ' % PAR.SLURMARGS
-                + '--partition=%s ' % PAR.PARTITION
+        args = ('%s ' % PAR.SLURMARGS
                 + '--job-name=%s ' % PAR.TITLE
                 + '--output %s ' % (PATH.WORKDIR+'/'+'output.log')
                 + '--cpus-per-task=%d '%PAR.NPROC
                 + '--ntasks=%d '%PAR.NTASK
-                + '--time=%d ' % PAR.WALLTIME
+                + '--time=%d ' % PAR.WALLTIME)
+
+        if planner.given(PAR.SLURMARGS):
+            # partition named in SLURMARGS takes precedence
+            pass
+        elif PAR.PARTITIONS:
+            args += '--partition=%s ' % planner.earliest(self.client(),
+                PAR.PARTITIONS, args)
+        else:
+            args += '--partition=%s ' % PAR.PARTITION
+
+        jobid = self.client().submit('sbatch '
+                + args
                 + findpath('seisflows.system') +'/'+ 'wrappers/submit '
                 + PATH.OUTPUT)
 
+        print('Submitted batch job %s' % jobid)
+
+
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
@@ -1,9 +1,14 @@
 
+import math
+import os
+import sys
+
 from os.path import abspath, basename, join
 
 from seisflows.tools import unix
-from seisflows.config import custom_import
-from seisflows.config import ParameterError, 
+from seisflows.tools.tools import findpath
+from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import accounting, arrays, logs, scheduler
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
@@ -16,6 +21,9 @@ class copper_lg(custom_import('system', 'pbs_lg')):
       classes provide a consistent command set across different computing
       environments.
 
+      Task sets larger than the server's max_array_size, or MAXARRAYSIZE if
+      given, are submitted as several concurrent sub-arrays and polled as one.
+
       For more informations, see 
       http://seisflows.readthedocs.org/en/latest/manual/manual.html#system-interfaces
     """
@@ -36,6 +44,24 @@ class copper_lg(custom_import('system', 'pbs_lg')):
         if 'PBS_ARGS' not in PAR:
             setattr(PAR, 'PBS_ARGS', '-A ERDCH38424KSC -q standard ')
 
+        # how task output is written: 'files', 'stage' or 'node'
+        if 'LOGMODE' not in PAR:
+            setattr(PAR, 'LOGMODE', 'files')
+
+        # whether aggregated task logs are compressed
+        if 'LOGCOMPRESS' not in PAR:
+            setattr(PAR, 'LOGCOMPRESS', False)
+
+        # optional limit on job array size; by default read from PBS server
+        if 'MAXARRAYSIZE' not in PAR:
+            setattr(PAR, 'MAXARRAYSIZE', None)
+
+        # whether to record utilization of each stage
+        accounting.check(PAR)
+
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
         super(copper_lg, self).check()
 
 
@@ -43,67 +69,131 @@ class copper_lg(custom_import('system', 'pbs_lg')):
         return 'aprun -n %d' % 1
 
 
+    def run(self, classname, method, hosts='all', **kwargs):
+        """ Executes the following task:
+              classname.method(*args, **kwargs)
+        """
+        # each task holds the nodes selected in job_array_cmd
+        cores = int(math.ceil(PAR.NTASK/float(PAR.NODESIZE)))*PAR.NODESIZE
+        stage = accounting.start(classname, method, hosts,
+            accounting.iteration(), PAR.NTASK if hosts == 'all' else 1, cores)
+
+        super(copper_lg, self).run(classname, method, hosts, **kwargs)
+
+        if PAR.ACCOUNTING:
+            try:
+                tasks = accounting.qstat(self.client(), list(stage['jobs']),
+                    '/opt/pbs/12.1.1.131502/bin/qstat')
+                accounting.save(PATH.SUBMIT+'/'+'output.accounting',
+                    accounting.finish(stage, tasks))
+            except Exception as e:
+                print(' accounting failed: %s' % e)
+
+
     def _launch(self, classname, method, hosts='all'):
         unix.mkdir(PATH.SYSTEM)
 
+        if hosts != 'all' or PAR.NTASK == 1:
+            job = self.client().submit(
+                self.job_array_cmd(classname, method, hosts))
+            accounting.submitted([job])
+            return [job]
+
+        # submit job, split into sub-arrays if too large
+        jobs = []
+        maxsize = PAR.MAXARRAYSIZE or arrays.pbs_limit(self.client(),
+            '/opt/pbs/12.1.1.131502/bin/qmgr')
+        for offset, count in arrays.split(PAR.NTASK, maxsize):
+            job = self.client().submit(
+                self.job_array_cmd(classname, method, hosts, offset, count))
+
+            # take number[].sdb and replace with number[str(ii)]].sdb
+            jobMain = job.split('[',1)[0]
+            jobs += [jobMain+'['+str(ii)+'].sdb' for ii in range(count)]
+        accounting.submitted(jobs)
+        return jobs
+
+
+    def job_array_cmd(self, classname, method, hosts, offset=0, count=None):
         nodes = math.ceil(PAR.NTASK/float(PAR.NODESIZE))
         cores = PAR.NTASK%PAR.NODESIZE
         hours = PAR.STEPTIME/60
         minutes = PAR.STEPTIME%60
         walltime = 'walltime=%02d:%02d:00 '%(hours, minutes)
 
-        # submit job
-        with open(PATH.SYSTEM+'/'+'job_id', 'w') as f:
-            args = ('/opt/pbs/12.1.1.131502/bin/qsub '
+        count = count or PAR.NTASK
+        args = ''
+        if offset:
+            args = '-v %s=%d ' % (arrays.OFFSET, offset)
+
+        return ('/opt/pbs/12.1.1.131502/bin/qsub '
                 + PAR.PBS_ARGS + ' '
-                + '-l select=%d:ncpus=%d:mpiprocs=%d ' (nodes,PAR.NODESIZE,cores)
+                + '-l select=%d:ncpus=%d:mpiprocs=%d ' % (nodes,PAR.NODESIZE,cores)
                 + '-l %s ' % walltime
-                + '-J 0-%s ' % (PAR.NTASK-1)
+                + '-J 0-%s ' % (count-1)
                 + '-N %s ' % PAR.TITLE
-                + '-o %s ' % (PATH.SUBMIT+'/'+'output.pbs/' + '$PBS_ARRAYID')
+                + '-o %s ' % self.task_output('$PBS_ARRAYID')
                 + '-r y '
                 + '-j oe '
                 + '-V '
-                + self.launch_args(hosts)
+                + args
+                + self.task_cmd(classname, method, hosts))
+
+
+    def taskid(self):
+        """ Provides a unique identifier for each running task
+        """
+        return arrays.taskid(os.getenv('PBS_ARRAY_INDEX'))
+
+
+
+    def task_cmd(self, classname, method, hosts):
+        """ Returns command executed by each task
+        """
+        cmd = (self.launch_args(hosts)
                 + PATH.OUTPUT + ' '
                 + classname + ' '
                 + method + ' '
                 + findpath('seisflows'))
 
-            # print(args)
-            subprocess.call(args, shell=1, stdout=f)
+        if PAR.LOGMODE == 'files':
+            return cmd
 
-        # print("made it here to job id")
-        # retrieve job ids
-        with open(PATH.SYSTEM+'/'+'job_id', 'r') as f:
-            line = f.readline()
-            job = line.split()[-1].strip()
-        if hosts == 'all' and PAR.NTASK > 1:
-            nn = range(PAR.NTASK)
-            # take number[].sdb and replace with number[str(ii)]].sdb
-            jobMain = job.split('[',1)[0]
-            # print(jobMain)
-            return [jobMain+'['+str(ii)+'].sdb' for ii in nn]
-        else:
-            return [job]
+        # output is piped through aggregated logger, which takes the task ID
+        # from PBS_ARRAY_INDEX at runtime
+        logfile = logs.logfile(PATH.SUBMIT+'/'+'output.logs',
+            classname, method, PAR.LOGMODE, PAR.LOGCOMPRESS)
 
+        cmd = cmd.strip()
+        if cmd.startswith('--'):
+            cmd = cmd[2:].strip()
+        return '-- ' + logs.wrap(logfile, cmd, compress=PAR.LOGCOMPRESS)
+
+
+    def task_output(self, pattern):
+        """ Returns scheduler output file for a task
+        """
+        if PAR.LOGMODE == 'files':
+            return PATH.SUBMIT+'/'+'output.pbs/'+pattern
+        else:
+            return '/dev/null'
 
 
     def _query(self, jobid):
         """ Queries job state from PBS database
         """
-        with open(PATH.SYSTEM+'/'+'job_status', 'w') as f:
-            subprocess.call('/opt/pbs/12.1.1.131502/bin/qstat -x -tJ '  
-                + jobid + ' | '
-                + 'tail -n 1 ' + ' | '
-                + 'awk \'{print $5}\'', 
-                shell=True, 
-                stdout=f)
+        output = self.client().call('/opt/pbs/12.1.1.131502/bin/qstat -x -tJ '
+                + jobid)
 
+        # state is in fifth column of last line
+        lines = output.splitlines()
+        if lines and len(lines[-1].split()) > 4:
+            return lines[-1].split()[4]
+        return ''
 
-        with open(PATH.SYSTEM+'/'+'job_status', 'r') as f:
-            line = f.readline()
-            state = line.strip()
 
-        return state
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
 
@@ -1,8 +1,13 @@
 
+import sys
+
 from getpass import getuser
 from os.path import abspath, basename, join
 
-from seisflows.config import ParameterError, , custom_import
+from seisflows.tools import unix
+from seisflows.tools.tools import findpath
+from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import accounting, scheduler
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
@@ -42,9 +47,60 @@ class icex_lg(custom_import('system', 'lsf_lg')):
         if 'LSF_ARGS' not in PAR:
             setattr(PAR, 'LSF_ARGS', '-a intelmpi -q LAURE_USERS')
 
+        # whether to record utilization of each stage
+        accounting.check(PAR)
+
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
         super(icex_lg, self).check()
 
 
+    def run(self, classname, method, hosts='all', **kwargs):
+        """ Executes the following task:
+              classname.method(*args, **kwargs)
+        """
+        stage = accounting.start(classname, method, hosts,
+            accounting.iteration(), PAR.NTASK if hosts == 'all' else 1,
+            PAR.NPROC)
+
+        super(icex_lg, self).run(classname, method, hosts, **kwargs)
+
+        if PAR.ACCOUNTING:
+            try:
+                tasks = accounting.bjobs(self.client(), list(stage['jobs']))
+                accounting.save(PATH.SUBMIT+'/'+'output.accounting',
+                    accounting.finish(stage, tasks))
+            except Exception as e:
+                print(' accounting failed: %s' % e)
+
+
+    def _launch(self, classname, method, hosts='all'):
+        """ Submits job array through scheduler client and returns ID of each
+          task
+        """
+        unix.mkdir(PATH.SYSTEM)
+
+        job = self.client().submit('bsub '
+                + '%s ' % PAR.LSF_ARGS
+                + '-n %d ' % PAR.NPROC
+                + '-R "span[ptile=%d]" ' % PAR.NODESIZE
+                + '-W %d:00 ' % PAR.STEPTIME
+                + '-J "%s' % PAR.TITLE
+                + self.launch_args(hosts)
+                + findpath('seisflows.system') +'/'+ 'wrappers/run '
+                + PATH.OUTPUT + ' '
+                + classname + ' '
+                + method + ' ')
+
+        if hosts == 'all':
+            jobs = [job+'['+str(ii+1)+']' for ii in range(PAR.NTASK)]
+        else:
+            jobs = [job]
+        accounting.submitted(jobs)
+        return jobs
+
+
     def mpiargs(self):
         #return 'mpirun '
         #return ('/apps/lsf/cluster_ICEX/8.3/linux2.6-glibc2.3-x86_64/bin/mpirun.lsf '
@@ -56,3 +112,7 @@ class icex_lg(custom_import('system', 'lsf_lg')):
                 + ' "-n %s " ' % PAR.NPROC )
 
 
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
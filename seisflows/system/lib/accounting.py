@@ -0,0 +1,378 @@
+
+""" Accounting of allocated versus used core-hours per stage
+
+  For each call to system.run -- a stage, identified by classname.method --
+  the master records when the stage started and finished, which jobs were
+  submitted for it and how many cores (and GPUs) each task held. Once the
+  stage completes, the start and end of each task are taken from the
+  scheduler (sacct, qstat or bjobs) or, where tasks run inside the master's
+  own allocation, from timestamps written around each task. From these the
+  following are derived:
+
+    charged   core-hours the allocation is billed for: the whole allocation
+              for the length of the stage if tasks run inside the master's
+              allocation, otherwise the run time of every task job
+    busy      core-hours spent running tasks that succeeded
+    retry     core-hours spent on attempts that failed and were retried
+    queue     mean and longest wait between submission and task start
+    straggle  time between the median and the last task finishing
+    poll      time between the last task finishing and the master noticing
+
+  Each stage is appended as one JSON line to stages.jsonl, and a plain text
+  report of all stages of the current iteration is rewritten alongside it.
+  Where tasks are timed as they run, each is run through a short shell
+  script (STAMP) that takes timestamps with date, rather than through a
+  further Python interpreter.
+
+  Reports can also be regenerated later:
+      python -m seisflows.system.lib.accounting report DIR
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from glob import glob
+from os.path import exists, join
+
+
+# file to which stage records are appended
+STAGES = 'stages.jsonl'
+
+# states counted as successful
+SUCCESS = ['COMPLETED', 'DONE']
+
+_current = [None]
+
+# shell script through which tasks are timed; takes directory to which the
+# timing is written, followed by the task command
+STAMP = '''dir=$1
+shift
+start=$(date +%s.%N)
+"$@"
+status=$?
+end=$(date +%s.%N)
+file=$dir/${SEISFLOWS_TASK_ID:-0}.$$
+echo "${SEISFLOWS_TASK_ID:-0} $status $start $end" > $file.tmp
+mv $file.tmp $file.txt
+exit $status
+'''
+
+
+def check(par):
+    """ Sets defaults of accounting parameters
+    """
+    # whether to record utilization of each stage
+    if 'ACCOUNTING' not in par:
+        setattr(par, 'ACCOUNTING', False)
+
+
+def start(classname, method, hosts, iteration=None, ntask=1, cores=1, gpus=0,
+          allocation=None, held=None):
+    """ Starts record of a stage
+
+      ALLOCATION is the number of cores held by the master's own allocation,
+      if tasks run inside it rather than as jobs of their own. HELD is the
+      number of cores charged for each task, if tasks hold more than the
+      CORES they use, e.g. whole nodes.
+    """
+    stage = {
+        'iteration': iteration,
+        'stage': classname+'.'+method,
+        'hosts': hosts,
+        'ntask': ntask,
+        'cores': cores,
+        'gpus': gpus,
+        'allocation': allocation,
+        'held': held,
+        'submitted': time.time(),
+        'jobs': {},
+        'tasks': []}
+    _current[0] = stage
+    return stage
+
+
+def submitted(jobids, taskids=None):
+    """ Records jobs submitted for the current stage
+    """
+    stage = _current[0]
+    if stage is None:
+        return
+    if taskids is None:
+        taskids = range(len(jobids))
+    for jobid, taskid in zip(jobids, taskids):
+        stage['jobs'][str(jobid)] = [taskid, time.time()]
+
+
+def finish(stage, tasks):
+    """ Completes record of a stage from the given task timings
+
+      TASKS is a list of dicts with 'jobid' or 'taskid', 'state', 'start' and
+      'end' entries, one per attempt, as returned by sacct, qstat, bjobs or
+      stamps below.
+    """
+    stage['completed'] = time.time()
+    for task in tasks:
+        if task.get('jobid') in stage['jobs']:
+            task['taskid'], task['submitted'] = stage['jobs'][task['jobid']]
+        task.setdefault('submitted', stage['submitted'])
+    stage['tasks'] = [task for task in tasks
+                      if task.get('start') and task.get('end')]
+    stage.update(summarize(stage))
+    _current[0] = None
+    return stage
+
+
+def summarize(stage):
+    """ Derives charged, busy and idle time of a stage
+    """
+    tasks = stage['tasks']
+    wall = stage['completed'] - stage['submitted']
+
+    ok = [t for t in tasks if t['state'] in SUCCESS]
+    failed = [t for t in tasks if t['state'] not in SUCCESS]
+    elapsed = lambda t: max(0., t['end'] - t['start'])
+
+    held = stage.get('held') or stage['cores']
+
+    busy = sum(elapsed(t) for t in ok) * stage['cores']
+    retry = sum(elapsed(t) for t in failed) * held
+    if stage['allocation']:
+        charged = stage['allocation'] * wall
+    else:
+        charged = sum(elapsed(t) for t in tasks) * held
+
+    waits = [max(0., t['start'] - t['submitted']) for t in tasks]
+    ends = sorted(t['end'] for t in tasks)
+
+    return {
+        'wall': wall,
+        'charged': charged/3600.,
+        'busy': busy/3600.,
+        'retry': retry/3600.,
+        'gpu_charged': charged/3600. * stage['gpus']/float(held or 1),
+        'efficiency': busy/charged if charged else None,
+        'queue_mean': sum(waits)/len(waits) if waits else 0.,
+        'queue_max': max(waits) if waits else 0.,
+        'straggle': ends[-1] - ends[len(ends)//2] if ends else 0.,
+        'poll': stage['completed'] - ends[-1] if ends else 0.,
+        'retries': len(failed)}
+
+
+def save(path, stage):
+    """ Appends stage record and rewrites report of its iteration
+    """
+    _mkdir(path)
+    with open(join(path, STAGES), 'a') as f:
+        f.write(json.dumps(stage) + '\n')
+    write_report(path, stage['iteration'])
+
+
+def load(path):
+    """ Reads all stage records
+    """
+    stages = []
+    if exists(join(path, STAGES)):
+        with open(join(path, STAGES)) as f:
+            for line in f:
+                if line.strip():
+                    stages += [json.loads(line)]
+    return stages
+
+
+def write_report(path, iteration):
+    """ Writes report of all stages of an iteration
+    """
+    stages = [s for s in load(path) if s['iteration'] == iteration]
+    if iteration is None:
+        filename = join(path, 'report.txt')
+    else:
+        filename = join(path, 'report_%04d.txt' % iteration)
+    with open(filename, 'w') as f:
+        f.write(report(stages, iteration))
+
+
+def report(stages, iteration=None):
+    """ Formats stage records as a table
+    """
+    header = ('%-32s %5s %7s %9s %9s %9s %5s %8s %8s %8s %8s %7s %8s\n'
+              % ('stage', 'tasks', 'cores', 'wall(s)', 'charged', 'busy',
+                 'eff', 'queue', 'qmax', 'straggle', 'poll', 'retries',
+                 'retry'))
+    lines = []
+    if iteration is not None:
+        lines += ['Utilization, iteration %d\n\n' % iteration]
+    lines += [header]
+
+    total = dict(wall=0., charged=0., busy=0., retry=0., retries=0)
+    for s in stages:
+        lines += ['%-32s %5d %7d %9.1f %9.2f %9.2f %5s %8.1f %8.1f %8.1f %8.1f %7d %8.2f\n'
+            % (s['stage'], s['ntask'], s['cores'], s['wall'], s['charged'],
+               s['busy'], _percent(s['efficiency']), s['queue_mean'],
+               s['queue_max'], s['straggle'], s['poll'], s['retries'],
+               s['retry'])]
+        for key in total:
+            total[key] += s[key]
+
+    lines += ['%-32s %5s %7s %9.1f %9.2f %9.2f %5s %8s %8s %8s %8s %7d %8.2f\n'
+        % ('total', '', '', total['wall'], total['charged'], total['busy'],
+           _percent(total['busy']/total['charged'] if total['charged'] else None),
+           '', '', '', '', total['retries'], total['retry'])]
+    lines += ['\ncharged, busy and retry in core-hours; times in seconds\n']
+    return ''.join(lines)
+
+
+def sacct(client, jobids):
+    """ Returns task timings from SLURM accounting
+    """
+    if not jobids:
+        return []
+    arrays = sorted(set(str(jobid).split('_')[0] for jobid in jobids))
+    output = client.call('sacct -n -P -o JobID,State,Start,End -j '
+                         + ','.join(arrays))
+    tasks = []
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) < 4 or '.' in fields[0]:
+            continue
+        tasks += [{
+            'jobid': fields[0],
+            'state': fields[1].split()[0] if fields[1] else '',
+            'start': _epoch(fields[2], '%Y-%m-%dT%H:%M:%S'),
+            'end': _epoch(fields[3], '%Y-%m-%dT%H:%M:%S')}]
+    return tasks
+
+
+def qstat(client, jobids, cmd='qstat'):
+    """ Returns task timings from PBS history
+    """
+    arrays = sorted(set(re.sub(r'\[\d+\]', '[]', str(jobid)) for jobid in jobids))
+    tasks = []
+    for array in arrays:
+        output = client.call('%s -x -f -t %s' % (cmd, array))
+        for block in output.split('Job Id:')[1:]:
+            lines = block.splitlines()
+            fields = dict(line.strip().split(' = ', 1)
+                          for line in lines[1:] if ' = ' in line)
+            start = _epoch(fields.get('stime', ''), '%a %b %d %H:%M:%S %Y')
+            used = _seconds(fields.get('resources_used.walltime', ''))
+            if start is None or used is None or '[]' in lines[0]:
+                continue
+            tasks += [{
+                'jobid': lines[0].strip(),
+                'state': 'COMPLETED' if fields.get('Exit_status') == '0'
+                         else 'FAILED',
+                'start': start,
+                'end': start + used}]
+    return tasks
+
+
+def bjobs(client, jobids, cmd='bjobs'):
+    """ Returns task timings from LSF
+    """
+    arrays = sorted(set(re.match(r'\d*', str(jobid)).group()
+                        for jobid in jobids) - set(['']))
+    tasks = []
+    for array in arrays:
+        output = client.call('%s -a -W -noheader %s' % (cmd, array))
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 15:
+                continue
+            match = re.search(r'\[(\d+)\]$', fields[6])
+            index = int(match.group(1)) if match else 1
+            task = {
+                'jobid': '%s[%d]' % (fields[0], index) if match else fields[0],
+                'taskid': index-1,
+                'state': fields[2],
+                'start': _epoch(fields[-2], '%m/%d-%H:%M:%S', year=True),
+                'end': _epoch(fields[-1], '%m/%d-%H:%M:%S', year=True)}
+            tasks += [task]
+    return tasks
+
+
+def stamps(directory):
+    """ Returns task timings written through stamp_cmd
+    """
+    tasks = []
+    for filename in glob(join(directory, '*.txt')):
+        with open(filename) as f:
+            fields = f.read().split()
+        if len(fields) != 4:
+            continue
+        taskid, status, start, end = fields
+        tasks += [{
+            'taskid': int(taskid),
+            'state': 'COMPLETED' if status == '0' else 'FAILED',
+            'start': float(start),
+            'end': float(end)}]
+    return tasks
+
+
+def stamp_cmd(directory):
+    """ Returns prefix that runs a task command through STAMP, writing its
+      timing to directory
+    """
+    _mkdir(directory)
+    script = join(directory, 'stamp.sh')
+    with open(script, 'w') as f:
+        f.write(STAMP)
+    return 'sh %s %s ' % (script, directory)
+
+
+def iteration():
+    """ Returns current iteration of workflow, if it has one
+    """
+    return getattr(sys.modules.get('seisflows_optimize'), 'iter', None)
+
+
+def _epoch(string, fmt, year=False):
+    """ Converts local time string to seconds since the epoch
+    """
+    string = string.strip()
+    try:
+        if year:
+            string = '%d/%s' % (time.localtime().tm_year, string)
+            fmt = '%Y/' + fmt
+        return time.mktime(time.strptime(string, fmt))
+    except ValueError:
+        return None
+
+
+def _seconds(string):
+    try:
+        hours, minutes, seconds = string.split(':')
+        return int(hours)*3600 + int(minutes)*60 + int(seconds)
+    except ValueError:
+        return None
+
+
+def _percent(fraction):
+    if fraction is None:
+        return '-'
+    return '%d%%' % round(100*fraction)
+
+
+def _mkdir(path):
+    if not exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.accounting')
+    subparsers = parser.add_subparsers(dest='action')
+
+    p = subparsers.add_parser('report', help='rewrite reports from records')
+    p.add_argument('path')
+
+    args = parser.parse_args()
+    if args.action == 'report':
+        for it in sorted(set(s['iteration'] for s in load(args.path)),
+                         key=lambda it: -1 if it is None else it):
+            write_report(args.path, it)
@@ -0,0 +1,75 @@
+
+""" Splitting of job arrays larger than the scheduler allows
+
+  SLURM (MaxArraySize) and PBS (max_array_size) cap the size of a single job
+  array. Larger task sets are submitted as several sub-arrays of about equal
+  size, all running at once. Each sub-array numbers its tasks from zero and
+  is told its offset through an environment variable, from which the global
+  task ID is recovered. The IDs of all sub-array tasks, in global task order,
+  are returned to the caller, which polls them as one logical job array.
+"""
+
+import os
+import re
+
+from math import ceil
+
+
+# environment variable holding offset of sub-array within whole task set
+OFFSET = 'SEISFLOWS_TASKID_OFFSET'
+
+# global task ID of a SLURM array task, expanded by the shell at runtime
+SLURM_TASKID = '$((SLURM_ARRAY_TASK_ID+${%s:-0}))' % OFFSET
+
+# limits assumed if the site configuration cannot be read
+SLURM_DEFAULT = 1001
+PBS_DEFAULT = 10000
+
+# seconds for which site limits are reused
+TTL = 3600.
+
+
+def split(ntask, maxsize):
+    """ Returns (offset, count) of each sub-array needed for NTASK tasks
+    """
+    nchunk = int(ceil(ntask/float(maxsize))) or 1
+    chunks = []
+    offset = 0
+    for ichunk in range(nchunk):
+        count = (ntask - offset)//(nchunk - ichunk)
+        chunks += [(offset, count)]
+        offset += count
+    return chunks
+
+
+def taskid(index):
+    """ Returns global task ID of task with given index within its sub-array
+    """
+    return int(index) + int(os.getenv(OFFSET) or 0)
+
+
+def slurm_limit(client):
+    """ Returns largest number of tasks in a SLURM job array
+    """
+    try:
+        output = client.cached('scontrol show config', TTL)
+    except Exception:
+        return SLURM_DEFAULT
+    match = re.search(r'^\s*MaxArraySize\s*=\s*(\d+)', output, re.M)
+    if not match:
+        return SLURM_DEFAULT
+    # array indices run from 0 to MaxArraySize-1
+    return int(match.group(1))
+
+
+def pbs_limit(client, qmgr='qmgr'):
+    """ Returns largest number of tasks in a PBS job array
+    """
+    try:
+        output = client.cached('%s -c "print server"' % qmgr, TTL)
+    except Exception:
+        return PBS_DEFAULT
+    match = re.search(r'max_array_size\s*=\s*(\d+)', output)
+    if not match:
+        return PBS_DEFAULT
+    return int(match.group(1))
@@ -0,0 +1,325 @@
+
+""" Background cleanup of scratch directories
+
+  Two kinds of directories accumulate on scratch filesystems over the course
+  of many workflows:
+
+    - per-iteration directories at the top of a workflow's scratch path,
+      named with a four-digit iteration number, e.g. 'kernels_0003'
+
+    - whole scratch trees named by UUID, e.g. /scratch/gpfs/<user>/seisflows/
+      <uuid>, left behind when a workflow is submitted again from the same
+      working directory, which is then linked to a new tree
+
+  A cleaner thread running alongside the workflow keeps only the most recent
+  iterations and removes orphaned UUID trees, deleting subtrees in parallel.
+
+  Since other workflows' trees may still be in use, a tree is only deleted on
+  positive evidence that it is not. It must carry an owner file naming its
+  working directory and the job of its master, its working directory must be
+  readable and link to a different tree, its master job must no longer be
+  known to the scheduler, and its owner file must not have been updated for
+  MINAGE seconds. Unmarked trees are never touched, and nor are trees whose
+  working directory cannot be read, for example because it is not mounted.
+
+  If free space falls below a threshold, the cleaner sweeps more often and
+  keeps only the latest iteration. Free space is that of the filesystem as a
+  whole, as reported by statvfs; per-user quotas are not checked.
+"""
+
+import errno
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from getpass import getuser
+from multiprocessing.pool import ThreadPool
+from os.path import basename, dirname, exists, getmtime, isdir, islink, join, \
+    realpath
+
+
+# name of file recording which working directory a scratch tree belongs to
+OWNER = '.seisflows_owner'
+
+# prefix given to directories while they are being deleted
+TRASH = '.trash.'
+
+# number of subtrees deleted concurrently
+NTHREADS = 16
+
+# seconds for which an orphaned tree's owner file must go unchanged
+MINAGE = 7*86400.
+
+UUID = re.compile('^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+ITERATION = re.compile('^(.*[^0-9])([0-9]{4})$')
+
+
+def mark(scratch, workdir, jobid=None):
+    """ Records working directory and master job that own scratch tree
+
+      Called at submission and again whenever the master job changes; the
+      created time of an existing owner file is kept.
+    """
+    data = {'workdir': workdir, 'created': time.time(), 'jobid': jobid}
+    data['created'] = _owner(scratch).get('created', data['created'])
+    tmpfile = join(scratch, OWNER + '.%d.tmp' % os.getpid())
+    with open(tmpfile, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmpfile, join(scratch, OWNER))
+
+
+def heartbeat(scratch):
+    """ Marks scratch tree as still in use
+    """
+    try:
+        os.utime(join(scratch, OWNER), None)
+    except OSError:
+        pass
+
+
+def owner(tree):
+    """ Returns working directory that owns scratch tree, or None if unmarked
+    """
+    return _owner(tree).get('workdir')
+
+
+def link(scratch, workdir):
+    """ Points WORKDIR/scratch at scratch tree, replacing any link to an
+      earlier tree
+    """
+    name = join(workdir, 'scratch')
+    if exists(name) and not islink(name):
+        # a real directory; leave it alone
+        return
+    if islink(name) and realpath(name) == realpath(scratch):
+        return
+    tmpname = name + '.%d.tmp' % os.getpid()
+    os.symlink(scratch, tmpname)
+    os.rename(tmpname, name)
+
+
+def active(client):
+    """ Returns IDs of the user's jobs known to the scheduler, or None if they
+      cannot be listed
+    """
+    try:
+        output = client.call('squeue -h -u %s -o %%A' % getuser())
+    except Exception:
+        return None
+    return set(output.split())
+
+
+def orphans(scratch, jobs, minage=MINAGE):
+    """ Lists orphaned UUID trees next to the given scratch tree
+
+      JOBS is the set of job IDs known to the scheduler, as returned by
+      active. If it is None, nothing is known to be orphaned.
+    """
+    scratch = realpath(scratch)
+    root = dirname(scratch)
+    if not UUID.match(basename(scratch)) or jobs is None:
+        return []
+
+    trees = []
+    for name in os.listdir(root):
+        tree = join(root, name)
+        if tree == scratch or not UUID.match(name) or islink(tree):
+            continue
+        data = _owner(tree)
+        if 'workdir' not in data:
+            continue
+        if data.get('jobid') and str(data['jobid']) in jobs:
+            continue
+        try:
+            age = time.time() - getmtime(join(tree, OWNER))
+            target = os.readlink(join(data['workdir'], 'scratch'))
+        except OSError:
+            # working directory missing or unreadable; no evidence either way
+            continue
+        if age < minage:
+            continue
+        if realpath(join(data['workdir'], target)) != tree:
+            trees += [tree]
+    return trees
+
+
+def stale_iterations(scratch, retain, depth=1):
+    """ Lists iteration directories other than the latest RETAIN of each kind
+    """
+    stale = []
+    groups = {}
+    for path in _subdirs(realpath(scratch), depth):
+        match = ITERATION.match(basename(path))
+        if match:
+            key = (dirname(path), match.group(1))
+            groups.setdefault(key, []).append((int(match.group(2)), path))
+
+    for paths in groups.values():
+        paths.sort()
+        stale += [path for _, path in paths[:-retain or None]]
+    return stale
+
+
+def leftovers(scratch):
+    """ Lists directories whose deletion was interrupted earlier
+    """
+    scratch = realpath(scratch)
+    paths = []
+    for path in [dirname(scratch)] + _subdirs(scratch, 2):
+        try:
+            names = os.listdir(path)
+        except OSError:
+            continue
+        paths += [join(path, name) for name in names if name.startswith(TRASH)]
+    return paths
+
+
+def remove(path, nthreads=NTHREADS):
+    """ Removes directory tree, deleting its subtrees in parallel
+
+      The tree is first renamed so that it disappears from view at once and,
+      if deletion is interrupted, is picked up again by the next sweep.
+    """
+    if not basename(path).startswith(TRASH):
+        trash = join(dirname(path), TRASH + basename(path))
+        try:
+            os.rename(path, trash)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        path = trash
+
+    # split tree into enough subtrees to keep all threads busy
+    subtrees = [path]
+    for _ in range(3):
+        if len(subtrees) >= 4*nthreads:
+            break
+        subtrees = sum([_children(p) for p in subtrees], [])
+
+    pool = ThreadPool(nthreads)
+    try:
+        pool.map(_rmtree, subtrees)
+    finally:
+        pool.close()
+        pool.join()
+    _rmtree(path)
+
+
+def freespace(path):
+    """ Returns fraction of space and inodes available on the filesystem
+      holding path, whichever is smaller
+
+      Only the filesystem as a whole is considered, not the user's quota.
+    """
+    st = os.statvfs(path)
+    fractions = [st.f_bavail/float(st.f_blocks or 1)]
+    if st.f_files:
+        fractions += [st.f_favail/float(st.f_files)]
+    return min(fractions)
+
+
+class Cleaner(threading.Thread):
+    """ Removes stale iterations and orphaned trees while a workflow runs
+    """
+    def __init__(self, scratch, retain=2, minfree=0.05, interval=600.,
+                 nthreads=NTHREADS, client=None, minage=MINAGE):
+        super(Cleaner, self).__init__()
+        self.daemon = True
+        self.scratch = scratch
+        self.retain = retain
+        self.minfree = minfree
+        self.interval = interval
+        self.nthreads = nthreads
+        self.client = client
+        self.minage = minage
+        self.stopped = threading.Event()
+
+
+    def run(self):
+        while not self.stopped.is_set():
+            low = self.sweep()
+            # check more often while space is short
+            self.stopped.wait(self.interval/10. if low else self.interval)
+
+
+    def sweep(self):
+        """ Removes stale directories; returns True if space remains short
+        """
+        heartbeat(self.scratch)
+        low = freespace(self.scratch) < self.minfree
+        retain = 1 if low else self.retain
+
+        targets = leftovers(self.scratch)
+        if self.client:
+            targets += orphans(self.scratch, active(self.client), self.minage)
+        if retain:
+            targets += stale_iterations(self.scratch, retain)
+
+        for target in targets:
+            try:
+                remove(target, self.nthreads)
+            except OSError as e:
+                print(' cleanup: could not remove %s (%s)' % (target, e))
+
+        if freespace(self.scratch) < self.minfree:
+            print(' cleanup: free space on filesystem of %s below %d%%'
+                  % (self.scratch, 100*self.minfree))
+            return True
+        return False
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+_cleaner = [None]
+
+def start(scratch, **kwargs):
+    """ Starts cleaner thread, unless already running in this process
+    """
+    if _cleaner[0] is None or not _cleaner[0].is_alive():
+        _cleaner[0] = Cleaner(scratch, **kwargs)
+        _cleaner[0].start()
+    return _cleaner[0]
+
+
+def _owner(tree):
+    try:
+        with open(join(tree, OWNER), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _subdirs(path, depth):
+    paths = []
+    if depth < 1:
+        return paths
+    for child in _children(path):
+        if isdir(child) and not islink(child) and \
+           not basename(child).startswith(TRASH):
+            paths += [child] + _subdirs(child, depth-1)
+    return paths
+
+
+def _children(path):
+    if isdir(path) and not islink(path):
+        try:
+            return [join(path, name) for name in os.listdir(path)]
+        except OSError:
+            return []
+    return [path]
+
+
+def _rmtree(path):
+    if isdir(path) and not islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
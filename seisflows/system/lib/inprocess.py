@@ -0,0 +1,61 @@
+
+""" Execution of lightweight tasks within the workflow master
+
+  Serial steps such as line search bookkeeping or model updates are normally
+  run as a separate task, which means starting a new interpreter, importing
+  seisflows and reloading the checkpoint, all to do a few seconds of work.
+  Tasks marked as cheap can instead be called directly in the master, where
+  all of this state is already loaded.
+
+  Tasks are selected by patterns of the form 'classname.method', in which
+  either part may contain shell-style wildcards, e.g. 'optimize.*'. Only
+  tasks that need neither MPI nor a compute node should be selected. Changes
+  such tasks make to objects in memory persist in the master, whereas those
+  made by a separate task would be discarded.
+"""
+
+import os
+import sys
+
+from fnmatch import fnmatch
+
+
+def check(par):
+    """ Sets defaults of in-process execution parameters
+    """
+    # tasks run within master rather than as separate tasks, given as
+    # 'classname.method' patterns; applies to hosts='head' only
+    if 'INPROCESS' not in par:
+        setattr(par, 'INPROCESS', [])
+
+
+def selected(classname, method, patterns):
+    """ Checks whether task matches any of the given patterns
+    """
+    name = classname+'.'+method
+    return any(fnmatch(name, pattern) for pattern in patterns or [])
+
+
+def run(classname, method, kwargs, taskid=0, environs=''):
+    """ Calls classname.method(**kwargs) with the environment seen by a task
+
+      The working directory and environment of the master are restored
+      afterwards, whether or not the task succeeds.
+    """
+    cwd = os.getcwd()
+    saved = dict(os.environ)
+    try:
+        os.environ['SEISFLOWS_TASK_ID'] = str(taskid)
+        for item in environs.strip(',').split(','):
+            if '=' in item:
+                key, val = item.split('=', 1)
+                os.environ[key] = val
+
+        func = getattr(sys.modules['seisflows_'+classname], method)
+        func(**kwargs)
+
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(saved)
+        sys.stdout.flush()
@@ -0,0 +1,250 @@
+
+""" Aggregated task logging
+
+  Rather than writing one output file per task, output from many tasks is
+  streamed into a shared per-stage or per-node log. Lines are prefixed with
+  the task ID, buffered in memory and appended in large chunks under an
+  advisory lock, so the number of files and metadata operations does not grow
+  with NTASK.
+
+  Next to each log, an index <log>.idx records the task ID, job ID and byte
+  range of every chunk, so that the output of a single task can be pulled out
+  without scanning the whole log. With compression enabled, each chunk is
+  written as a separate gzip member, so the log as a whole can still be read
+  with zcat.
+
+  Usage from the command line:
+      python -m seisflows.system.lib.logs run [--taskid N] [--compress] LOG -- CMD ...
+      python -m seisflows.system.lib.logs extract [--jobid ID] LOG [LOG ...] TASKID
+"""
+
+import argparse
+import errno
+import fcntl
+import os
+import socket
+import subprocess
+import sys
+import time
+import zlib
+
+from os.path import dirname
+
+from seisflows.system.lib import arrays
+
+
+# environment variables from which task and job identifiers are taken, in
+# order of precedence
+TASKID_VARS = ['SEISFLOWS_TASK_ID', 'TASKID', 'SLURM_ARRAY_TASK_ID',
+               'PBS_ARRAY_INDEX', 'PBS_ARRAYID', 'LSB_JOBINDEX']
+
+JOBID_VARS = ['SLURM_ARRAY_JOB_ID', 'SLURM_JOB_ID', 'PBS_JOBID', 'LSB_JOBID']
+
+# flush buffered output once this many bytes have accumulated...
+BUFSIZE = 1024*1024
+
+# ...or once this many seconds have passed since the last flush
+INTERVAL = 60.
+
+
+class TaskLog(object):
+    """ Buffered writer that appends task-ID-prefixed lines to a shared log
+    """
+    def __init__(self, filename, taskid, jobid=None, compress=False,
+                 bufsize=BUFSIZE, interval=INTERVAL):
+        self.filename = filename
+        self.taskid = str(taskid)
+        self.jobid = jobid or '-'
+        self.compress = compress
+        self.bufsize = bufsize
+        self.interval = interval
+
+        self.prefix = ('[%s] ' % self.taskid).encode()
+        self.buffer = []
+        self.nbytes = 0
+        self.flushed = time.time()
+
+
+    def write(self, line):
+        """ Adds a line of output to the buffer
+        """
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        self.buffer += [self.prefix + line]
+        self.nbytes += len(self.prefix) + len(line)
+
+        if self.nbytes >= self.bufsize or \
+           time.time() - self.flushed >= self.interval:
+            self.flush()
+
+
+    def flush(self):
+        """ Appends buffered output to log and records its location in index
+        """
+        self.flushed = time.time()
+        if not self.buffer:
+            return
+
+        data = b''.join(self.buffer)
+        if self.compress:
+            z = zlib.compressobj(6, zlib.DEFLATED, 31)
+            data = z.compress(data) + z.flush()
+
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            # POSIX record locks are honored across nodes by GPFS and Lustre
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            offset = os.lseek(fd, 0, os.SEEK_END)
+            _write(fd, data)
+            with open(self.filename+'.idx', 'a') as f:
+                f.write('%s %s %d %d\n' % (self.taskid, self.jobid, offset, len(data)))
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        self.buffer = []
+        self.nbytes = 0
+
+
+    def close(self):
+        self.flush()
+
+
+def run(filename, command, taskid=None, compress=False):
+    """ Runs command, streaming its output to a shared log
+
+      Returns the exit status of the command, so that the scheduler still sees
+      failed tasks as failed.
+    """
+    if taskid is None:
+        taskid = _getenv(TASKID_VARS, '0')
+        if _getenv(TASKID_VARS[:2]) is None:
+            # array index is relative to its sub-array if array was split
+            taskid = str(arrays.taskid(taskid))
+    jobid = _getenv(JOBID_VARS, '-')
+
+    filename = filename.replace('{host}', socket.gethostname().split('.')[0])
+    _mkdir(dirname(filename))
+
+    log = TaskLog(filename, taskid, jobid, compress)
+    proc = subprocess.Popen(command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    try:
+        for line in iter(proc.stdout.readline, b''):
+            log.write(line)
+    finally:
+        log.close()
+    return proc.wait()
+
+
+def extract(filenames, taskid, jobid=None):
+    """ Retrieves output of a single task from one or more logs
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    prefix = ('[%s] ' % taskid).encode()
+    lines = []
+    for filename in filenames:
+        with open(filename, 'rb') as log:
+            for entry in _index(filename):
+                if entry[0] != str(taskid):
+                    continue
+                if jobid and entry[1] != jobid:
+                    continue
+                log.seek(entry[2])
+                data = log.read(entry[3])
+                if filename.endswith('.gz'):
+                    data = zlib.decompress(data, 31)
+                lines += [line[len(prefix):] for line in data.splitlines(True)]
+    return b''.join(lines)
+
+
+def logfile(path, classname, method, mode='stage', compress=False):
+    """ Returns name of aggregated log for the given stage
+
+      In 'node' mode, the name contains a {host} placeholder that is filled in
+      by each task at runtime.
+    """
+    name = path+'/'+classname+'_'+method
+    if mode == 'node':
+        name += '.{host}'
+    name += '.log'
+    if compress:
+        name += '.gz'
+    return name
+
+
+def wrap(filename, cmd, taskid=None, compress=False):
+    """ Returns shell command that runs cmd with output sent to an aggregated log
+    """
+    args = sys.executable + ' -m seisflows.system.lib.logs run '
+    if taskid is not None:
+        args += '--taskid %s ' % taskid
+    if compress:
+        args += '--compress '
+    return args + filename + ' -- ' + cmd
+
+
+def _index(filename):
+    entries = []
+    with open(filename+'.idx', 'r') as f:
+        for line in f:
+            taskid, jobid, offset, length = line.split()
+            entries += [(taskid, jobid, int(offset), int(length))]
+    return entries
+
+
+def _write(fd, data):
+    while data:
+        n = os.write(fd, data)
+        data = data[n:]
+
+
+def _getenv(names, default=None):
+    for name in names:
+        if os.getenv(name):
+            return os.getenv(name)
+    return default
+
+
+def _mkdir(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.logs')
+    subparsers = parser.add_subparsers(dest='action')
+
+    p = subparsers.add_parser('run', help='run command and log its output')
+    p.add_argument('--taskid', default=None)
+    p.add_argument('--compress', action='store_true')
+    p.add_argument('filename')
+    p.add_argument('command', nargs=argparse.REMAINDER)
+
+    p = subparsers.add_parser('extract', help='print output of a single task')
+    p.add_argument('--jobid', default=None)
+    p.add_argument('filenames', nargs='+')
+    p.add_argument('taskid')
+
+    args = parser.parse_args(argv)
+
+    if args.action == 'run':
+        cmd = args.command
+        if cmd and cmd[0] == '--':
+            cmd = cmd[1:]
+        return run(args.filename, cmd, args.taskid, args.compress)
+
+    elif args.action == 'extract':
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        out.write(extract(args.filenames, args.taskid, args.jobid))
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
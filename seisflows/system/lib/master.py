@@ -0,0 +1,203 @@
+
+""" Lightweight workflow master
+
+  The workflow master spends nearly all of its time submitting task arrays and
+  polling their state, yet by default it is itself a batch job holding a
+  whole compute node. Instead it can run
+
+    - 'node': as a batch job on a whole node, as before
+    - 'core': as a batch job with a single core
+    - 'login': as a detached background process on the current (login or
+      service) node, at reduced priority
+
+  Where the master runs is recorded in PATH.OUTPUT, so that its progress can
+  be followed from any shell and a second master is not started by accident:
+      python -m seisflows.system.lib.master status DIR
+      python -m seisflows.system.lib.master attach DIR
+
+  Attaching follows the master's output until it exits; interrupting with
+  Ctrl-C detaches again without affecting the workflow.
+
+  If the scheduler or the master's host cannot be reached, whether the master
+  is running is unknown; a new master is then refused rather than risking two
+  masters of the same workflow.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from os.path import exists, join
+
+
+MODES = ['node', 'core', 'login']
+
+# file under PATH.OUTPUT recording where master runs
+STATE = 'master.json'
+
+# scheduling priority of masters started on login nodes
+NICE = 10
+
+# scheduler states of a master job that has not yet finished
+ACTIVE = ['PENDING', 'CONFIGURING', 'RUNNING', 'COMPLETING', 'SUSPENDED',
+          'REQUEUED', 'RESIZING', 'Q', 'R', 'H', 'E']
+
+# squeue output for a job already purged from the controller
+PURGED = 'Invalid job id'
+
+
+class UnknownError(Exception):
+    """ Raised when it cannot be told whether master is running
+    """
+    pass
+
+
+def launch(cmd, log, path, nice=NICE):
+    """ Starts master as a background process that outlives the current shell
+    """
+    with open(os.devnull, 'r') as stdin, open(log, 'a') as stdout:
+        proc = subprocess.Popen('exec nice -n %d %s' % (nice, cmd),
+            shell=True,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+            preexec_fn=os.setsid)
+
+    record(path, host=socket.gethostname(), pid=proc.pid, log=log)
+    return proc.pid
+
+
+def record(path, **state):
+    """ Records where master runs
+    """
+    state['started'] = time.time()
+    if not exists(path):
+        os.makedirs(path)
+    tmpfile = join(path, '.'+STATE)
+    with open(tmpfile, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmpfile, join(path, STATE))
+
+
+def state(path):
+    """ Returns where master runs, or None if no master was started
+    """
+    try:
+        with open(join(path, STATE)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def alive(path, client=None):
+    """ Checks whether master recorded in PATH.OUTPUT is still running;
+      raises UnknownError if the scheduler or master host cannot be queried
+    """
+    info = state(path)
+    if not info:
+        return False
+
+    if info.get('jobid'):
+        if client is None:
+            from seisflows.system.lib.scheduler import client
+            client = client()
+        try:
+            output = client.call('squeue -h -o %%T -j %s' % info['jobid'],
+                retries=0)
+        except Exception as e:
+            if PURGED in str(e):
+                return False
+            raise UnknownError('Cannot tell whether master job %s is running: %s'
+                % (info['jobid'], e))
+        return any(line.strip() in ACTIVE for line in output.splitlines())
+
+    if info.get('host') == socket.gethostname():
+        try:
+            # reap master if started by this very process
+            if os.waitpid(info['pid'], os.WNOHANG)[0]:
+                return False
+        except OSError:
+            pass
+        try:
+            os.kill(info['pid'], 0)
+        except OSError:
+            return False
+        return True
+
+    with open(os.devnull, 'w') as devnull:
+        status = subprocess.call('ssh %s kill -0 %d' % (info['host'], info['pid']),
+            shell=True, stdout=devnull, stderr=subprocess.STDOUT)
+    if status == 255:
+        # ssh itself failed
+        raise UnknownError('Cannot tell whether master process %d is running: '
+            'ssh to %s failed' % (info['pid'], info['host']))
+    return status == 0
+
+
+def attach(path, client=None, interval=2.):
+    """ Follows master output until master exits or Ctrl-C is pressed
+    """
+    info = state(path)
+    if not info:
+        print('No workflow master recorded in %s' % path)
+        return
+
+    offset = 0
+    try:
+        while True:
+            try:
+                running = alive(path, client)
+            except UnknownError:
+                # keep following until master is known to have exited
+                running = True
+            if exists(info['log']):
+                with open(info['log']) as f:
+                    f.seek(offset)
+                    data = f.read()
+                    offset = f.tell()
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            if not running:
+                print('Workflow master has exited')
+                return
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print('\nDetached; workflow master continues to run')
+
+
+def describe(path, client=None):
+    """ Returns one-line description of where master runs
+    """
+    info = state(path)
+    if not info:
+        return 'no workflow master recorded in %s' % path
+
+    if info.get('jobid'):
+        where = 'batch job %s' % info['jobid']
+    else:
+        where = 'process %d on %s' % (info['pid'], info['host'])
+
+    try:
+        running = alive(path, client)
+    except UnknownError as e:
+        return 'unknown (%s)' % e
+    if running:
+        return 'running as %s' % where
+    return 'exited (was %s)' % where
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.master')
+    parser.add_argument('action', choices=['status', 'attach'])
+    parser.add_argument('path', help='PATH.OUTPUT of workflow')
+    args = parser.parse_args()
+
+    if args.action == 'status':
+        print(describe(args.path))
+    elif args.action == 'attach':
+        attach(args.path)
@@ -0,0 +1,292 @@
+
+""" Live workflow metrics in Prometheus text format
+
+  The master keeps counters, gauges and histograms in memory -- task states of
+  the current stage, retries, polling and scheduler command latencies, free
+  scratch space -- and exposes them either
+
+    - over HTTP, at http://<master node>:<port>/metrics, for Prometheus to
+      scrape directly, or
+
+    - as a file rewritten every few seconds, for the node exporter's
+      textfile collector
+
+  The HTTP endpoint is unauthenticated, so it listens on the loopback
+  interface only, unless another address is given explicitly, e.g. that of
+  an interface reachable only from within the cluster.
+
+  Updating a metric costs a dictionary update under a lock, so metrics are
+  always collected; they are only rendered when scraped or written.
+"""
+
+import os
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+# address on which metrics are served unless another is given
+ADDRESS = '127.0.0.1'
+
+# upper bounds of histogram buckets, in seconds
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., 120., 300.]
+
+# seconds between rewrites of textfile
+INTERVAL = 15.
+
+# scheduler states of tasks, by category
+STATES = {
+    'queued': ['PENDING', 'CONFIGURING', 'REQUEUED', 'SUSPENDED', 'Q', 'H',
+               'W', 'PEND', 'PSUSP'],
+    'running': ['RUNNING', 'COMPLETING', 'R', 'E', 'B', 'RUN'],
+    'completed': ['COMPLETED', 'DONE', 'F', 'X'],
+    'failed': ['FAILED', 'NODE_FAIL', 'TIMEOUT', 'CANCELLED', 'OUT_OF_MEMORY',
+               'PREEMPTED', 'BOOT_FAIL', 'DEADLINE', 'EXIT']}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_help = {}
+_tasks = {}
+_scratch = [None]
+
+
+def inc(name, value=1., help='', **labels):
+    """ Increments counter
+    """
+    key = _key(name, labels)
+    with _lock:
+        _help.setdefault(name, ('counter', help))
+        _counters[key] = _counters.get(key, 0.) + value
+
+
+def gauge(name, value, help='', **labels):
+    """ Sets gauge
+    """
+    key = _key(name, labels)
+    with _lock:
+        _help.setdefault(name, ('gauge', help))
+        _gauges[key] = float(value)
+
+
+def observe(name, value, help='', **labels):
+    """ Adds observation to histogram
+    """
+    key = _key(name, labels)
+    with _lock:
+        _help.setdefault(name, ('histogram', help))
+        counts, total, n = _histograms.get(key, ([0]*len(BUCKETS), 0., 0))
+        counts = [c + (value <= b) for c, b in zip(counts, BUCKETS)]
+        _histograms[key] = (counts, total + value, n + 1)
+
+
+class timer(object):
+    """ Context manager observing elapsed time in a histogram
+    """
+    def __init__(self, name, help='', **labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        observe(self.name, time.time() - self.started, self.help, **self.labels)
+
+
+def stage(name, ntask):
+    """ Starts tracking task states of a new stage
+    """
+    with _lock:
+        _tasks.clear()
+        _tasks['stage'] = name
+        _tasks['ntask'] = ntask
+        _tasks['states'] = []
+    inc('seisflows_stages_total', help='Stages started', stage=name)
+
+
+def task_states(states):
+    """ Records latest scheduler state of each task of the current stage
+    """
+    with _lock:
+        if 'states' in _tasks:
+            _tasks['states'] = list(states)
+
+
+def category(state):
+    """ Returns 'queued', 'running', 'completed', 'failed' or 'unknown'
+    """
+    state = ''.join((state or '').split()[:1])
+    for name, states in STATES.items():
+        if state in states:
+            return name
+    return 'unknown'
+
+
+def render():
+    """ Returns all metrics in Prometheus text format
+    """
+    lines = []
+    with _lock:
+        _task_gauges()
+        _scratch_gauges()
+
+        for name in sorted(_help):
+            kind, help = _help[name]
+            lines += ['# HELP %s %s' % (name, help or name),
+                      '# TYPE %s %s' % (name, kind)]
+            if kind == 'counter':
+                lines += [_line(k, v) for k, v in sorted(_counters.items())
+                          if k[0] == name]
+            elif kind == 'gauge':
+                lines += [_line(k, v) for k, v in sorted(_gauges.items())
+                          if k[0] == name]
+            elif kind == 'histogram':
+                for key, (counts, total, n) in sorted(_histograms.items()):
+                    if key[0] != name:
+                        continue
+                    for count, bound in zip(counts, BUCKETS):
+                        lines += [_line((name+'_bucket',)+key[1:]
+                                        +(('le', '%g' % bound),), count)]
+                    lines += [_line((name+'_bucket',)+key[1:]
+                                    +(('le', '+Inf'),), n),
+                              _line((name+'_sum',)+key[1:], total),
+                              _line((name+'_count',)+key[1:], n)]
+    return '\n'.join(lines) + '\n'
+
+
+def check(par):
+    """ Sets defaults of metrics parameters
+    """
+    # port on which master serves metrics; 0 to disable
+    if 'METRICSPORT' not in par:
+        setattr(par, 'METRICSPORT', 0)
+
+    # address on which master serves metrics; '' for all interfaces
+    if 'METRICSADDR' not in par:
+        setattr(par, 'METRICSADDR', ADDRESS)
+
+    # optional file to which master periodically writes metrics
+    if 'METRICSFILE' not in par:
+        setattr(par, 'METRICSFILE', None)
+
+
+def start(port=0, textfile=None, scratch=None, interval=INTERVAL,
+          address=ADDRESS):
+    """ Starts exporting metrics, unless already doing so in this process
+    """
+    _scratch[0] = scratch
+    if _exporters:
+        return
+    if port:
+        server = HTTPServer((address, port), _Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        _exporters.append(server)
+        print(' metrics at http://%s:%d/metrics'
+              % (address or socket.gethostname(), server.server_address[1]))
+    if textfile:
+        thread = threading.Thread(target=_write_loop, args=(textfile, interval))
+        thread.daemon = True
+        thread.start()
+        _exporters.append(thread)
+
+
+def write(textfile):
+    """ Writes metrics to file, replacing it atomically
+    """
+    tmpfile = textfile + '.%d.tmp' % os.getpid()
+    with open(tmpfile, 'w') as f:
+        f.write(render())
+    os.rename(tmpfile, textfile)
+
+
+_exporters = []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _write_loop(textfile, interval):
+    while True:
+        try:
+            write(textfile)
+        except (IOError, OSError):
+            pass
+        time.sleep(interval)
+
+
+def _task_gauges():
+    if 'states' not in _tasks:
+        return
+    counts = dict((name, 0) for name in list(STATES) + ['unknown'])
+    for state in _tasks['states']:
+        counts[category(state)] += 1
+    # tasks not yet seen by the scheduler count as queued
+    counts['queued'] += max(0, _tasks['ntask'] - len(_tasks['states']))
+
+    _help.setdefault('seisflows_tasks',
+        ('gauge', 'Tasks of current stage by state'))
+    for key in [k for k in _gauges if k[0] == 'seisflows_tasks']:
+        del _gauges[key]
+    for name, count in counts.items():
+        _gauges[_key('seisflows_tasks',
+            {'stage': _tasks['stage'], 'state': name})] = float(count)
+
+
+def _scratch_gauges():
+    if not _scratch[0]:
+        return
+    try:
+        st = os.statvfs(_scratch[0])
+    except OSError:
+        return
+    _help.setdefault('seisflows_scratch_free_ratio',
+        ('gauge', 'Fraction of scratch space available'))
+    _help.setdefault('seisflows_scratch_free_bytes',
+        ('gauge', 'Scratch space available in bytes'))
+    _help.setdefault('seisflows_scratch_free_inodes_ratio',
+        ('gauge', 'Fraction of scratch inodes available'))
+    _gauges[('seisflows_scratch_free_ratio',)] = \
+        st.f_bavail/float(st.f_blocks or 1)
+    _gauges[('seisflows_scratch_free_bytes',)] = float(st.f_bavail*st.f_frsize)
+    _gauges[('seisflows_scratch_free_inodes_ratio',)] = \
+        st.f_favail/float(st.f_files or 1)
+
+
+def _key(name, labels):
+    return (name,) + tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _line(key, value):
+    name, labels = key[0], key[1:]
+    if labels:
+        name += '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                                  for k, v in labels)
+    return '%s %s' % (name, repr(float(value)))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,123 @@
+
+""" Queue-aware choice of SLURM partition and node shape
+
+  Rather than always submitting to the same partition with the same number of
+  nodes, candidate partitions and node shapes (for example 2 nodes x 24 tasks
+  versus 1 node x 48 tasks) are put to the scheduler with 'sbatch --test-only',
+  which reports when each would be expected to start without actually
+  submitting anything. The candidate with the earliest expected start wins.
+
+  Estimates are cached for a few minutes, so that planning many submissions
+  in a row does not flood the scheduler with queries.
+"""
+
+import re
+import time
+
+from math import ceil
+
+from seisflows.system.lib.scheduler import SchedulerError
+
+
+# seconds for which estimates and partition sizes are reused
+TTL = 300.
+
+# maximum number of node shapes tried per partition
+MAXSHAPES = 3
+
+START = re.compile(r'to start at (\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})')
+
+PARTITION = re.compile(r'(^|\s)(-p|--partition(=|\s|$))')
+
+
+def given(args):
+    """ Returns True if sbatch arguments already name a partition
+
+      A partition named this way, as in parameter files written before
+      PARTITION existed, takes precedence over PARTITION and PARTITIONS.
+    """
+    return bool(PARTITION.search(args or ''))
+
+
+def plan(client, partitions, nproc, nodesize, args=''):
+    """ Returns (partition, nodes, tasks per node) expected to start earliest
+
+      NPROC tasks are spread over nodes with no more than NODESIZE tasks each,
+      or fewer if a partition's nodes are smaller. ARGS are any further
+      sbatch arguments, such as the time limit.
+    """
+    candidates = []
+    for partition in partitions:
+        size = min(nodesize, cores(client, partition) or nodesize)
+        for nodes, tasks_per_node in shapes(nproc, size):
+            start = estimate(client, args
+                + ' --partition=%s' % partition
+                + ' --nodes=%d' % nodes
+                + ' --ntasks-per-node=%d' % tasks_per_node
+                + ' --ntasks=%d' % nproc)
+            if start is not None:
+                candidates += [(start, nodes, partition, tasks_per_node)]
+
+    if not candidates:
+        raise SchedulerError('No partition among %s can run %d tasks'
+                             % (', '.join(partitions), nproc))
+
+    # earliest start wins; ties go to the fewest nodes
+    start, nodes, partition, tasks_per_node = min(candidates)
+    return partition, nodes, tasks_per_node
+
+
+def earliest(client, partitions, args=''):
+    """ Returns partition in which a job with given arguments starts earliest
+    """
+    candidates = []
+    for partition in partitions:
+        start = estimate(client, args + ' --partition=%s' % partition)
+        if start is not None:
+            candidates += [(start, partition)]
+
+    if not candidates:
+        raise SchedulerError('No partition among %s accepts job'
+                             % ', '.join(partitions))
+    return min(candidates)[1]
+
+
+def shapes(nproc, nodesize):
+    """ Lists ways of placing NPROC tasks on nodes with NODESIZE cores
+
+      Returns (nodes, tasks per node) pairs, fewest nodes first.
+    """
+    nmin = int(ceil(nproc/float(nodesize)))
+    shapes = [(nmin, int(ceil(nproc/float(nmin))))]
+    shapes += [(nodes, nproc//nodes) for nodes in range(nmin+1, 2*nmin+1)
+               if nproc % nodes == 0]
+    return shapes[:MAXSHAPES]
+
+
+def estimate(client, args):
+    """ Returns expected start time of job in seconds since the epoch, or None
+      if the job would be rejected
+    """
+    try:
+        output = client.cached('sbatch --test-only %s --wrap=true' % args, TTL,
+            retries=0)
+    except SchedulerError:
+        return None
+
+    match = START.search(output)
+    if not match:
+        return None
+    return time.mktime(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S'))
+
+
+def cores(client, partition):
+    """ Returns number of cores per node in partition
+    """
+    try:
+        output = client.cached('sinfo -h -p %s -o %%c' % partition, TTL)
+    except SchedulerError:
+        return None
+
+    sizes = [int(re.match(r'\d+', line).group())
+             for line in output.split() if re.match(r'\d+', line)]
+    return min(sizes) if sizes else None
@@ -0,0 +1,233 @@
+""" Parallel provisioning of per-task working directories
+
+  Most of what a task needs in its working directory -- binaries, mesh
+  databases, parameter files -- is identical across tasks. Instead of having
+  the solver copy binaries and input files into each directory one by one, a
+  template directory is built once on the scratch filesystem and then fanned
+  out into task directories. Read-only files may be reflinked, on filesystems
+  with copy-on-write support, or hardlinked; only files matching one of the
+  WRITABLE patterns are then actually copied.
+
+  Hardlinked files share storage with the template and with every other task,
+  so that a task rewriting one in place, as solver setup does with parameter
+  files and binaries, changes it everywhere, and rewriting a binary another
+  task is running fails. Files are therefore copied unless LINKMODE says
+  otherwise; hardlinking is only safe if WRITABLE covers every file a task may
+  write to.
+
+  Provisioning takes the place of the solver's initialize_solver_directories
+  rather than adding to it: install builds the template at submission and
+  replaces that method of the solver object with an Initializer, which is
+  checkpointed along with the solver and so used by every task, however tasks
+  are started. The template should therefore hold what the solver would copy
+  into its working directory, i.e. at least bin and DATA.
+
+  System classes set the parameters below through check and call install
+  before the workflow is first checkpointed.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+import sys
+
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+from os.path import exists, islink, join, lexists, relpath
+
+
+# files matching these patterns, relative to the template, are copied rather
+# than linked
+WRITABLE = ['DATA/*', 'DATABASES_MPI/*', 'OUTPUT_FILES/*']
+
+# number of directories populated concurrently
+NTHREADS = 16
+
+# Linux ioctl request for cloning file contents (reflink)
+FICLONE = 0x40049409
+
+# cleared once the filesystem is found not to support reflinks
+_reflink_supported = [True]
+
+
+def check(par, path):
+    """ Sets defaults of provisioning parameters and paths
+    """
+    # optional template for task working directories
+    if 'TEMPLATE' not in path:
+        setattr(path, 'TEMPLATE', None)
+
+    # how read-only files are replicated into task directories
+    if 'LINKMODE' not in par:
+        setattr(par, 'LINKMODE', 'copy')
+
+    # files that tasks write to and which are therefore always copied
+    if 'WRITABLE' not in par:
+        setattr(par, 'WRITABLE', WRITABLE)
+
+
+def install(par, path):
+    """ Builds template from PATH.TEMPLATE, if given, and has the solver's
+      setup populate task working directories from it
+    """
+    if not path.TEMPLATE:
+        return
+    solver = sys.modules['seisflows_solver']
+    solver.initialize_solver_directories = Initializer(solver,
+        template(path.TEMPLATE, join(path.SCRATCH, 'template')),
+        par.WRITABLE, par.LINKMODE)
+
+
+def setup(source, path, dirnames, writable=WRITABLE, mode='copy',
+          nthreads=NTHREADS):
+    """ Builds template from source under path, then fans it out into dirnames
+    """
+    fanout(template(source, join(path, 'template')), dirnames,
+           writable, mode, nthreads)
+
+
+class Initializer(object):
+    """ Stands in for initialize_solver_directories of a solver object
+
+      Populates the solver's working directory from the template, then
+      carries out what remains of the solver's own method: creating the
+      directories the solver writes to, installing the source-specific input
+      file and checking parameter files.
+    """
+    def __init__(self, solver, template, writable=WRITABLE, mode='copy'):
+        self.solver = solver
+        self.template = template
+        self.writable = writable
+        self.mode = mode
+
+    def __call__(self):
+        solver = self.solver
+        fanout(self.template, [solver.cwd], self.writable, self.mode, 1)
+
+        for name in ['traces/obs', 'traces/syn', 'traces/adj',
+                     solver.model_databases, solver.kernel_databases]:
+            _mkdir(join(solver.cwd, name))
+
+        # replaced rather than overwritten, in case it is linked
+        dst = join(solver.cwd, 'DATA', solver.source_prefix)
+        if lexists(dst):
+            os.remove(dst)
+        shutil.copy2(dst+'_'+solver.source_name, dst)
+
+        os.chdir(solver.cwd)
+        solver.check_solver_parameter_files()
+
+
+def template(source, path):
+    """ Builds template directory from source directory
+
+      The template should reside on the same filesystem as the task
+      directories, so that its files can be hardlinked. An existing template
+      is reused, since task directories may already be linked to it.
+    """
+    if not exists(path):
+        shutil.copytree(source, path, symlinks=True)
+    return path
+
+
+def fanout(template, dirnames, writable=WRITABLE, mode='copy',
+           nthreads=NTHREADS):
+    """ Populates each of the given directories from template, in parallel
+
+      MODE determines how read-only files are replicated and is one of
+      'hardlink', 'reflink' or 'copy'. Where linking is not possible (for
+      example across filesystems), files are copied instead. Files that
+      already exist in a task directory are left untouched, so that fanout can
+      safely be repeated.
+    """
+    if mode not in ['hardlink', 'reflink', 'copy']:
+        raise ValueError('Bad provisioning mode: %s' % mode)
+
+    entries = _scan(template, writable)
+
+    pool = ThreadPool(min(nthreads, max(len(dirnames), 1)))
+    try:
+        pool.map(lambda dirname: _populate(template, dirname, entries, mode),
+                 dirnames)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _scan(template, writable):
+    """ Lists directories, symlinks and files in template
+    """
+    dirs, links, files = [], [], []
+    for root, subdirs, filenames in os.walk(template):
+        for name in subdirs + filenames:
+            fullname = join(root, name)
+            if islink(fullname):
+                links += [(relpath(fullname, template), os.readlink(fullname))]
+            elif name in subdirs:
+                dirs += [relpath(fullname, template)]
+            else:
+                name = relpath(fullname, template)
+                copy = any(fnmatch(name, pattern) for pattern in writable)
+                files += [(name, copy)]
+    return dirs, links, files
+
+
+def _populate(template, dirname, entries, mode):
+    """ Populates a single task directory from template
+    """
+    dirs, links, files = entries
+
+    _mkdir(dirname)
+    for name in dirs:
+        _mkdir(join(dirname, name))
+
+    for name, target in links:
+        if not lexists(join(dirname, name)):
+            os.symlink(target, join(dirname, name))
+
+    for name, copy in files:
+        src = join(template, name)
+        dst = join(dirname, name)
+        if lexists(dst):
+            continue
+        if copy or mode == 'copy':
+            shutil.copy2(src, dst)
+        elif mode == 'hardlink':
+            _hardlink(src, dst)
+        elif mode == 'reflink':
+            _reflink(src, dst)
+
+
+def _hardlink(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in [errno.EXDEV, errno.EMLINK, errno.EPERM]:
+            raise
+        shutil.copy2(src, dst)
+
+
+def _reflink(src, dst):
+    if not _reflink_supported[0]:
+        shutil.copy2(src, dst)
+        return
+    try:
+        with open(src, 'rb') as fsrc:
+            with open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except (IOError, OSError) as e:
+        if e.errno not in [errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                           errno.EINVAL, errno.ENOSYS]:
+            raise
+        _reflink_supported[0] = False
+        shutil.copy2(src, dst)
+
+
+def _mkdir(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,262 @@
+
+""" Tree-structured summation of arrays contributed by tasks
+
+  Summing per-task arrays (kernels, gradients) by having every task write a
+  full-size file to shared scratch and then reading all of them back from one
+  process makes this the heaviest I/O step of an iteration. Instead:
+
+    1. Tasks write their arrays to a node-local filesystem such as /dev/shm
+       (contribute), each to a file named after its task ID. A retried task
+       replaces the file of its earlier attempt rather than adding to it.
+
+    2. Each node sums its tasks' arrays, and node partials are combined in a
+       binomial tree (node). In round r, each node whose rank is an odd
+       multiple of 2**r hands its partial to the node 2**r ranks below it and
+       drops out, so n nodes finish in ceil(log2(n)) rounds with all merges
+       of a round running in parallel. Hand-offs go through the shared
+       filesystem, and each is published by an atomic rename.
+
+    3. Rank 0 writes the final result.
+
+  Where tasks do not share nodes persistently, for example when each task is
+  a separate job, contributions are written to shared scratch instead. They
+  are then merged pairwise in a tree by a pool of threads (merge).
+
+  Files are written under temporary names that never match those of
+  contributions, so that the leftovers of a killed task are not summed.
+
+  Usage from the command line:
+      python -m seisflows.system.lib.reduction node KEY RANK NNODE LOCAL SHARED DST
+"""
+
+import argparse
+import errno
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+from multiprocessing.pool import ThreadPool
+from os.path import exists, join
+
+import numpy as np
+
+
+# seconds to wait for a partial from another node before giving up
+TIMEOUT = 3600.
+
+# seconds between checks for a partial from another node
+INTERVAL = 0.5
+
+# number of pairwise merges carried out concurrently
+NTHREADS = 8
+
+# names of contributions, which are named after task IDs
+CONTRIBUTION = re.compile(r'^[0-9]+\.npy$')
+
+# directories of contributions already cleared by this process
+_reset = set()
+
+
+def contribute(path, taskid, array):
+    """ Writes array contributed by a task to directory for later summing,
+      replacing any earlier contribution of the same task
+    """
+    _mkdir(path)
+    _save(join(path, '%06d.npy' % int(taskid)), np.asarray(array))
+
+
+def contributions(path):
+    """ Lists contributions written to directory, in task order
+    """
+    if not exists(path):
+        return []
+    return sorted(join(path, name) for name in os.listdir(path)
+                  if CONTRIBUTION.match(name))
+
+
+def clear(path):
+    """ Discards contributions written to directory, e.g. by a failed run
+    """
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def reset(path):
+    """ Discards contributions left in directory by an earlier master;
+      carried out once per process, so that contributions of this master are
+      kept until reduced
+    """
+    if path in _reset:
+        return
+    clear(path)
+    _reset.add(path)
+
+
+def discard(path, keep):
+    """ Discards directories under path other than keep, e.g. those left on a
+      node by tasks of earlier jobs
+    """
+    if not exists(path):
+        return
+    for name in os.listdir(path):
+        if join(path, name) != keep:
+            clear(join(path, name))
+
+
+def node(key, rank, nnode, local, shared, dst):
+    """ Carries out one node's part of the tree reduction
+    """
+    partial = None
+    for filename in contributions(join(local, key)):
+        if partial is None:
+            partial = np.load(filename)
+        else:
+            partial += np.load(filename, mmap_mode='r')
+    _mkdir(shared)
+
+    step = 1
+    while step < nnode:
+        if rank % (2*step):
+            # hand partial to node RANK-STEP and drop out
+            _handoff(join(shared, '%s.%d' % (key, rank)), partial)
+            break
+
+        if rank + step < nnode:
+            other = _receive(join(shared, '%s.%d' % (key, rank+step)))
+            if partial is None:
+                partial = other
+            elif other is not None:
+                partial += other
+        step *= 2
+
+    if rank == 0:
+        if partial is None:
+            raise Exception('Nothing to reduce for key %s' % key)
+        _save(dst, partial)
+
+    clear(join(local, key))
+
+
+def tree(hosts, key, local, shared, dst):
+    """ Runs tree reduction across the given hosts; returns exit statuses
+    """
+    # discard hand-offs left by an earlier, failed reduction
+    handoff = re.compile(r'^%s\.[0-9]+\.(npy|empty)$' % re.escape(key))
+    if exists(shared):
+        for name in os.listdir(shared):
+            if handoff.match(name):
+                os.remove(join(shared, name))
+
+    procs = []
+    for rank, host in enumerate(hosts):
+        procs += [subprocess.Popen('ssh ' + host + ' '
+            + '"'
+            + 'export PYTHONPATH=%s; ' % os.getenv('PYTHONPATH', '')
+            + '%s -m seisflows.system.lib.reduction node ' % sys.executable
+            + '%s %d %d %s %s %s' % (key, rank, len(hosts), local, shared, dst)
+            + '"',
+            shell=True)]
+    return [proc.wait() for proc in procs]
+
+
+def merge(filenames, dst, nthreads=NTHREADS):
+    """ Sums arrays stored in the given files, pairwise in a tree
+
+      Input files are consumed.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        raise Exception('Nothing to reduce')
+
+    def add(pair):
+        a, b = pair
+        array = np.load(a)
+        array += np.load(b)
+        _save(a, array)
+        os.remove(b)
+
+    pool = ThreadPool(nthreads)
+    try:
+        while len(filenames) > 1:
+            pairs = list(zip(filenames[0::2], filenames[1::2]))
+            pool.map(add, pairs)
+            filenames = filenames[0::2]
+    finally:
+        pool.close()
+        pool.join()
+
+    _move(filenames[0], dst)
+
+
+def _handoff(name, partial):
+    if partial is None:
+        open(name+'.empty', 'w').close()
+    else:
+        _save(name+'.npy', partial)
+
+
+def _receive(name):
+    waited = 0.
+    while True:
+        if exists(name+'.npy'):
+            array = np.load(name+'.npy')
+            os.remove(name+'.npy')
+            return array
+        if exists(name+'.empty'):
+            os.remove(name+'.empty')
+            return None
+        if waited > TIMEOUT:
+            raise Exception('Timed out waiting for %s' % name)
+        time.sleep(INTERVAL)
+        waited += INTERVAL
+
+
+def _save(filename, array):
+    """ Saves array, making it visible to other processes all at once
+    """
+    # file object rather than name, since np.save would append '.npy'
+    tmpfile = filename + '.%d.tmp' % os.getpid()
+    with open(tmpfile, 'wb') as f:
+        np.save(f, array)
+    os.rename(tmpfile, filename)
+
+
+def _move(src, dst):
+    """ Moves file, replacing dst all at once even across filesystems
+    """
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmpfile = dst + '.%d.tmp' % os.getpid()
+        shutil.copyfile(src, tmpfile)
+        os.rename(tmpfile, dst)
+        os.remove(src)
+
+
+def _mkdir(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.reduction')
+    subparsers = parser.add_subparsers(dest='action')
+
+    p = subparsers.add_parser('node', help="run this node's part of reduction")
+    p.add_argument('key')
+    p.add_argument('rank', type=int)
+    p.add_argument('nnode', type=int)
+    p.add_argument('local')
+    p.add_argument('shared')
+    p.add_argument('dst')
+
+    args = parser.parse_args()
+    if args.action == 'node':
+        node(args.key, args.rank, args.nnode, args.local, args.shared, args.dst)
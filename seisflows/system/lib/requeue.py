@@ -0,0 +1,140 @@
+
+""" Walltime-aware self-requeue of the workflow master
+
+  Rather than asking for enough walltime to cover a whole inversion, the
+  master job hands over to a continuation of itself, which picks up where the
+  master left off.
+
+  The master hands over only at iteration boundaries, that is, on starting the
+  first stage of an iteration. At that point the checkpoint holds the state
+  of the optimizer as left by the previous iteration, so the continuation
+  restarts the new iteration from scratch without repeating any optimizer
+  update or line search step. Only steps the master carries out at the start
+  of an iteration, before its first stage, are repeated.
+
+  The master hands over once the walltime left is less than the previous
+  iteration took, or once SLURM has sent it SIGUSR1 some minutes before its
+  time runs out (sbatch --signal=B:USR1@MARGIN), whichever comes first. If
+  the signal arrives during an iteration, the rest of it must still finish
+  within the margin. Every master completes at least one iteration before
+  handing over.
+
+  The command used to submit the master is recorded under PATH.OUTPUT, which
+  unlike PATH.SYSTEM survives a restart from the first iteration. The
+  continuation is submitted before the master checkpoints and exits, and
+  waits for the master to end, so that a failed submission leaves the master
+  and its checkpoint as they were.
+"""
+
+import json
+import os
+import signal
+import threading
+import time
+
+from os.path import exists, join
+
+
+# file under PATH.OUTPUT holding command used to submit master
+COMMAND = 'requeue.json'
+
+_requested = [False]
+
+# when this master started, and iteration it is in and when that started
+_started = [None]
+_current = [None, None]
+
+
+def check(par):
+    """ Sets defaults of requeue parameters
+    """
+    # seconds before walltime at which master is signalled to requeue itself
+    # after the current iteration; 0 disables
+    if 'REQUEUE' not in par:
+        setattr(par, 'REQUEUE', 0)
+
+
+def args(margin):
+    """ Returns sbatch arguments asking for SIGUSR1 MARGIN seconds before
+      walltime runs out
+    """
+    return '--signal=B:USR1@%d ' % margin
+
+
+def install():
+    """ Sets flag on SIGUSR1 rather than terminating; call from master only
+    """
+    if threading.current_thread().name != 'MainThread':
+        return
+    if _started[0] is None:
+        _started[0] = time.time()
+    signal.signal(signal.SIGUSR1, _handler)
+
+
+def due(iteration, walltime):
+    """ Checks whether master should hand over before starting the current
+      stage; call at the start of every stage
+
+      Returns True only at the first stage of an iteration after the first,
+      and only if SIGUSR1 was received or the WALLTIME seconds of the master
+      would run out before another iteration like the previous one finishes.
+    """
+    now = time.time()
+    if iteration is None or iteration == _current[0]:
+        return False
+
+    previous = _current[1]
+    _current[:] = [iteration, now]
+    if previous is None:
+        # first iteration of this master
+        return False
+
+    if _requested[0]:
+        return True
+    started = _started[0] if _started[0] is not None else previous
+    return now - previous > started + walltime - now
+
+
+def save(path, cmd):
+    """ Records command used to submit master, for use by continuations
+    """
+    _dump(join(path, COMMAND), {'cmd': cmd})
+
+
+def resubmit(path, client, after=None):
+    """ Submits continuation of master and returns its job ID
+
+      Output of the continuation is appended to that of the original master.
+      If AFTER is given, the continuation waits for that job to end. Raises
+      an exception if no command was recorded or it cannot be submitted.
+    """
+    filename = join(path, COMMAND)
+    try:
+        cmd = _load(filename)['cmd']
+    except (IOError, OSError, ValueError, KeyError) as e:
+        raise Exception('Cannot requeue master: no submit command in %s (%s)'
+                        % (filename, e))
+
+    args = '--open-mode=append '
+    if after:
+        args += '--dependency=afterany:%s ' % after
+    return client.submit(cmd.replace('sbatch ', 'sbatch '+args, 1))
+
+
+def _handler(signum, frame):
+    _requested[0] = True
+    print(' received SIGUSR1; master will requeue itself after this iteration')
+
+
+def _load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def _dump(filename, data):
+    if not exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmpfile, filename)
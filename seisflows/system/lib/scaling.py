@@ -0,0 +1,279 @@
+
+""" Strong-scaling probe for choosing the number of cores per task
+
+  Rather than running every task on a fixed guess at NPROC, a short solver
+  benchmark is run once at each of several NPROC values, through the same
+  MPI launcher (system.mpiexec) and node shape that tasks use. A curve
+
+      T(NPROC) = SERIAL + PARALLEL/NPROC + COMM*NPROC
+
+  is fitted to the measured wall times, with terms dropped until all are
+  non-negative, and the probed NPROC at which the planned NTASK tasks
+  finish in the fewest node-hours is chosen. Node-hours count whole nodes,
+  so that an NPROC leaving part of each node idle is penalized.
+
+  Probes run as jobs of their own, which the submitting process does not wait
+  for: it records their job IDs and returns, and the fit is made by a later
+  submission once all of them have finished. Each probe writes its timings
+  to a directory of its own. Choices are recorded in a JSON file, under a key
+  describing the system, benchmark and candidates, so that later runs with
+  the same key reuse them rather than probing again. Recorded choices can be
+  listed with
+      python -m seisflows.system.lib.scaling show PATH
+
+  Solvers whose mesh is partitioned in advance can only run with as many
+  cores as there are partitions, so candidates are then limited to that
+  number (partitions).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from glob import glob
+from math import ceil
+from os.path import basename, exists, join
+
+import numpy as np
+
+
+# file holding recorded choices, by key
+RESULTS = 'scaling.json'
+
+# placeholder in benchmark command replaced by number of cores
+NPROC = '{nproc}'
+
+# file in probe directory holding IDs of probe jobs
+JOBS = 'jobs.json'
+
+# mesh databases, named after the partition holding them
+PARTITION = re.compile(r'^proc([0-9]+)_')
+
+
+def key(**fields):
+    """ Returns key under which a choice is recorded
+    """
+    return json.dumps(fields, sort_keys=True)
+
+
+def directory(path, key):
+    """ Returns directory in which probes for given key write their timings
+    """
+    return join(path, hashlib.md5(key.encode('utf-8')).hexdigest()[:12])
+
+
+def prepare(directory, nproc, launcher, command, repeats=1):
+    """ Writes command run by probe and returns command that runs probe
+
+      LAUNCHER is the MPI launcher for NPROC cores, e.g. 'mpirun -np 16';
+      occurrences of {nproc} in COMMAND are replaced by NPROC.
+    """
+    _mkdir(directory)
+    with open(join(directory, '%d.cmd' % nproc), 'w') as f:
+        json.dump({
+            'nproc': nproc,
+            'repeats': repeats,
+            'command': launcher.strip() + ' '
+                       + command.replace(NPROC, str(nproc))}, f)
+    return ('env PYTHONPATH=%s ' % os.getenv('PYTHONPATH', '')
+            + '%s -m seisflows.system.lib.scaling probe %s %d'
+            % (sys.executable, directory, nproc))
+
+
+def probe(directory, nproc):
+    """ Runs benchmark prepared for NPROC cores, recording its wall times
+    """
+    with open(join(directory, '%d.cmd' % nproc)) as f:
+        spec = json.load(f)
+
+    times = []
+    status = 0
+    for _ in range(spec['repeats']):
+        started = time.time()
+        status = subprocess.call(spec['command'], shell=True)
+        if status != 0:
+            break
+        times += [time.time() - started]
+
+    with open(join(directory, '%d.json' % nproc), 'w') as f:
+        json.dump({'nproc': nproc, 'status': status, 'times': times}, f)
+    return status
+
+
+def submitted(directory, jobs):
+    """ Records IDs of probe jobs
+    """
+    _mkdir(directory)
+    with open(join(directory, JOBS), 'w') as f:
+        json.dump(jobs, f)
+
+
+def jobs(directory):
+    """ Returns IDs of probe jobs, or [] if none were submitted
+    """
+    if not exists(join(directory, JOBS)):
+        return []
+    with open(join(directory, JOBS)) as f:
+        return json.load(f)
+
+
+def partitions(path):
+    """ Returns number of partitions of mesh databases in path, or None if
+      there are none
+    """
+    ranks = set()
+    for filename in glob(join(path, 'proc*')):
+        match = PARTITION.match(basename(filename))
+        if match:
+            ranks.add(int(match.group(1)))
+    if not ranks:
+        return None
+    return max(ranks) + 1
+
+
+def timings(directory):
+    """ Returns fastest wall time of each successful probe, by NPROC
+    """
+    result = {}
+    for filename in glob(join(directory, '*.json')):
+        with open(filename) as f:
+            record = json.load(f)
+        if record['status'] == 0 and record['times']:
+            result[record['nproc']] = min(record['times'])
+    return result
+
+
+def fit(timings):
+    """ Fits scaling curve to wall times, given as a dict keyed by NPROC
+
+      Returns coefficients 'serial', 'parallel' and 'comm'. Terms are dropped,
+      communication first, until the remaining coefficients are non-negative;
+      a single timing is taken to scale perfectly.
+    """
+    nprocs = np.array(sorted(timings), dtype=float)
+    times = np.array([timings[p] for p in sorted(timings)], dtype=float)
+    terms = {
+        'serial': np.ones(len(nprocs)),
+        'parallel': 1./nprocs,
+        'comm': nprocs}
+
+    for names in [['serial', 'parallel', 'comm'], ['serial', 'parallel'],
+                  ['parallel']]:
+        if len(names) > len(nprocs):
+            continue
+        A = np.column_stack([terms[name] for name in names])
+        coefs = np.linalg.lstsq(A, times, rcond=None)[0]
+        if (coefs >= 0).all():
+            break
+
+    model = dict(serial=0., parallel=0., comm=0.)
+    model.update(zip(names, [float(c) for c in np.maximum(coefs, 0.)]))
+    return model
+
+
+def runtime(model, nproc):
+    """ Returns wall time predicted by fitted curve
+    """
+    return model['serial'] + model['parallel']/nproc + model['comm']*nproc
+
+
+def choose(model, nprocs, ntask, nodesize):
+    """ Returns the NPROC at which NTASK tasks take fewest node-hours
+
+      Returns a dict with the chosen 'nproc', 'tasks_per_node', 'nodes' and
+      'rate' in tasks per node-hour, and the same for every candidate under
+      'candidates'. Ties go to the larger NPROC, which finishes sooner.
+    """
+    candidates = []
+    for nproc in sorted(nprocs):
+        if nproc <= nodesize:
+            tasks_per_node = nodesize//nproc
+            nodes = int(ceil(ntask/float(tasks_per_node)))
+        else:
+            tasks_per_node = 0
+            nodes = ntask*int(ceil(nproc/float(nodesize)))
+        hours = runtime(model, nproc)/3600.
+        candidates += [{
+            'nproc': nproc,
+            'tasks_per_node': tasks_per_node,
+            'nodes': nodes,
+            'runtime': hours*3600.,
+            'rate': ntask/(nodes*hours) if hours > 0 else float('inf')}]
+
+    best = max(candidates, key=lambda c: (c['rate'], c['nproc']))
+    return dict(best, candidates=candidates)
+
+
+def lookup(path, key):
+    """ Returns choice recorded under key, if any
+    """
+    return load(path).get(key)
+
+
+def record(path, key, result):
+    """ Records choice under key
+    """
+    results = load(path)
+    results[key] = result
+    _mkdir(path)
+    tmpfile = join(path, RESULTS + '.%d.tmp' % os.getpid())
+    with open(tmpfile, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    os.rename(tmpfile, join(path, RESULTS))
+
+
+def load(path):
+    """ Reads all recorded choices
+    """
+    if not exists(join(path, RESULTS)):
+        return {}
+    with open(join(path, RESULTS)) as f:
+        return json.load(f)
+
+
+def report(result):
+    """ Formats measured and predicted times of each candidate as a table
+    """
+    lines = ['%6s %10s %10s %6s %14s\n' % ('nproc', 'measured', 'fitted',
+             'nodes', 'tasks/node-h')]
+    measured = dict((int(p), t) for p, t in result.get('timings', {}).items())
+    for c in result['candidates']:
+        lines += ['%6d %10s %10.1f %6d %14.2f%s\n' % (c['nproc'],
+            '%.1f' % measured[c['nproc']] if c['nproc'] in measured else '-',
+            c['runtime'], c['nodes'], c['rate'],
+            ' *' if c['nproc'] == result['nproc'] else '')]
+    return ''.join(lines)
+
+
+def _mkdir(path):
+    if not exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.scaling')
+    subparsers = parser.add_subparsers(dest='action')
+
+    p = subparsers.add_parser('probe', help='run prepared benchmark')
+    p.add_argument('directory')
+    p.add_argument('nproc', type=int)
+
+    p = subparsers.add_parser('show', help='list recorded choices')
+    p.add_argument('path')
+
+    args = parser.parse_args()
+    if args.action == 'probe':
+        sys.exit(probe(args.directory, args.nproc))
+
+    elif args.action == 'show':
+        for k, result in sorted(load(args.path).items()):
+            print(k)
+            print(report(result))
@@ -0,0 +1,256 @@
+
+""" Scheduler command client
+
+  All interaction with the scheduler -- submitting jobs, querying their state,
+  listing nodes -- goes through a Client, which
+
+    - captures command output in memory rather than via files on PATH.SYSTEM
+
+    - kills commands that do not finish within a timeout, so that a hung
+      sbatch or qstat cannot stall the master indefinitely
+
+    - retries failed commands with exponential backoff; a failed submission
+      is only retried after checking that it did not go through, which is
+      possible for sbatch, whose submissions are tagged with a unique comment
+
+    - limits the rate at which commands are issued with a token bucket, so
+      that large workflows do not overload or get throttled by the scheduler
+
+  Clients with the same settings are shared within a process, so that the rate
+  limit applies to all scheduler commands issued by that process. System
+  classes set the parameters controlling them through check.
+"""
+
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+from getpass import getuser
+from uuid import uuid4
+from seisflows.system.lib import metrics
+
+
+# job IDs as reported by sbatch, sbatch --parsable, qsub and bsub
+JOBID_PATTERNS = [
+    re.compile(r'Submitted batch job (\d+)'),
+    re.compile(r'Job <(\d+)> is submitted'),
+    re.compile(r'^(\d+(?:\[\])?(?:\.[\w.-]+)?)(?:;\S+)?\s*$', re.M),
+    ]
+
+
+class SchedulerError(Exception):
+    """ Raised when a scheduler command fails or times out
+    """
+    pass
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter
+
+      Allows bursts of up to CAPACITY commands, refilled at RATE per second.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        """ Blocks until a token is available, then takes it
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                    self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1.:
+                    self.tokens -= 1.
+                    return
+                wait = (1. - self.tokens)/self.rate
+            time.sleep(wait)
+
+
+class Client(object):
+    """ Runs scheduler commands with timeouts, retries and rate limiting
+    """
+    def __init__(self, rate=1., burst=10, timeout=120., retries=3, backoff=5.):
+        self.bucket = TokenBucket(rate, burst)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = {}
+
+
+    def call(self, cmd, timeout=None, retries=None, idempotent=True):
+        """ Runs command and returns its output
+
+          Commands that time out are only retried if IDEMPOTENT, since a
+          submission that timed out may nonetheless have gone through.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+
+        command = os.path.basename(cmd.split()[0]) if cmd.split() else ''
+        for attempt in range(retries+1):
+            self.bucket.acquire()
+            with metrics.timer('seisflows_scheduler_command_seconds',
+                               'Scheduler command latency', command=command):
+                status, output, timedout = _run(cmd, timeout)
+            if status == 0:
+                return output
+            metrics.inc('seisflows_scheduler_command_failures_total',
+                        help='Failed scheduler commands', command=command)
+            if timedout and not idempotent:
+                raise SchedulerError('Timed out after %ds: %s' % (timeout, cmd))
+            if attempt < retries:
+                time.sleep(self.backoff * 2**attempt)
+
+        if timedout:
+            raise SchedulerError('Timed out after %ds: %s' % (timeout, cmd))
+        raise SchedulerError('Command failed with status %d: %s\n%s'
+                             % (status, cmd, output))
+
+
+    def cached(self, cmd, ttl, **kwargs):
+        """ Runs command, reusing output of an identical command issued within
+          the last TTL seconds
+        """
+        now = time.time()
+        if cmd in self.cache and now - self.cache[cmd][0] < ttl:
+            return self.cache[cmd][1]
+        output = self.call(cmd, **kwargs)
+        self.cache[cmd] = (now, output)
+        return output
+
+
+    def submit(self, cmd):
+        """ Submits job and returns its ID
+
+          Since a submission that failed or timed out may nonetheless have
+          gone through, sbatch submissions are tagged with a unique comment
+          and only retried if no job with that comment is queued. Other
+          submissions, and those already carrying a comment, are not retried.
+        """
+        if not cmd.startswith('sbatch ') or '--comment' in cmd:
+            return parse_jobid(self.call(cmd, retries=0, idempotent=False))
+
+        tag = 'seisflows-' + uuid4().hex
+        cmd = cmd.replace('sbatch ', 'sbatch --comment=%s ' % tag, 1)
+        for attempt in range(self.retries+1):
+            try:
+                return parse_jobid(self.call(cmd, retries=0))
+            except SchedulerError:
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2**attempt)
+
+            # raises, rather than risking a second job, if squeue fails
+            jobid = self.find(tag)
+            if jobid:
+                return jobid
+
+
+    def find(self, comment):
+        """ Returns ID of the user's queued or running job with given comment,
+          or None if there is none
+        """
+        output = self.call("squeue -h -u %s -o '%%F %%k'" % getuser())
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[1] == comment:
+                return fields[0]
+        return None
+
+
+    def state(self, jobid, ttl=10.):
+        """ Returns state of SLURM job or array task from accounting, or
+          'PENDING' if accounting does not list it yet
+
+          All tasks of an array are queried at once; the output is reused for
+          TTL seconds. Fields are delimited rather than of fixed width, so
+          that long job IDs and states are not truncated.
+        """
+        output = self.cached('sacct -n -P -o JobID,State -j '
+                             + jobid.split('_')[0], ttl)
+        for line in output.splitlines():
+            fields = line.split('|')
+            if len(fields) >= 2 and fields[0] == jobid and fields[1].strip():
+                # e.g. 'CANCELLED by 1234'
+                return fields[1].split()[0]
+        return 'PENDING'
+
+
+def parse_jobid(output):
+    """ Extracts job ID from output of sbatch, qsub or bsub
+    """
+    for pattern in JOBID_PATTERNS:
+        match = pattern.search(output)
+        if match:
+            return match.group(1)
+    raise SchedulerError('Could not parse job ID from: %s' % output.strip())
+
+
+def check(par):
+    """ Sets defaults of parameters controlling scheduler commands
+    """
+    # maximum number of scheduler commands per second
+    if 'CMDRATE' not in par:
+        setattr(par, 'CMDRATE', 1.)
+
+    # time in seconds after which scheduler commands are killed
+    if 'CMDTIMEOUT' not in par:
+        setattr(par, 'CMDTIMEOUT', 120.)
+
+    # number of times failed scheduler commands are retried
+    if 'CMDRETRIES' not in par:
+        setattr(par, 'CMDRETRIES', 3)
+
+
+_clients = {}
+_lock = threading.Lock()
+
+def client(rate=1., timeout=120., retries=3):
+    """ Returns client shared by all callers with the same settings
+    """
+    key = (rate, timeout, retries)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = Client(rate=rate, timeout=timeout, retries=retries)
+        return _clients[key]
+
+
+def _run(cmd, timeout):
+    """ Runs shell command, killing it and its children after TIMEOUT seconds
+    """
+    proc = subprocess.Popen(cmd,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        preexec_fn=os.setsid)
+
+    timedout = []
+    def kill():
+        timedout.append(True)
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output = proc.communicate()[0]
+    finally:
+        timer.cancel()
+
+    if not isinstance(output, str):
+        output = output.decode('utf-8', 'replace')
+    return proc.returncode, output, bool(timedout)
@@ -0,0 +1,458 @@
+
+""" Discrete-event simulation of workflows, for choosing settings offline
+
+  Replays the stage sequence of a workflow against a cluster profile, a task
+  runtime model and a queue wait model, and predicts makespan and core-hours
+  for each combination of system class, NPROC and NTASKMAX, so that the
+  cheapest or fastest configuration can be picked before any allocation is
+  spent. System classes are modelled by their flavor:
+
+    lg    each task is a job of its own, holding whole nodes and waiting in
+          the queue by itself; at most NTASKMAX tasks run at once, and the
+          master, itself a job, notices finished stages when it next polls
+
+    sm    one allocation of NTASK*NPROC cores holds the whole workflow; it
+          waits in the queue once and is charged while head tasks run
+
+    dsh   as sm, but the allocation is made of whole nodes
+
+  Cost is charged for the cores allocated, whole nodes where these are
+  allocated, rather than those tasks use, so that flavors compare alike.
+
+  Task runtimes follow Amdahl's law: a task doing WORK core-seconds of which a
+  fraction SERIAL cannot be parallelized takes
+
+      OVERHEAD + WORK*(SERIAL + (1-SERIAL)/NPROC)
+
+  seconds, divided by GPUSPEEDUP*NGPU if it uses GPUs, and scattered by a
+  lognormal factor. Queue waits are drawn from an exponential distribution
+  whose mean grows with the number of nodes asked for, and only a SHARE of
+  the cluster's nodes is taken to be available to the workflow at once.
+
+  Stage sequences are either those of a synthetic inversion or those recorded
+  by the accounting module, in which case runtimes and queue waits of the
+  recorded run calibrate the models. For example:
+      python -m seisflows.system.lib.simulate --systems tigercpu_lg \\
+          tigercpu_sm --ntask 200 --nproc 20 40 80 --ntaskmax 50 100
+      python -m seisflows.system.lib.simulate --systems chinook_lg \\
+          --stages output.accounting/stages.jsonl --nproc 24 48
+"""
+
+import argparse
+import heapq
+import random
+
+from collections import deque
+from math import ceil
+from os.path import isdir, dirname
+
+
+# clusters, with approximate numbers of nodes, cores and GPUs per node
+PROFILES = {
+    'tiger': {'nodes': 644, 'nodesize': 16, 'gpus': 0},
+    'tigercpu': {'nodes': 408, 'nodesize': 40, 'gpus': 0},
+    'chinook': {'nodes': 160, 'nodesize': 24, 'gpus': 0},
+    'tigergpu': {'nodes': 80, 'nodesize': 28, 'gpus': 4},
+    }
+
+FLAVORS = ['lg', 'sm', 'dsh']
+
+# seconds between polls of job array status by lg master
+POLL = 5.
+
+# objectives by which configurations can be ranked, and the results they use
+OBJECTIVES = {'makespan': 'makespan', 'cost': 'charged'}
+
+
+class TaskModel(object):
+    """ Runtime of a task as a function of its number of cores and GPUs
+    """
+    def __init__(self, work=3600., serial=0.02, overhead=20., jitter=0.1,
+                 gpuspeedup=1.):
+        self.work = work
+        self.serial = serial
+        self.overhead = overhead
+        self.jitter = jitter
+        self.gpuspeedup = gpuspeedup
+
+
+    def mean(self, stage, nproc, ngpu=0):
+        """ Returns expected runtime in seconds of a task of the given stage
+        """
+        work = stage.get('work', self.work)
+        serial = stage.get('serial', self.serial)
+        runtime = work*(serial + (1.-serial)/nproc)
+        if ngpu and stage['hosts'] == 'all':
+            runtime /= self.gpuspeedup*ngpu
+        return self.overhead + runtime
+
+
+    def sample(self, rng, stage, nproc, ngpu=0):
+        """ Draws runtime in seconds of a task of the given stage
+        """
+        sigma = self.jitter
+        return self.mean(stage, nproc, ngpu) \
+            * rng.lognormvariate(-sigma**2/2., sigma)
+
+
+class QueueModel(object):
+    """ Wait between submission and start of a job
+    """
+    def __init__(self, wait=300., pernode=10., share=0.25):
+        self.wait = wait
+        self.pernode = pernode
+        self.share = share
+
+
+    def sample(self, rng, nodes):
+        """ Draws wait in seconds of a job asking for the given number of nodes
+        """
+        mean = self.wait + self.pernode*nodes
+        if mean <= 0:
+            return 0.
+        return rng.expovariate(1./mean)
+
+
+    def capacity(self, profile):
+        """ Returns number of nodes of the cluster available to the workflow
+        """
+        return max(1, int(profile['nodes']*self.share))
+
+
+def workflow(iterations=5, steps=3, setup=600., head=60.):
+    """ Returns stage sequence of a synthetic inversion
+
+      Each iteration evaluates misfit and gradient and takes STEPS line
+      search steps, each costing another forward simulation. SETUP and HEAD
+      are runtimes in seconds of the serial setup and head tasks.
+    """
+    stages = [{'stage': 'workflow.setup', 'hosts': 'head', 'work': setup,
+               'serial': 1.}]
+    stages += [{'stage': 'solver.setup', 'hosts': 'all', 'scale': 0.1}]
+    for _ in range(iterations):
+        stages += [
+            {'stage': 'solver.eval_func', 'hosts': 'all', 'scale': 1.},
+            {'stage': 'solver.eval_grad', 'hosts': 'all', 'scale': 2.},
+            {'stage': 'postprocess.write_gradient', 'hosts': 'head',
+             'work': head, 'serial': 1.},
+            {'stage': 'optimize.compute_direction', 'hosts': 'head',
+             'work': head, 'serial': 1.}]
+        for _ in range(steps):
+            stages += [
+                {'stage': 'solver.eval_func', 'hosts': 'all', 'scale': 1.},
+                {'stage': 'optimize.update_search', 'hosts': 'head',
+                 'work': head, 'serial': 1.}]
+    return stages
+
+
+def recorded(records, serial=0.02):
+    """ Converts stage records of the accounting module to a stage sequence
+
+      Task runtimes measured at the recorded number of cores are converted
+      to core-seconds at one core, so that they can be replayed at any NPROC.
+      Returns the stage sequence and the mean queue wait of the recorded run.
+    """
+    stages = []
+    waits = []
+    for record in records:
+        tasks = [t for t in record['tasks'] if t.get('start') and t.get('end')]
+        if not tasks:
+            continue
+        elapsed = sum(t['end'] - t['start'] for t in tasks)/len(tasks)
+        waits += [max(0., t['start'] - t['submitted']) for t in tasks
+                  if t.get('submitted')]
+        if record['hosts'] == 'head':
+            stages += [{'stage': record['stage'], 'hosts': 'head',
+                        'work': elapsed, 'serial': 1., 'ntask': 1}]
+        else:
+            cores = record['cores'] or 1
+            stages += [{'stage': record['stage'], 'hosts': 'all',
+                        'work': elapsed/(serial + (1.-serial)/cores),
+                        'serial': serial, 'ntask': record['ntask']}]
+    return stages, (sum(waits)/len(waits) if waits else None)
+
+
+def simulate(profile, flavor, stages, ntask, nproc, ntaskmax=None, ngpu=0,
+             tasks=None, queue=None, seed=0):
+    """ Simulates one run of a workflow; returns its makespan and cost
+
+      Returns a dict with makespan in seconds and charged and busy core-hours,
+      or None if the configuration cannot run on the cluster at all.
+    """
+    tasks = tasks or TaskModel()
+    queue = queue or QueueModel()
+    rng = random.Random(seed)
+    nodesize = profile['nodesize']
+    capacity = queue.capacity(profile)
+
+    if ngpu > (profile['gpus'] or 0):
+        return None
+    if nproc > capacity*nodesize:
+        return None
+
+    if flavor == 'lg':
+        # cores charged for each task
+        pertask = int(ceil(nproc/float(nodesize)))*nodesize
+
+        # master holds one node for the length of the workflow
+        started = queue.sample(rng, 1)
+        now = started
+        busy = charged = 0.
+        for stage in stages:
+            n = _ntask(stage, ntask)
+            durations = [_duration(rng, tasks, stage, nproc, ngpu)
+                         for _ in range(n)]
+            end, used, held = _array(rng, durations, nproc, ngpu,
+                ntaskmax or n, capacity, profile, queue, now)
+            # finished stages are noticed at the next poll
+            now += ceil((end - now)/POLL)*POLL
+            busy += used
+            charged += held
+        charged += nodesize*(now - started)
+        makespan = now
+
+    elif flavor in ['sm', 'dsh']:
+        cores = ntask*nproc
+        nodes = int(ceil(cores/float(nodesize)))
+        if nodes > capacity:
+            return None
+        if ngpu and ntask*ngpu > nodes*profile['gpus']:
+            return None
+        if flavor == 'dsh':
+            cores = nodes*nodesize
+        pertask = cores/float(ntask)
+
+        started = queue.sample(rng, nodes)
+        now = started
+        busy = 0.
+        for stage in stages:
+            durations = [_duration(rng, tasks, stage, nproc, ngpu)
+                         for _ in range(_ntask(stage, ntask))]
+            now += max(durations)
+            busy += nproc*sum(durations)
+        charged = cores*(now - started)
+        makespan = now
+
+    else:
+        raise ValueError('Unknown flavor: %s' % flavor)
+
+    return {
+        'makespan': makespan,
+        'charged': charged/3600.,
+        'busy': busy/3600.,
+        'gpu_hours': charged/3600. * ngpu/pertask}
+
+
+def sweep(systems, stages, ntask, nprocs, ntaskmaxs=None, ngpu=0,
+          tasks=None, queue=None, replicates=5, seed=0, nodes=None):
+    """ Simulates every combination of system class, NPROC and NTASKMAX
+
+      SYSTEMS are names of system classes, e.g. 'tigercpu_lg', from which
+      cluster profile and flavor are taken. Results are averaged over
+      REPLICATES runs with different random draws.
+    """
+    results = []
+    for system in systems:
+        profile, flavor = _parse(system, nodes)
+        for nproc in nprocs:
+            # NTASKMAX only applies where tasks are jobs of their own
+            limits = ntaskmaxs if flavor == 'lg' else None
+            for ntaskmax in limits or [None]:
+                runs = [simulate(profile, flavor, stages, ntask, nproc,
+                                 ntaskmax, ngpu, tasks, queue, seed+i)
+                        for i in range(replicates)]
+                result = {'system': system, 'flavor': flavor, 'nproc': nproc,
+                          'ntaskmax': ntaskmax, 'feasible': None not in runs}
+                if result['feasible']:
+                    for key in runs[0]:
+                        result[key] = sum(r[key] for r in runs)/len(runs)
+                results += [result]
+    return results
+
+
+def pareto(results):
+    """ Marks results not beaten on both makespan and cost by any other
+    """
+    feasible = [r for r in results if r['feasible']]
+    for r in feasible:
+        r['pareto'] = not any(
+            o['makespan'] <= r['makespan'] and o['charged'] <= r['charged']
+            and (o['makespan'] < r['makespan'] or o['charged'] < r['charged'])
+            for o in feasible)
+    return results
+
+
+def report(results, objective='makespan'):
+    """ Formats results as a table, best first by the given objective
+
+      Configurations on the tradeoff between makespan and cost, which no
+      other configuration beats on both, are marked with an asterisk.
+    """
+    pareto(results)
+    feasible = sorted([r for r in results if r['feasible']],
+                      key=lambda r: r[OBJECTIVES[objective]])
+    lines = ['%-16s %5s %8s %12s %12s %12s %5s\n'
+             % ('system', 'nproc', 'ntaskmax', 'makespan(h)', 'charged',
+                'busy', 'eff')]
+    for r in feasible:
+        lines += ['%-16s %5d %8s %12.2f %12.1f %12.1f %4d%% %s\n'
+            % (r['system'], r['nproc'], r['ntaskmax'] or '-',
+               r['makespan']/3600., r['charged'], r['busy'],
+               round(100*r['busy']/r['charged']) if r['charged'] else 0,
+               '*' if r['pareto'] else '')]
+    for r in results:
+        if not r['feasible']:
+            lines += ['%-16s %5d %8s %12s\n' % (r['system'], r['nproc'],
+                      r['ntaskmax'] or '-', 'does not fit')]
+    lines += ['\ncharged and busy in core-hours; '
+              '* not beaten on both makespan and cost\n']
+    return ''.join(lines)
+
+
+def _parse(system, nodes=None):
+    """ Returns cluster profile and flavor of system class
+    """
+    name, flavor = system.rsplit('_', 1)
+    if flavor == 'FT':
+        # fault tolerant variants submit tasks as lg does
+        flavor = 'lg'
+    if name not in PROFILES or flavor not in FLAVORS:
+        raise ValueError('No profile for system: %s' % system)
+    profile = dict(PROFILES[name])
+    if nodes:
+        profile['nodes'] = nodes
+    return profile, flavor
+
+
+def _ntask(stage, ntask):
+    if stage['hosts'] == 'head':
+        return 1
+    return ntask
+
+
+def _duration(rng, tasks, stage, nproc, ngpu):
+    if 'scale' in stage:
+        stage = dict(stage, work=tasks.work*stage['scale'])
+    return tasks.sample(rng, stage, nproc, ngpu)
+
+
+def _array(rng, durations, nproc, ngpu, ntaskmax, capacity, profile, queue,
+           now):
+    """ Simulates job array submitted at time NOW; returns time at which its
+      last task finishes, and core-seconds its tasks used and held
+
+      Each task holds whole nodes.
+    """
+    nodes = int(ceil(nproc/float(profile['nodesize'])))
+    allocated = nodes*profile['nodesize']
+    cores = capacity*profile['nodesize']
+    gpus = capacity*profile['gpus']
+
+    # events are (time, sequence number, kind, task)
+    events = []
+    for i in range(len(durations)):
+        heapq.heappush(events, (now + queue.sample(rng, nodes), i, 'eligible', i))
+
+    pending = deque()
+    running = 0
+    used = held = 0.
+    end = now
+    sequence = len(durations)
+    while events:
+        t, _, kind, i = heapq.heappop(events)
+        if kind == 'eligible':
+            pending.append(i)
+        else:
+            running -= 1
+            cores += allocated
+            gpus += ngpu
+            end = t
+
+        # start eligible tasks, in order, while resources and throttle allow
+        while pending and running < ntaskmax and cores >= allocated \
+              and gpus >= ngpu:
+            j = pending.popleft()
+            running += 1
+            cores -= allocated
+            gpus -= ngpu
+            used += nproc*durations[j]
+            held += allocated*durations[j]
+            sequence += 1
+            heapq.heappush(events, (t + durations[j], sequence, 'finish', j))
+
+    return end, used, held
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.simulate',
+        description='Predicts makespan and core-hours of a workflow')
+    parser.add_argument('--systems', nargs='+', required=True,
+        help='system classes, e.g. tigercpu_lg chinook_sm')
+    parser.add_argument('--ntask', type=int,
+        help='number of tasks per stage (NTASK); by default as recorded')
+    parser.add_argument('--nproc', type=int, nargs='+', required=True,
+        help='cores per task to try (NPROC)')
+    parser.add_argument('--ntaskmax', type=int, nargs='+', default=[None],
+        help='limits on concurrent tasks to try (NTASKMAX); lg only')
+    parser.add_argument('--ngpu', type=int, default=0,
+        help='GPUs per task (NGPU)')
+    parser.add_argument('--nodes', type=int,
+        help='number of nodes of cluster, overriding profile')
+
+    parser.add_argument('--stages',
+        help='stages.jsonl written by accounting, replayed instead of a '
+             'synthetic inversion')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=3,
+        help='line search steps per iteration')
+
+    parser.add_argument('--work', type=float, default=3600.,
+        help='core-seconds of one forward simulation on one core')
+    parser.add_argument('--serial', type=float, default=0.02,
+        help='fraction of work that cannot be parallelized')
+    parser.add_argument('--overhead', type=float, default=20.,
+        help='seconds to start a task')
+    parser.add_argument('--jitter', type=float, default=0.1,
+        help='spread of task runtimes')
+    parser.add_argument('--gpuspeedup', type=float, default=1.,
+        help='speedup per GPU of solver tasks')
+
+    parser.add_argument('--wait', type=float,
+        help='mean queue wait in seconds of a one-node job')
+    parser.add_argument('--pernode', type=float, default=10.,
+        help='further mean queue wait per node asked for')
+    parser.add_argument('--share', type=float, default=0.25,
+        help='fraction of cluster available to workflow')
+
+    parser.add_argument('--replicates', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sort', choices=sorted(OBJECTIVES), default='makespan')
+
+    args = parser.parse_args()
+
+    wait = args.wait
+    ntask = args.ntask
+    if args.stages:
+        from seisflows.system.lib import accounting
+        path = args.stages if isdir(args.stages) else dirname(args.stages)
+        stages, measured = recorded(accounting.load(path or '.'), args.serial)
+        if wait is None:
+            wait = measured
+        if ntask is None:
+            ntask = max([s['ntask'] for s in stages] or [1])
+    else:
+        stages = workflow(args.iterations, args.steps)
+    if ntask is None:
+        parser.error('--ntask is required unless replaying --stages')
+
+    try:
+        results = sweep(args.systems, stages, ntask, args.nproc,
+            args.ntaskmax, args.ngpu,
+            TaskModel(args.work, args.serial, args.overhead, args.jitter,
+                      args.gpuspeedup),
+            QueueModel(300. if wait is None else wait, args.pernode,
+                       args.share),
+            args.replicates, args.seed, args.nodes)
+    except ValueError as e:
+        parser.error(str(e))
+    print(report(results, args.sort))
@@ -0,0 +1,330 @@
+
+""" Fast task start-up from a pre-resolved parameter snapshot
+
+  Normally every task starts through wrappers/run, which rebuilds PAR and PATH
+  from JSON files on the shared filesystem and then unpickles each object of
+  the checkpoint. Unpickling the system object imports its module and, with
+  it, every helper that module imports, even though tasks use few of them.
+
+  With SNAPSHOT=True, the master instead writes PAR and PATH, with all defaults resolved by the
+  system class, to a single snapshot file in OUTPUT. The snapshot is only
+  rewritten when it changes, and always by rename, so that each node can keep
+  a copy in a node-local cache (/dev/shm, unless SEISFLOWS_CACHE is set) and
+  tasks on that node read the copy rather than the shared filesystem. Tasks
+  install the snapshot as is, without checking parameters again, before
+  unpickling the checkpoint, and run under the interpreter PYTHON found on
+  the task's node. Since tasks then trust the parameters the master pickled,
+  this is off by default. System classes import their helpers through lazy
+  below, so that each is only imported when first used.
+
+  With STARTUPTIMES=True, each task records how long it took from process
+  start to calling the task itself, split into interpreter start-up, loading
+  parameters and loading the checkpoint, under PATH.SYSTEM/startup. Since
+  this adds a write to the shared filesystem to every task, it is off by
+  default. Recorded times can be summarized with
+      python -m seisflows.system.lib.startup report PATH.SYSTEM/startup
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+from glob import glob
+from importlib import import_module
+from os.path import exists, join
+
+
+# file under OUTPUT holding snapshot of PAR and PATH
+SNAPSHOT = 'snapshot.p'
+
+# environment variable overriding node-local cache directory
+CACHE = 'SEISFLOWS_CACHE'
+
+_imported = time.time()
+
+
+class lazy(object):
+    """ Module of this package imported on first attribute access
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = 'seisflows.system.lib.'+name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__['_module'] = import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def check(par):
+    """ Sets defaults of start-up parameters
+    """
+    # whether tasks start from a snapshot of PAR and PATH
+    if 'SNAPSHOT' not in par:
+        setattr(par, 'SNAPSHOT', False)
+
+    # interpreter running tasks started from the snapshot
+    if 'PYTHON' not in par:
+        setattr(par, 'PYTHON', 'python')
+
+    # whether tasks record their start-up times
+    if 'STARTUPTIMES' not in par:
+        setattr(par, 'STARTUPTIMES', False)
+
+
+def update(par, path):
+    """ Brings snapshot up to date with PAR and PATH, if tasks use one;
+      call after each checkpoint
+    """
+    if par.SNAPSHOT:
+        write(path.OUTPUT, par, path)
+
+
+def task_cmd(par, path, classname, method):
+    """ Returns command that runs a task, from the snapshot if tasks use one
+    """
+    if par.SNAPSHOT:
+        return run_cmd(path.OUTPUT, classname, method, par.ENVIRONS,
+                       par.PYTHON)
+
+    from seisflows.tools.tools import findpath
+    return (findpath('seisflows.system') +'/'+ 'wrappers/run '
+            + path.OUTPUT + ' '
+            + classname + ' '
+            + method + ' '
+            + par.ENVIRONS)
+
+
+def write(output, par, path):
+    """ Writes snapshot of PAR and PATH, unless unchanged
+    """
+    data = pickle.dumps({'parameters': dict(vars(par)),
+                         'paths': dict(vars(path))}, 2)
+    filename = join(output, SNAPSHOT)
+    if exists(filename):
+        with open(filename, 'rb') as f:
+            if f.read() == data:
+                return
+    tmpfile = filename + '.%d.tmp' % os.getpid()
+    with open(tmpfile, 'wb') as f:
+        f.write(data)
+    os.rename(tmpfile, filename)
+
+
+def cached(filename, cache=None):
+    """ Returns copy of file in node-local cache, refreshing it if stale
+
+      Copies are named after the inode, size and modification time of the
+      file, which all change when the file is replaced by rename. These are
+      read from the open file, since on NFS opening a file revalidates its
+      attributes, whereas a bare stat may be answered from the client's
+      attribute cache. A copy is therefore as fresh as a read of the file
+      itself would be.
+    """
+    cache = cache or _cachedir()
+    prefix = hashlib.md5(filename.encode('utf-8')).hexdigest()[:12]
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        copy = join(cache, '%s.%d.%d.%d' % (prefix, st.st_ino, st.st_size,
+                                            int(st.st_mtime*1e6)))
+        if exists(copy):
+            return copy
+
+        try:
+            if not exists(cache):
+                os.makedirs(cache, 0o700)
+            tmpfile = copy + '.%d.tmp' % os.getpid()
+            with open(tmpfile, 'wb') as g:
+                shutil.copyfileobj(f, g)
+            os.rename(tmpfile, copy)
+        except (IOError, OSError):
+            return filename
+
+    # remove copies of earlier versions
+    for stale in glob(join(cache, prefix+'.*')):
+        if stale != copy and not stale.endswith('.tmp'):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return copy
+
+
+def load(output, cache=True):
+    """ Installs PAR and PATH from snapshot, then loads checkpoint
+
+      Falls back on seisflows.config.load if there is no snapshot.
+    """
+    if parameters(output, cache):
+        objects(output)
+    else:
+        from seisflows.config import load
+        load(output)
+
+
+def parameters(output, cache=True):
+    """ Installs PAR and PATH from snapshot; returns False if there is none
+    """
+    try:
+        from seisflows.config import Dict
+    except ImportError:
+        return False
+
+    filename = join(output, SNAPSHOT)
+    if not exists(filename):
+        return False
+    if cache:
+        filename = cached(filename)
+    with open(filename, 'rb') as f:
+        snapshot = pickle.load(f)
+    sys.modules['seisflows_parameters'] = Dict(snapshot['parameters'])
+    sys.modules['seisflows_paths'] = Dict(snapshot['paths'])
+    return True
+
+
+def objects(output):
+    """ Loads objects of checkpoint, in the order seisflows.config.load does
+    """
+    from seisflows.config import names
+    from seisflows.tools.tools import loadobj
+    for name in names:
+        filename = join(output, 'seisflows_'+name+'.p')
+        if exists(filename):
+            sys.modules['seisflows_'+name] = loadobj(filename)
+
+
+def run(output, classname, method, environs='', cache=True):
+    """ Runs task classname.method, as wrappers/run does, recording the time
+      taken to start it
+    """
+    for item in environs.strip(',').split(','):
+        if '=' in item:
+            key, val = item.split('=', 1)
+            os.environ[key] = val
+
+    timings = {'start': _started(), 'imported': _imported}
+    if parameters(output, cache):
+        timings['loaded'] = time.time()
+        objects(output)
+    else:
+        # parameters and checkpoint loaded together
+        from seisflows.config import load
+        load(output)
+        timings['loaded'] = time.time()
+
+    from seisflows.tools.tools import loadobj
+    kwargs = loadobj(join(output, 'kwargs', classname+'_'+method+'.p'))
+    func = getattr(sys.modules['seisflows_'+classname], method)
+    timings['ready'] = time.time()
+    PAR = sys.modules['seisflows_parameters']
+    if 'STARTUPTIMES' in PAR and PAR.STARTUPTIMES:
+        _record(classname, method, timings)
+
+    func(**kwargs)
+
+
+def run_cmd(output, classname, method, environs='', python='python'):
+    """ Returns command that runs a task through run, under interpreter
+      PYTHON as found on the task's node
+    """
+    return ('env PYTHONPATH=%s ' % os.getenv('PYTHONPATH', '')
+            + '%s -m seisflows.system.lib.startup run ' % python
+            + '%s %s %s %s' % (output, classname, method, environs))
+
+
+def report(directory):
+    """ Summarizes start-up times of the tasks of each stage
+    """
+    lines = ['%-32s %6s %9s %9s %9s %9s %9s\n' % ('stage', 'tasks',
+             'python', 'params', 'objects', 'median', 'max')]
+    for stage in sorted(os.listdir(directory)):
+        records = []
+        for filename in glob(join(directory, stage, '*.json')):
+            with open(filename) as f:
+                records += [json.load(f)]
+        if not records:
+            continue
+        mean = lambda key: sum(r[key] for r in records)/len(records)
+        totals = sorted(r['total'] for r in records)
+        lines += ['%-32s %6d %9.2f %9.2f %9.2f %9.2f %9.2f\n' % (stage,
+            len(records), mean('python'), mean('params'), mean('objects'),
+            totals[len(totals)//2], totals[-1])]
+    lines += ['\nmean seconds spent starting python, loading parameters and '
+              'loading checkpoint;\nmedian and max seconds from process start '
+              'to task\n']
+    return ''.join(lines)
+
+
+def _cachedir():
+    cache = os.getenv(CACHE)
+    if not cache:
+        cache = '/dev/shm' if exists('/dev/shm') else tempfile.gettempdir()
+    return join(cache, 'seisflows-%d' % os.getuid())
+
+
+def _started():
+    """ Returns time at which this process started, if it can be determined
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # fields after command name, which may contain spaces
+            ticks = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot = [float(line.split()[1]) for line in f
+                    if line.startswith('btime')][0]
+        return boot + ticks/os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError):
+        return _imported
+
+
+def _record(classname, method, timings):
+    """ Writes start-up times of this task under PATH.SYSTEM/startup
+    """
+    try:
+        PATH = sys.modules['seisflows_paths']
+        taskid = sys.modules['seisflows_system'].taskid()
+        directory = join(PATH.SYSTEM, 'startup', classname+'_'+method)
+        if not exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        with open(join(directory, '%s.%s.%d.json' % (taskid,
+                  socket.gethostname(), os.getpid())), 'w') as f:
+            json.dump({
+                'taskid': taskid,
+                'python': timings['imported'] - timings['start'],
+                'params': timings['loaded'] - timings['imported'],
+                'objects': timings['ready'] - timings['loaded'],
+                'total': timings['ready'] - timings['start']}, f)
+    except Exception:
+        # timings are not worth failing a task over
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.startup')
+    subparsers = parser.add_subparsers(dest='action')
+
+    p = subparsers.add_parser('run', help='run task')
+    p.add_argument('output')
+    p.add_argument('classname')
+    p.add_argument('method')
+    p.add_argument('environs', nargs='?', default='')
+
+    p = subparsers.add_parser('report', help='summarize start-up times')
+    p.add_argument('directory')
+
+    args = parser.parse_args()
+    if args.action == 'run':
+        run(args.output, args.classname, args.method, args.environs)
+
+    elif args.action == 'report':
+        sys.stdout.write(report(args.directory))
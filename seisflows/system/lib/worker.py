@@ -0,0 +1,409 @@
+
+""" Persistent per-node task workers
+
+  Normally every task starts a new Python interpreter through wrappers/run,
+  which imports seisflows and its numerical dependencies, rebuilds PAR and
+  PATH and unpickles the checkpoint before doing any work. For short tasks
+  this start-up cost dominates.
+
+  Instead, one worker can be started on each node of an allocation. The worker
+  imports everything once and reloads the checkpoint only when it changes. For
+  each task it receives, it forks a child with all of this state already in
+  memory. When the child exits, its exit status is reported back to the master.
+
+  Reloading the checkpoint replaces PAR, PATH and the workflow objects in
+  sys.modules, but modules imported earlier keep module-level aliases such as
+  PAR = sys.modules['seisflows_parameters'] bound to the objects replaced.
+  After each reload, such aliases in seisflows modules are rebound to the new
+  objects, so that tasks see changes made by the master, e.g. to NPROC.
+
+  Workers listen on a TCP port. Each one advertises its address in a file
+  named after its host under the workers directory, which is normally
+  PATH.SYSTEM/workers. Requests must carry a token that is stored, readable
+  only by the user, in the same directory. The master sends all tasks for a
+  node over a single connection, on which the worker reports each task as it
+  finishes. A worker exits when asked to or after a period without tasks.
+
+  Usage from the command line:
+      python -m seisflows.system.lib.worker serve [--jobid ID] OUTPUT DIR
+"""
+
+import argparse
+import binascii
+import json
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+
+from glob import glob
+from os.path import exists, getmtime, join
+
+
+# modules imported by each worker ahead of time
+PRELOAD = ['numpy', 'scipy', 'obspy']
+
+# seconds without tasks after which a worker exits
+IDLE = 3600.
+
+# seconds to wait for workers to come up, or for replies other than task
+# exit statuses
+TIMEOUT = 120.
+
+# seconds to wait for a task to finish before giving up on it
+TASKTIME = 86400.
+
+# fields of a request to run a task
+FIELDS = ['classname', 'method', 'taskid', 'environs']
+
+
+def serve(output, path, jobid='', idle=IDLE):
+    """ Runs worker on current node until shut down or idle
+    """
+    for name in PRELOAD:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    from seisflows.config import load
+
+    token = _token(path)
+    host = socket.gethostname()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('', 0))
+    sock.listen(128)
+    _advertise(path, host, sock.getsockname()[1], jobid)
+
+    stamp = None
+    children = {}
+    last = time.time()
+    while True:
+        # report tasks that have finished
+        while children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            conn, taskid = children.pop(pid)
+            # connection is closed once its last task is reported
+            _reply(conn, {'taskid': taskid, 'status': _exitcode(status)},
+                close=not any(c is conn for c, _ in children.values()))
+            last = time.time()
+
+        if not children and time.time() - last > idle:
+            break
+
+        if not select.select([sock], [], [], 0.1)[0]:
+            continue
+
+        conn = sock.accept()[0]
+        try:
+            conn.settimeout(10.)
+            request = _recv(conn)
+            conn.settimeout(None)
+        except (socket.error, ValueError):
+            conn.close()
+            continue
+
+        if not isinstance(request, dict) or request.get('token') != token:
+            conn.close()
+            continue
+
+        action = request.get('action')
+        if action == 'ping':
+            _reply(conn, {'status': 0, 'jobid': jobid})
+
+        elif action == 'shutdown':
+            _reply(conn, {'status': 0})
+            break
+
+        elif action == 'run' and _valid(request.get('tasks')):
+            # reload checkpoint if master has written a new one
+            if _stamp(output) != stamp:
+                _reload(output, load)
+                stamp = _stamp(output)
+
+            for task in request['tasks']:
+                pid = os.fork()
+                if pid == 0:
+                    sock.close()
+                    conn.close()
+                    os._exit(_execute(output, task))
+                children[pid] = (conn, task['taskid'])
+
+        else:
+            _reply(conn, {'status': -1, 'error': 'malformed request'})
+
+    sock.close()
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def start(hosts, output, path, jobid='', timeout=TIMEOUT):
+    """ Starts a worker on each host that does not already have one
+    """
+    _mkdir(path)
+    _token(path)
+
+    pending = [host for host in hosts if not ping(path, host, jobid)]
+    for host in pending:
+        if exists(join(path, host)):
+            os.remove(join(path, host))
+        subprocess.call('ssh ' + host + ' '
+            + '"'
+            + 'export PYTHONPATH=%s; ' % os.getenv('PYTHONPATH', '')
+            + 'nohup %s -m seisflows.system.lib.worker serve ' % sys.executable
+            + '--jobid=%s ' % jobid
+            + output + ' '
+            + path + ' '
+            + '> %s 2>&1 < /dev/null &' % join(path, host+'.log')
+            + '"',
+            shell=True)
+
+    # wait for workers to advertise themselves
+    started = time.time()
+    while pending:
+        pending = [host for host in pending if not ping(path, host, jobid)]
+        if time.time() - started > timeout:
+            raise Exception('Workers failed to start on: %s' % ' '.join(pending))
+        time.sleep(1.)
+
+
+def ping(path, host, jobid=''):
+    """ Checks whether a worker belonging to the current job runs on host
+    """
+    try:
+        reply = _request(path, host, {'action': 'ping'}, timeout=10.)
+    except (IOError, OSError, socket.error, ValueError):
+        return False
+    return reply.get('jobid') == jobid
+
+
+def dispatch(path, tasks, timings=None, timeout=TASKTIME):
+    """ Runs tasks on workers and returns their exit statuses
+
+      TASKS is a list of (host, classname, method, taskid, environs) tuples.
+      All tasks are sent at once and run concurrently, over one connection
+      per host. If a TIMINGS list is given, the start and end time of each
+      task are appended to it. Tasks not reported finished within TIMEOUT
+      seconds count as failed.
+    """
+    statuses = [-1]*len(tasks)
+    times = [None]*len(tasks)
+    token = _token(path)
+
+    batches = {}
+    for i, task in enumerate(tasks):
+        batches.setdefault(task[0], []).append(i)
+
+    def run(host, indices):
+        started = time.time()
+        index = dict((tasks[i][3], i) for i in indices)
+        try:
+            conn = _connect(path, host, {
+                'action': 'run',
+                'tasks': [dict(zip(FIELDS, tasks[i][1:])) for i in indices]},
+                token)
+            try:
+                lines = conn.makefile('rb')
+                for _ in indices:
+                    conn.settimeout(max(started + timeout - time.time(), 0.01))
+                    reply = _parse(lines.readline())
+                    i = index[reply['taskid']]
+                    statuses[i] = reply.get('status', -1)
+                    times[i] = (started, time.time())
+            finally:
+                conn.close()
+        except (IOError, OSError, socket.error, ValueError, KeyError):
+            pass
+        for i in indices:
+            if times[i] is None:
+                times[i] = (started, time.time())
+
+    threads = [threading.Thread(target=run, args=item)
+               for item in batches.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if timings is not None:
+        timings.extend(times)
+    return statuses
+
+
+def shutdown(path, hosts):
+    """ Asks workers on given hosts to exit
+    """
+    for host in hosts:
+        try:
+            _request(path, host, {'action': 'shutdown'}, timeout=10.)
+        except (IOError, OSError, socket.error, ValueError):
+            pass
+
+
+def _execute(output, request):
+    """ Runs requested task in a forked child; returns exit status
+    """
+    from seisflows.tools.tools import loadobj
+    try:
+        os.environ['SEISFLOWS_TASK_ID'] = str(request['taskid'])
+        for item in request['environs'].strip(',').split(','):
+            if '=' in item:
+                key, val = item.split('=', 1)
+                os.environ[key] = val
+
+        classname, method = request['classname'], request['method']
+        kwargs = loadobj(join(output, 'kwargs', classname+'_'+method+'.p'))
+        func = getattr(sys.modules['seisflows_'+classname], method)
+        func(**kwargs)
+        return 0
+    except:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def _reload(output, load):
+    """ Loads checkpoint, then rebinds module globals of seisflows modules
+      that refer to the objects it replaced
+    """
+    names = [name for name in sys.modules if name.startswith('seisflows_')]
+    old = dict((name, sys.modules[name]) for name in names)
+    load(output)
+    _rebind(dict((id(obj), sys.modules[name]) for name, obj in old.items()
+                 if sys.modules.get(name, obj) is not obj))
+
+
+def _rebind(replaced):
+    """ Rebinds module globals of seisflows modules according to REPLACED,
+      a dict mapping the id of each replaced object to its replacement
+    """
+    if not replaced:
+        return
+    for module in list(sys.modules.values()):
+        if not isinstance(module, types.ModuleType) or \
+           not module.__name__.startswith('seisflows'):
+            continue
+        for key, val in list(vars(module).items()):
+            if id(val) in replaced:
+                setattr(module, key, replaced[id(val)])
+
+
+def _valid(tasks):
+    """ Checks that a run request lists at least one complete task
+    """
+    return isinstance(tasks, list) and len(tasks) > 0 and all(
+        isinstance(task, dict) and all(key in task for key in FIELDS)
+        for task in tasks)
+
+
+def _request(path, host, request, timeout=TIMEOUT):
+    conn = _connect(path, host, request)
+    try:
+        conn.settimeout(timeout)
+        return _recv(conn)
+    finally:
+        conn.close()
+
+
+def _connect(path, host, request, token=None):
+    """ Sends request to worker on host; returns connection awaiting reply
+    """
+    with open(join(path, host)) as f:
+        addr, port = f.read().split()[:2]
+    request['token'] = token or _token(path)
+    conn = socket.create_connection((addr, int(port)), timeout=10.)
+    try:
+        _send(conn, request)
+    except:
+        conn.close()
+        raise
+    return conn
+
+
+def _send(conn, message):
+    conn.sendall((json.dumps(message)+'\n').encode())
+
+
+def _reply(conn, message, close=True):
+    """ Sends reply and, if CLOSE, closes connection; the master may have
+      given up waiting, in which case the reply is dropped
+    """
+    try:
+        _send(conn, message)
+    except (IOError, OSError, socket.error):
+        pass
+    if close:
+        conn.close()
+
+
+def _recv(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        if not chunk:
+            raise ValueError('Connection closed')
+        data += chunk
+    return _parse(data)
+
+
+def _parse(line):
+    if not line.endswith(b'\n'):
+        raise ValueError('Connection closed')
+    return json.loads(line.decode())
+
+
+def _advertise(path, host, port, jobid):
+    tmpfile = join(path, '.'+host)
+    with open(tmpfile, 'w') as f:
+        f.write('%s %d %s %d\n' % (host, port, jobid, os.getpid()))
+    os.rename(tmpfile, join(path, host))
+
+
+def _token(path):
+    """ Reads token shared by master and workers, creating it if necessary
+    """
+    filename = join(path, 'token')
+    if not exists(filename):
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        os.write(fd, binascii.hexlify(os.urandom(16)))
+        os.close(fd)
+    with open(filename) as f:
+        return f.read().strip()
+
+
+def _stamp(output):
+    return max([getmtime(f) for f in glob(join(output, 'seisflows_*'))] or [0])
+
+
+def _exitcode(status):
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return -1
+
+
+def _mkdir(path):
+    if not exists(path):
+        os.makedirs(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='seisflows.system.lib.worker')
+    subparsers = parser.add_subparsers(dest='action')
+
+    p = subparsers.add_parser('serve', help='run worker on this node')
+    p.add_argument('--jobid', default='')
+    p.add_argument('--idle', type=float, default=IDLE)
+    p.add_argument('output')
+    p.add_argument('path')
+
+    args = parser.parse_args()
+    if args.action == 'serve':
+        serve(args.output, args.path, args.jobid, args.idle)
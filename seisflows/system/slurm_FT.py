@@ -9,13 +9,21 @@ from seisflows.tools import msg
 from seisflows.tools import unix
 from seisflows.tools.tools import call, findpath, saveobj, timestamp
 from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib.startup import lazy
+
+accounting = lazy('accounting')
+arrays = lazy('arrays')
+metrics = lazy('metrics')
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
 
 
-class slurm_FT(custom_import('system', 'slurm_lg')):
+class slurm_FT(custom_import('system', 'slurm_lg_hpc')):
     """ Adds fault tolerance to slurm_lg
+
+      Failed tasks are resubmitted; core-hours lost to failed attempts are
+      reported as retry waste under ACCOUNTING.
     """
 
     def check(self):
@@ -25,13 +33,11 @@ class slurm_FT(custom_import('system', 'slurm_lg')):
 
 
     def resubmit_failed_job(self, classname, method, jobs, taskid):
-        with open(PATH.SYSTEM+'/'+'job_id', 'w') as file:
-            call(self.resubmit_cmd(classname, method, taskid),
-                stdout=file)
-
-        with open(PATH.SYSTEM+'/'+'job_id', 'r') as file:
-            line = file.readline()
-            jobid = line.split()[-1].strip()
+        jobid = self.client().submit(
+            self.resubmit_cmd(classname, method, taskid))
+        accounting.submitted([jobid], [taskid])
+        metrics.inc('seisflows_task_retries_total', help='Tasks resubmitted',
+                    stage=classname+'.'+method)
 
         # remove failed job from list
         jobs.pop(taskid)
@@ -45,24 +51,21 @@ class slurm_FT(custom_import('system', 'slurm_lg')):
         return ('sbatch '
                 + '%s ' % PAR.SLURMARGS
                 + '--job-name=%s ' % PAR.TITLE
-                + '--nodes=%d ' % math.ceil(PAR.NPROC/float(PAR.NODESIZE))
-                + '--ntasks-per-node=%d ' % PAR.NODESIZE
-                + '--ntasks=%d ' % PAR.NPROC
+                + self.resource_args()
                 + '--time=%d ' % PAR.TASKTIME
-                + '--output=%s ' % (PATH.WORKDIR+'/'+'output.slurm/'+'%j')
+                + '--output=%s ' % self.task_output('%j')
                 + '--export=TASKID=%d ' % taskid
-                + findpath('seisflows.system') +'/'+ 'wrappers/run '
-                + PATH.OUTPUT + ' '
-                + classname + ' '
-                + method + ' ' 
-                + PAR.ENVIRONS)
+                + self.task_cmd(classname, method, taskid))
 
 
     def taskid(self):
         """ Provides a unique identifier for each running task
         """
         if os.getenv('SLURM_ARRAY_TASK_ID'):
-            return int(os.getenv('SLURM_ARRAY_TASK_ID'))
+            return arrays.taskid(os.getenv('SLURM_ARRAY_TASK_ID'))
+        elif os.getenv('SEISFLOWS_TASK_ID'):
+            # task run within master
+            return int(os.getenv('SEISFLOWS_TASK_ID'))
         else:
             try:
                 return int(os.getenv('TASKID'))
@@ -70,7 +73,7 @@ class slurm_FT(custom_import('system', 'slurm_lg')):
                 raise Exception("TASKID environment variable not defined.")
 
 
-    def job_array_status(self, classname, method, jobs):
+    def task_status(self, classname, method, jobs):
         """ Determines completion status of one or more jobs
         """
         states = []
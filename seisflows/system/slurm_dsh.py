@@ -3,14 +3,30 @@ import os
 import re
 import sys
 
-from os.path import abspath, basename, join
+from hashlib import md5
+
+from os.path import abspath, basename, dirname, join
 from seisflows.tools import unix
 from seisflows.tools.tools import call, findpath, saveobj
 from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import startup
+from seisflows.system.lib.startup import lazy
+
+# helpers are imported on first use, so that tasks import only what they need
+accounting = lazy('accounting')
+inprocess = lazy('inprocess')
+metrics = lazy('metrics')
+reduction = lazy('reduction')
+requeue = lazy('requeue')
+scheduler = lazy('scheduler')
+worker = lazy('worker')
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
 
+# host list of each allocation
+_hostlists = {}
+
 
 class slurm_dsh(custom_import('system', 'base')):
     """ An interface through which to WORKDIR workflows, run tasks in serial or 
@@ -26,6 +42,24 @@ class slurm_dsh(custom_import('system', 'base')):
       Optionally, users can provide a local scratch path PATH.LOCAL if each
       compute node has its own local filesystem.
 
+      With WORKERS=True, a persistent worker is started on each node the first
+      time tasks are run. Workers keep seisflows and the current checkpoint
+      loaded and fork a child for each task, which avoids starting a new
+      interpreter per task. Task output then goes to one log per node in
+      PATH.SYSTEM/workers.
+
+      Arrays computed by tasks can be summed with contribute and reduce. Tasks
+      call contribute, which writes their array to a node-local filesystem
+      (REDUCEDIR), replacing that of any earlier attempt of the same task.
+      The master then calls reduce, which sums the arrays of each node and
+      combines the node partials in a log-depth tree across nodes, writing
+      only the final sum to the shared filesystem. Contributions are kept in
+      a directory per job; tasks discard those left on their node by earlier
+      jobs.
+
+      INPROCESS, ACCOUNTING, METRICSPORT, SNAPSHOT and REQUEUE behave as in
+      slurm_lg_hpc; see the seisflows.system.lib modules implementing them.
+
       For important additional information, please see 
       http://seisflows.readthedocs.org/en/latest/manual/manual.html#system-configuration
     """
@@ -66,6 +100,33 @@ class slurm_dsh(custom_import('system', 'base')):
         if 'VERBOSE' not in PAR:
             setattr(PAR, 'VERBOSE', 1)
 
+        # whether to run tasks through persistent per-node workers
+        if 'WORKERS' not in PAR:
+            setattr(PAR, 'WORKERS', False)
+
+        # node-local directory in which task contributions are summed
+        if 'REDUCEDIR' not in PAR:
+            setattr(PAR, 'REDUCEDIR', '/dev/shm')
+
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
+        # tasks run within master rather than as separate tasks
+        inprocess.check(PAR)
+
+        # whether to record utilization of each stage
+        accounting.check(PAR)
+
+        # whether master requeues itself before walltime runs out
+        requeue.check(PAR)
+
+        # whether tasks start from a snapshot of PAR and PATH, and record
+        # their start-up times
+        startup.check(PAR)
+
+        # where master serves or writes metrics, if anywhere
+        metrics.check(PAR)
+
         # where job was submitted
         if 'WORKDIR' not in PATH:
             setattr(PATH, 'WORKDIR', abspath('.'))
@@ -98,55 +159,196 @@ class slurm_dsh(custom_import('system', 'base')):
         unix.mkdir(PATH.OUTPUT)
 
         self.checkpoint()
+        startup.update(PAR, PATH)
 
         # submit workflow
-        call('sbatch '
+        cmd = ('sbatch '
                 + '%s ' %  PAR.SLURMARGS
                 + '--job-name=%s '%PAR.TITLE
                 + '--output=%s '%(PATH.WORKDIR +'/'+ 'output.log')
                 + '--cpus-per-task=%d '%PAR.NPROC
                 + '--ntasks=%d '%PAR.NTASK
-                + '--time=%d '%PAR.WALLTIME
-                + findpath('seisflows.system') +'/'+ 'wrappers/submit '
+                + '--time=%d '%PAR.WALLTIME)
+
+        if PAR.REQUEUE:
+            cmd += requeue.args(PAR.REQUEUE)
+
+        cmd += (findpath('seisflows.system') +'/'+ 'wrappers/submit '
                 + PATH.OUTPUT)
 
+        jobid = self.client().submit(cmd)
+        requeue.save(PATH.OUTPUT, cmd)
+
+        print('Submitted batch job %s' % jobid)
+
 
     def run(self, classname, method, hosts='all', **kwargs):
         """ Executes the following task:
               classname.method(*args, **kwargs)
         """
+        if PAR.REQUEUE:
+            requeue.install()
+            if requeue.due(accounting.iteration(), 60.*PAR.WALLTIME):
+                self.requeue()
+        if PAR.METRICSPORT or PAR.METRICSFILE:
+            metrics.start(PAR.METRICSPORT, PAR.METRICSFILE, PATH.SCRATCH,
+                address=PAR.METRICSADDR)
+
+        # allocation in which tasks run, read by tasks from the checkpoint
+        self.jobid = os.getenv('SLURM_JOB_ID', '0')
+
         self.checkpoint()
+        startup.update(PAR, PATH)
+
+        if hosts == 'head' and \
+           inprocess.selected(classname, method, PAR.INPROCESS):
+            # cheap task; run within master
+            inprocess.run(classname, method, kwargs, environs=PAR.ENVIRONS)
+            return
+
         self.save_kwargs(classname, method, kwargs)
 
-        if hosts == 'all':
+        # tasks run inside this allocation, so are timed as they run
+        ntask = PAR.NTASK if hosts == 'all' else 1
+        stage = accounting.start(classname, method, hosts,
+            accounting.iteration(), ntask, PAR.NPROC,
+            allocation=PAR.NTASK*PAR.NPROC)
+
+        # tasks start at once, since nodes are already allocated
+        metrics.stage(classname+'.'+method, ntask)
+        metrics.task_states(['RUNNING']*ntask)
+        stamps = PATH.SYSTEM+'/'+'stamps'+'/'+classname+'_'+method
+        unix.rm(stamps)
+        prefix = accounting.stamp_cmd(stamps) if PAR.ACCOUNTING else ''
+        timings = []
+
+        if PAR.WORKERS:
+            # run through persistent workers
+            timings = self.run_workers(classname, method, hosts)
+
+        elif hosts == 'all':
             # run on all available nodes
             call(findpath('seisflows.system')  +'/'+'wrappers/dsh '
                     + ','.join(self.hostlist()) + ' '
-                    + findpath('seisflows.system')  +'/'+'wrappers/run '
-                    + PATH.OUTPUT + ' '
-                    + classname + ' '
-                    + method + ' ' 
-                    + PAR.ENVIRONS)
+                    + prefix
+                    + self.task_cmd(classname, method))
 
         elif hosts == 'head':
             # run on head node
             call('ssh ' + self.hostlist()[0] + ' '
                     + '"'
                     + 'export SEISFLOWS_TASK_ID=0; '
-                    + join(findpath('seisflows.system'), 'wrappers/run ')
-                    + PATH.OUTPUT + ' '
-                    + classname + ' '
-                    + method + ' '
-                    + PAR.ENVIRONS
+                    + prefix
+                    + self.task_cmd(classname, method)
                     +'"')
 
         else:
             raise(KeyError('Hosts parameter not set/recognized.'))
 
+        metrics.task_states(['COMPLETED']*ntask)
+
+        if PAR.ACCOUNTING:
+            try:
+                accounting.save(PATH.WORKDIR+'/'+'output.accounting',
+                    accounting.finish(stage, timings + accounting.stamps(stamps)))
+            except Exception as e:
+                print(' accounting failed: %s' % e)
+
+
+
+    def requeue(self):
+        """ Checkpoints workflow and hands over to a continuation job
+        """
+        # continuation starts with the iteration about to begin; set
+        # directly, since parameters cannot otherwise be changed once defined
+        PAR.__dict__['BEGIN'] = accounting.iteration()
+
+        # submitted first, so that a failure leaves this master running
+        jobid = requeue.resubmit(PATH.OUTPUT, self.client(),
+            os.getenv('SLURM_JOB_ID'))
+        self.checkpoint()
+
+        print(' walltime nearly over; continuing as job %s' % jobid)
+        sys.exit(0)
+
+
+    def run_workers(self, classname, method, hosts='all'):
+        """ Executes tasks through persistent per-node workers; returns
+          start and end of each task
+        """
+        hostlist = self.hostlist()
+        if hosts == 'all':
+            tasks = [(host, classname, method, taskid, PAR.ENVIRONS)
+                     for taskid, host in enumerate(hostlist)]
+        elif hosts == 'head':
+            tasks = [(hostlist[0], classname, method, 0, PAR.ENVIRONS)]
+        else:
+            raise(KeyError('Hosts parameter not set/recognized.'))
+
+        path = PATH.SYSTEM+'/'+'workers'
+        worker.start(sorted(set([task[0] for task in tasks])),
+            PATH.OUTPUT, path, os.getenv('SLURM_JOB_ID', ''))
+
+        # tasks cannot outlast the allocation, given in minutes
+        timings = []
+        statuses = worker.dispatch(path, tasks, timings, 60.*PAR.WALLTIME)
+        failed = [str(task[3]) for task, status in zip(tasks, statuses) if status]
+        if failed:
+            print(' tasks %s failed; see %s' % (','.join(failed), path))
+            sys.exit(-1)
+
+        return [{'taskid': task[3], 'state': 'COMPLETED', 'start': t0, 'end': t1}
+                for task, (t0, t1) in zip(tasks, timings)]
+
+
+    def task_cmd(self, classname, method):
+        """ Returns command executed by each task
+        """
+        return startup.task_cmd(PAR, PATH, classname, method)
+
+
+    def contribute(self, key, array):
+        """ Adds array to the sum stored under key; called from within tasks
+        """
+        path = self.reduce_path()
+
+        # discard contributions left on this node by earlier jobs
+        reduction.discard(dirname(path), path)
+        reduction.contribute(join(path, key), self.taskid(), array)
+
+
+    def reduce(self, key, path):
+        """ Sums arrays contributed by tasks under key and saves result to path
+        """
+        hostlist = self.hostlist()
+        hosts = sorted(set(hostlist), key=hostlist.index)
+
+        statuses = reduction.tree(hosts, key, self.reduce_path(),
+            PATH.SCRATCH+'/'+'reduce', path)
+
+        if any(statuses):
+            raise Exception('Reduction of %s failed' % key)
+
+
+    def reduce_path(self):
+        """ Returns node-local directory in which contributions of the current
+          job are summed
+        """
+        return join(PAR.REDUCEDIR,
+            'seisflows_' + md5(PATH.SCRATCH.encode()).hexdigest()[:12],
+            self.jobid)
+
 
     def hostlist(self):
-        """ Generates list of allocated cores
+        """ Generates list of allocated cores; resolved once per allocation
         """
+        jobid = os.getenv('SLURM_JOB_ID')
+        if jobid not in _hostlists:
+            _hostlists[jobid] = self._hostlist()
+        return list(_hostlists[jobid])
+
+
+    def _hostlist(self):
         tasks_per_node = []
         for pattern in os.getenv('SLURM_TASKS_PER_NODE').split(','):
             match = re.search('([0-9]+)\(x([0-9]+)\)', pattern)
@@ -156,11 +358,8 @@ class slurm_dsh(custom_import('system', 'base')):
             else:
                 tasks_per_node += [int(pattern)]
 
-        with open(PATH.SYSTEM+'/'+'job_nodelist', 'w') as f:
-            call('scontrol show hostname $SLURM_JOB_NODEFILE', stdout=f)
-
-        with open(PATH.SYSTEM+'/'+'job_nodelist', 'r') as f:
-            nodes = f.read().splitlines() 
+        nodes = self.client().call(
+            'scontrol show hostname $SLURM_JOB_NODEFILE').split()
 
         nodelist = []
         for i,j in zip(nodes, tasks_per_node):
@@ -181,6 +380,12 @@ class slurm_dsh(custom_import('system', 'base')):
         #return 'mpirun -np %d '%PAR.NPROC
 
 
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
+
+
     def save_kwargs(self, classname, method, kwargs):
         kwargspath = join(PATH.OUTPUT, 'kwargs')
         kwargsfile = join(kwargspath, classname+'_'+method+'.p')
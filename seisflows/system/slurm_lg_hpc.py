@@ -0,0 +1,586 @@
+
+import math
+import os
+import sys
+
+from seisflows.tools import unix
+from seisflows.tools.tools import findpath
+from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import startup
+from seisflows.system.lib.startup import lazy
+
+# helpers are imported on first use, so that tasks import only what they need
+accounting = lazy('accounting')
+arrays = lazy('arrays')
+cleanup = lazy('cleanup')
+inprocess = lazy('inprocess')
+logs = lazy('logs')
+master = lazy('master')
+metrics = lazy('metrics')
+planner = lazy('planner')
+provision = lazy('provision')
+reduction = lazy('reduction')
+requeue = lazy('requeue')
+scaling = lazy('scaling')
+scheduler = lazy('scheduler')
+
+PAR = sys.modules['seisflows_parameters']
+PATH = sys.modules['seisflows_paths']
+
+
+class slurm_lg_hpc(custom_import('system', 'slurm_lg')):
+    """ Extends slurm_lg with the options provided by this package
+
+      Cluster-specific interfaces built on slurm_lg inherit from this class,
+      so that these options are available on every such cluster. Each option
+      is described where it is checked below and in the seisflows.system.lib
+      module implementing it.
+
+      See parent class SLURM_LG for more information
+    """
+
+    def check(self):
+        """ Checks parameters and paths
+        """
+        # how task output is written: 'files', 'stage' or 'node'
+        if 'LOGMODE' not in PAR:
+            setattr(PAR, 'LOGMODE', 'files')
+
+        # whether aggregated task logs are compressed
+        if 'LOGCOMPRESS' not in PAR:
+            setattr(PAR, 'LOGCOMPRESS', False)
+
+        # whether to remove stale scratch directories while workflow runs
+        if 'CLEANUP' not in PAR:
+            setattr(PAR, 'CLEANUP', False)
+
+        # number of iterations kept on scratch during cleanup
+        if 'RETAIN' not in PAR:
+            setattr(PAR, 'RETAIN', 2)
+
+        # fraction of free space on scratch filesystem below which cleanup is
+        # stepped up
+        if 'MINFREE' not in PAR:
+            setattr(PAR, 'MINFREE', 0.05)
+
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
+        # optional SLURM partition for tasks
+        if 'PARTITION' not in PAR:
+            setattr(PAR, 'PARTITION', None)
+
+        # optional list of candidate partitions, tried in turn for each array
+        if 'PARTITIONS' not in PAR:
+            setattr(PAR, 'PARTITIONS', [])
+
+        # where workflow master runs: 'node', 'core' or 'login'
+        if 'MASTER' not in PAR:
+            setattr(PAR, 'MASTER', 'node')
+
+        # whether to follow master output after submitting
+        if 'ATTACH' not in PAR:
+            setattr(PAR, 'ATTACH', False)
+
+        # whether master requeues itself before walltime runs out
+        requeue.check(PAR)
+
+        # optional limit on job array size; by default read from SLURM
+        if 'MAXARRAYSIZE' not in PAR:
+            setattr(PAR, 'MAXARRAYSIZE', None)
+
+        # tasks run within master rather than as separate tasks
+        inprocess.check(PAR)
+
+        # whether to record utilization of each stage
+        accounting.check(PAR)
+
+        # where master serves or writes metrics, if anywhere
+        metrics.check(PAR)
+
+        # NPROC values tried by scaling probe; [] to keep NPROC as given
+        if 'SCALING' not in PAR:
+            setattr(PAR, 'SCALING', [])
+
+        # benchmark run by scaling probe, in which '{nproc}' is replaced by
+        # the number of cores
+        if 'SCALINGCMD' not in PAR:
+            setattr(PAR, 'SCALINGCMD', None)
+
+        # whether tasks start from a snapshot of PAR and PATH, and record
+        # their start-up times
+        startup.check(PAR)
+
+        # template for task working directories, and how it is replicated
+        provision.check(PAR, PATH)
+
+        super(slurm_lg_hpc, self).check()
+
+        # where scaling probe choices are recorded
+        if 'SCALING' not in PATH:
+            setattr(PATH, 'SCALING', PATH.WORKDIR+'/'+'output.scaling')
+
+        if PAR.SCALING and not PAR.SCALINGCMD:
+            raise ParameterError(PAR, 'SCALINGCMD')
+
+        # a mesh partitioned in advance fixes the number of cores
+        if PAR.SCALING and 'MODEL_INIT' in PATH:
+            nproc = scaling.partitions(PATH.MODEL_INIT)
+            if nproc and set(PAR.SCALING) != set([nproc]):
+                raise ParameterError(PAR, 'SCALING')
+
+        assert PAR.LOGMODE in ['files', 'stage', 'node']
+        assert PAR.MASTER in master.MODES
+
+
+    def submit(self, workflow):
+        """ Submits workflow
+        """
+        if self.reattach():
+            return
+
+        # create scratch directories
+        unix.mkdir(PATH.SCRATCH)
+        unix.mkdir(PATH.SYSTEM)
+
+        # create output directories
+        unix.mkdir(PATH.OUTPUT)
+        unix.mkdir(PATH.WORKDIR+'/'+'output.slurm')
+
+        # mark scratch tree and populate task working directories
+        self.prepare_scratch()
+
+        # choose NPROC before it is checkpointed; the workflow is submitted
+        # again once the scaling probe has finished
+        if PAR.SCALING and not self.calibrate():
+            return
+
+        workflow.checkpoint()
+        startup.update(PAR, PATH)
+
+        # prepare sbatch arguments
+        args = ('%s ' % PAR.SLURMARGS
+                + '--job-name=%s ' % PAR.TITLE
+                + self.master_args()
+                + '--time=%d ' % PAR.WALLTIME)
+
+        if planner.given(PAR.SLURMARGS):
+            pass
+        elif PAR.PARTITIONS and PAR.MASTER != 'login':
+            args += '--partition=%s ' % planner.earliest(self.client(),
+                PAR.PARTITIONS, args)
+        elif PAR.PARTITION:
+            args += '--partition=%s ' % PAR.PARTITION
+
+        if PAR.REQUEUE:
+            args += requeue.args(PAR.REQUEUE)
+
+        self.launch_master(args)
+
+
+    def run(self, classname, method, hosts='all', **kwargs):
+        """ Executes the following task:
+              classname.method(*args, **kwargs)
+        """
+        if PAR.REQUEUE and PAR.MASTER != 'login':
+            requeue.install()
+            if requeue.due(accounting.iteration(), 60.*PAR.WALLTIME):
+                self.requeue()
+        if PAR.CLEANUP:
+            cleanup.start(PATH.SCRATCH, retain=PAR.RETAIN, minfree=PAR.MINFREE,
+                client=self.client())
+        if PAR.METRICSPORT or PAR.METRICSFILE:
+            metrics.start(PAR.METRICSPORT, PAR.METRICSFILE, PATH.SCRATCH,
+                address=PAR.METRICSADDR)
+
+        if hosts == 'head' and \
+           inprocess.selected(classname, method, PAR.INPROCESS):
+            # cheap task; run within master
+            inprocess.run(classname, method, kwargs, environs=PAR.ENVIRONS)
+            return
+
+        ntask = PAR.NTASK if hosts == 'all' else 1
+        metrics.stage(classname+'.'+method, ntask)
+        stage = accounting.start(classname, method, hosts,
+            accounting.iteration(), ntask, PAR.NPROC,
+            PAR.NGPU if 'NGPU' in PAR else 0,
+            held=self.allocated() if PAR.ACCOUNTING else None)
+
+        self.clear_contributions()
+        super(slurm_lg_hpc, self).run(classname, method, hosts, **kwargs)
+        self.account(stage)
+
+
+    def checkpoint(self):
+        """ Writes checkpoint, along with snapshot of PAR and PATH read by
+          tasks
+        """
+        super(slurm_lg_hpc, self).checkpoint()
+        startup.update(PAR, PATH)
+
+
+    def calibrate(self):
+        """ Sets NPROC from scaling probe, reusing a recorded choice if any;
+          returns False if the probe has yet to finish
+        """
+        key = scaling.key(
+            system=self.__class__.__name__,
+            command=PAR.SCALINGCMD,
+            nprocs=sorted(PAR.SCALING),
+            ntask=PAR.NTASK,
+            nodesize=PAR.NODESIZE)
+
+        result = scaling.lookup(PATH.SCALING, key)
+        if result is None:
+            path = scaling.directory(PATH.SCALING, key)
+            jobs = scaling.jobs(path)
+            if not jobs:
+                self.probe(path)
+                return False
+
+            states = [metrics.category(self._query(job)) for job in jobs]
+            if not all(state in ['completed', 'failed'] for state in states):
+                print(' scaling probe still running as jobs %s; submit again '
+                      'once it has finished' % ', '.join(jobs))
+                return False
+
+            result = self.fit(path, key)
+
+        if result is None:
+            # probe is repeated by the next submission
+            unix.rm(scaling.directory(PATH.SCALING, key))
+            print(' scaling probe failed; keeping NPROC=%d' % PAR.NPROC)
+            return True
+
+        # set directly, since parameters cannot otherwise be changed once
+        # defined; candidates were checked against the mesh by check
+        PAR.__dict__['NPROC'] = result['nproc']
+        print(' NPROC=%d chosen by scaling probe' % result['nproc'])
+        return True
+
+
+    def probe(self, path):
+        """ Submits scaling benchmark at each NPROC value, with the resources
+          and launcher of tasks with that NPROC
+        """
+        unix.rm(path)
+
+        jobs = []
+        for value in PAR.SCALING:
+            jobs += [self.client().submit('sbatch '
+                + '%s ' % PAR.SLURMARGS
+                + '--job-name=%s ' % PAR.TITLE
+                + self.resource_args(value)
+                + '--time=%d ' % PAR.TASKTIME
+                + '--output=%s ' % self.task_output('%j')
+                + "--wrap='%s'" % scaling.prepare(path, value,
+                    self.mpiexec(value), PAR.SCALINGCMD))]
+        scaling.submitted(path, jobs)
+
+        print(' submitted scaling probe as jobs %s; submit again once it has '
+              'finished' % ', '.join(jobs))
+
+
+    def fit(self, path, key):
+        """ Fits scaling curve to timings of finished probe, then records and
+          returns choice, or None if every run failed
+        """
+        timings = scaling.timings(path)
+        if not timings:
+            return None
+
+        model = scaling.fit(timings)
+        result = scaling.choose(model, list(timings), PAR.NTASK, PAR.NODESIZE)
+        result.update(model=model, timings=timings)
+        scaling.record(PATH.SCALING, key, result)
+        print(scaling.report(result))
+        return result
+
+
+    def job_array_status(self, classname, method, jobs):
+        """ Determines completion status of job array, recording task states
+          as metrics
+        """
+        with metrics.timer('seisflows_poll_seconds',
+                           'Time taken to poll task states'):
+            isdone, jobs = self.task_status(classname, method, jobs)
+        if PAR.METRICSPORT or PAR.METRICSFILE:
+            # reuses output of the queries just made
+            metrics.task_states([self._query(job) for job in jobs])
+        return isdone, jobs
+
+
+    def task_status(self, classname, method, jobs):
+        """ Determines completion status of each task; overridden by
+          subclasses that handle failed tasks differently
+        """
+        return super(slurm_lg_hpc, self).job_array_status(classname, method,
+            jobs)
+
+
+    def account(self, stage):
+        """ Records utilization of a completed stage
+        """
+        if not PAR.ACCOUNTING:
+            return
+        try:
+            tasks = accounting.sacct(self.client(), list(stage['jobs']))
+            accounting.save(PATH.WORKDIR+'/'+'output.accounting',
+                accounting.finish(stage, tasks))
+        except Exception as e:
+            print(' accounting failed: %s' % e)
+
+
+    def requeue(self):
+        """ Checkpoints workflow and hands over to a continuation job
+        """
+        # continuation starts with the iteration about to begin; set
+        # directly, since parameters cannot otherwise be changed once defined
+        PAR.__dict__['BEGIN'] = accounting.iteration()
+
+        # submitted first, so that a failure leaves this master running
+        jobid = requeue.resubmit(PATH.OUTPUT, self.client(),
+            os.getenv('SLURM_JOB_ID'))
+        self.checkpoint()
+
+        master.record(PATH.OUTPUT, jobid=jobid,
+            log=PATH.WORKDIR+'/'+'output.log')
+        cleanup.mark(PATH.SCRATCH, PATH.WORKDIR, jobid)
+        print(' walltime nearly over; continuing as job %s' % jobid)
+        sys.exit(0)
+
+
+    def contribute(self, key, array):
+        """ Adds array to the sum stored under key; called from within tasks
+        """
+        reduction.contribute(PATH.SCRATCH+'/'+'reduce/'+key,
+            self.taskid(), array)
+
+
+    def reduce(self, key, path):
+        """ Sums arrays contributed by tasks under key and saves result to path
+        """
+        reduction.merge(
+            reduction.contributions(PATH.SCRATCH+'/'+'reduce/'+key), path)
+        reduction.clear(PATH.SCRATCH+'/'+'reduce/'+key)
+
+
+    def clear_contributions(self):
+        """ Discards contributions left by an earlier master, e.g. one that
+          failed before reducing them; those of this master are kept until
+          reduced
+        """
+        reduction.reset(PATH.SCRATCH+'/'+'reduce')
+
+
+    def prepare_scratch(self):
+        """ Links working directory to scratch tree, marks the tree as
+          belonging to this workflow and builds template of task working
+          directories
+        """
+        # an earlier submission's tree is no longer linked to, so that it can
+        # be recognized as orphaned
+        cleanup.link(PATH.SCRATCH, PATH.WORKDIR)
+        cleanup.mark(PATH.SCRATCH, PATH.WORKDIR)
+        provision.install(PAR, PATH)
+
+
+    def reattach(self):
+        """ Attaches to workflow master if one is already running; returns
+          True if so. Raises master.UnknownError, so that no second master is
+          submitted, if it cannot be told whether one is running
+        """
+        if not master.alive(PATH.OUTPUT, self.client()):
+            return False
+        print('Workflow master already %s; attaching (Ctrl-C to detach)'
+              % master.describe(PATH.OUTPUT, self.client()))
+        master.attach(PATH.OUTPUT, self.client())
+        return True
+
+
+    def master_args(self):
+        """ Returns resources requested by master job
+        """
+        if PAR.MASTER == 'core':
+            return '--nodes=1 --ntasks=1 --cpus-per-task=1 '
+        return '--ntasks-per-node=%d --nodes=1 ' % PAR.NODESIZE
+
+
+    def launch_master(self, args):
+        """ Starts workflow master; ARGS are sbatch arguments of master job
+        """
+        cmd = (findpath('seisflows.system') +'/'+ 'wrappers/submit '
+               + PATH.OUTPUT)
+        log = PATH.WORKDIR+'/'+'output.log'
+
+        if PAR.MASTER == 'login':
+            pid = master.launch(cmd, log, PATH.OUTPUT)
+            print('Started workflow master as process %d' % pid)
+        else:
+            cmd = 'sbatch ' + args + '--output=%s ' % log + cmd
+            jobid = self.client().submit(cmd)
+            requeue.save(PATH.OUTPUT, cmd)
+            master.record(PATH.OUTPUT, jobid=jobid, log=log)
+            cleanup.mark(PATH.SCRATCH, PATH.WORKDIR, jobid)
+            print('Submitted batch job %s' % jobid)
+
+        if PAR.ATTACH:
+            master.attach(PATH.OUTPUT, self.client())
+
+
+    def submit_job_array(self, classname, method, hosts='all'):
+        """ Submits job array and returns ID of each task
+
+          Arrays larger than the scheduler allows are split into sub-arrays;
+          task IDs are returned in global task order.
+        """
+        if hosts != 'all':
+            job = self.client().submit(
+                self.job_array_cmd(classname, method, hosts))
+            accounting.submitted([job+'_'+'0'])
+            return [job+'_'+'0']
+
+        jobs = []
+        maxsize = PAR.MAXARRAYSIZE or arrays.slurm_limit(self.client())
+        for offset, count in arrays.split(PAR.NTASK, maxsize):
+            job = self.client().submit(
+                self.job_array_cmd(classname, method, hosts, offset, count))
+            jobs += [job+'_'+str(ii) for ii in range(count)]
+        accounting.submitted(jobs)
+        return jobs
+
+
+    def job_array_cmd(self, classname, method, hosts, offset=0, count=None):
+        return ('sbatch '
+                + '%s ' % PAR.SLURMARGS
+                + '--job-name=%s ' % PAR.TITLE
+                + self.resource_args()
+                + '--time=%d ' % PAR.TASKTIME
+                + self.job_array_args(hosts, offset, count)
+                + self.task_cmd(classname, method, arrays.SLURM_TASKID))
+
+
+    def job_array_args(self, hosts, offset=0, count=None):
+        if hosts == 'all':
+            # sub-arrays share the limit on concurrent tasks
+            count = count or PAR.NTASK
+            ntaskmax = max(1, PAR.NTASKMAX*count//PAR.NTASK)
+            args = ('--array=%d-%d%%%d ' % (0, count-1, ntaskmax)
+                   +'--output=%s ' % self.task_output('%A_%a'))
+            if offset:
+                args += '--export=ALL,%s=%d ' % (arrays.OFFSET, offset)
+
+        elif hosts == 'head':
+            args = ('--array=%d-%d ' % (0, 0)
+                   +'--output=%s ' % self.task_output('%j'))
+
+        else:
+            raise(KeyError('Hosts parameter not set/recognized.'))
+
+        return args
+
+
+    def taskid(self):
+        """ Provides a unique identifier for each running task
+        """
+        if os.getenv('SLURM_ARRAY_TASK_ID') is None:
+            # task run within master
+            return int(os.getenv('SEISFLOWS_TASK_ID', 0))
+        return arrays.taskid(os.getenv('SLURM_ARRAY_TASK_ID'))
+
+
+    def resource_args(self, nproc=None):
+        """ Returns partition and node shape requested by each task, of
+          NPROC cores if given rather than PAR.NPROC
+        """
+        if nproc is None:
+            nproc = PAR.NPROC
+
+        partition, nodes, ntasks_per_node = self.shape(nproc)
+
+        args = ('--nodes=%d ' % nodes
+               +'--ntasks-per-node=%d ' % ntasks_per_node
+               +'--ntasks=%d ' % nproc)
+        if partition:
+            args = '--partition=%s ' % partition + args
+        return args
+
+
+    def shape(self, nproc):
+        """ Returns partition, number of nodes and tasks per node requested
+          by each task of NPROC cores
+        """
+        if PAR.PARTITIONS and not planner.given(PAR.SLURMARGS):
+            return planner.plan(self.client(), PAR.PARTITIONS, nproc,
+                PAR.NODESIZE, '%s --time=%d' % (PAR.SLURMARGS, PAR.TASKTIME))
+
+        # partition named in SLURMARGS takes precedence
+        partition = None if planner.given(PAR.SLURMARGS) else PAR.PARTITION
+        nodes = int(math.ceil(nproc/float(PAR.NODESIZE)))
+        return partition, nodes, PAR.NODESIZE
+
+
+    def allocated(self, nproc=None):
+        """ Returns number of cores charged for each task, which holds the
+          whole nodes requested by resource_args
+        """
+        if nproc is None:
+            nproc = PAR.NPROC
+
+        partition, nodes, ntasks_per_node = self.shape(nproc)
+        if PAR.PARTITIONS and not planner.given(PAR.SLURMARGS):
+            return nodes*min(PAR.NODESIZE,
+                planner.cores(self.client(), partition) or PAR.NODESIZE)
+        return nodes*PAR.NODESIZE
+
+
+    def mpiexec(self, nproc=None):
+        """ Specifies MPI executable used to invoke solver, on NPROC cores if
+          given rather than all those allocated by resource_args
+        """
+        if nproc is None:
+            return super(slurm_lg_hpc, self).mpiexec()
+        return 'srun -u -n %d ' % nproc
+
+
+    def task_cmd(self, classname, method, taskid):
+        """ Returns command executed by each task
+        """
+        cmd = startup.task_cmd(PAR, PATH, classname, method)
+
+        if PAR.LOGMODE == 'files' and not PAR.SNAPSHOT:
+            return cmd
+        elif PAR.LOGMODE == 'files':
+            # not a batch script, so run through a shell
+            return "--wrap='%s' " % cmd
+
+        # output is piped through aggregated logger; single quotes defer
+        # expansion of taskid until the task starts
+        logfile = logs.logfile(PATH.WORKDIR+'/'+'output.logs',
+            classname, method, PAR.LOGMODE, PAR.LOGCOMPRESS)
+
+        return "--wrap='%s' " % logs.wrap(logfile, cmd, taskid, PAR.LOGCOMPRESS)
+
+
+    def task_output(self, pattern):
+        """ Returns scheduler output file for a task
+        """
+        if PAR.LOGMODE == 'files':
+            return PATH.WORKDIR+'/'+'output.slurm/'+pattern
+        else:
+            return '/dev/null'
+
+
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
+
+
+    def _query(self, jobid):
+        """ Queries job state from SLURM database
+
+          All tasks of an array are queried at once; the result is reused for
+          the remaining tasks of the same polling cycle.
+        """
+        return self.client().state(jobid, ttl=10.)
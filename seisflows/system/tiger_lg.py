@@ -11,7 +11,7 @@ PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
 
 
-class tiger_lg(custom_import('system', 'slurm_lg')):
+class tiger_lg(custom_import('system', 'slurm_lg_hpc')):
     """ Specially designed system interface for tiger.princeton.edu
 
       See parent class SLURM_LG for more information
@@ -35,11 +35,3 @@ class tiger_lg(custom_import('system', 'slurm_lg')):
 
         super(tiger_lg, self).check()
 
-
-    def submit(self, *args, **kwargs):
-        """ Submits job
-        """
-        if not exists(PATH.WORKDIR + '/' + 'scratch'):
-            unix.ln(PATH.SCRATCH, PATH.WORKDIR + '/' + 'scratch')
-        super(tiger_lg, self).submit(*args, **kwargs)
-
@@ -5,7 +5,9 @@ from getpass import getuser
 from os.path import abspath, exists
 from uuid import uuid4
 from seisflows.tools import unix
+from seisflows.tools.tools import findpath
 from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import provision, scheduler
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
@@ -28,16 +30,50 @@ class tiger_sm(custom_import('system', 'slurm_sm')):
         if 'SCRATCH' not in PATH:
             setattr(PATH, 'SCRATCH', PATH.WORKDIR+'/'+'scratch')
 
+        # template for task working directories, and how it is replicated
+        provision.check(PAR, PATH)
+
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
         super(tiger_sm, self).check()
 
 
-    def submit(self, *args, **kwargs):
-        """ Submits job
+    def submit(self, workflow):
+        """ Submits workflow
         """
         if not exists(PATH.SCRATCH):
             path = '/scratch/gpfs'+'/'+getuser()+'/'+'seisflows'+'/'+str(uuid4())
             unix.mkdir(path)
             unix.ln(path, PATH.SCRATCH)
 
-        super(tiger_sm, self).submit(*args, **kwargs)
+        # have solver setup populate task working directories from template
+        provision.install(PAR, PATH)
+
+        # create scratch directories
+        unix.mkdir(PATH.SCRATCH)
+        unix.mkdir(PATH.SYSTEM)
+
+        # create output directories
+        unix.mkdir(PATH.OUTPUT)
+
+        self.checkpoint()
 
+        # submit workflow
+        jobid = self.client().submit('sbatch '
+                + '%s ' %  PAR.SLURMARGS
+                + '--job-name=%s '%PAR.TITLE
+                + '--output=%s '%(PATH.WORKDIR +'/'+ 'output.log')
+                + '--cpus-per-task=%d '%PAR.NPROC
+                + '--ntasks=%d '%PAR.NTASK
+                + '--time=%d '%PAR.WALLTIME
+                + findpath('seisflows.system') +'/'+ 'wrappers/submit '
+                + PATH.OUTPUT)
+
+        print('Submitted batch job %s' % jobid)
+
+
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
@@ -11,7 +11,7 @@ PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
 
 
-class tigercpu_lg(custom_import('system', 'slurm_lg')):
+class tigercpu_lg(custom_import('system', 'slurm_lg_hpc')):
     """ Specially designed system interface for tigercpu.princeton.edu
 
       See parent class SLURM_LG for more information
@@ -36,11 +36,3 @@ class tigercpu_lg(custom_import('system', 'slurm_lg')):
         super(tigercpu_lg, self).check()
 
 
-    def submit(self, *args, **kwargs):
-        """ Submits job
-        """
-        if not exists(PATH.WORKDIR + '/' + 'scratch'):
-            unix.ln(PATH.SCRATCH, PATH.WORKDIR + '/' + 'scratch')
-        super(tigercpu_lg, self).submit(*args, **kwargs)
-
-
@@ -12,7 +12,7 @@ PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
 
 
-class tigergpu_lg(custom_import('system', 'slurm_lg')):
+class tigergpu_lg(custom_import('system', 'slurm_lg_hpc')):
     """ Specially designed system interface for tigergpu.princeton.edu
 
       See parent class for more information.
@@ -43,7 +43,7 @@ class tigergpu_lg(custom_import('system', 'slurm_lg')):
         assert PAR.NPROC <= 28
 
 
-    def submit(self, *args, **kwargs):
+    def submit(self, workflow):
         """ Submits job
         """
         # create scratch directories
@@ -52,50 +52,34 @@ class tigergpu_lg(custom_import('system', 'slurm_lg')):
             unix.mkdir(path)
             unix.ln(path, PATH.SCRATCH)
 
-        unix.mkdir(PATH.SYSTEM)
+        super(tigergpu_lg, self).submit(workflow)
 
-        # create output directories
-        unix.mkdir(PATH.OUTPUT)
-        unix.mkdir(PATH.WORKDIR+'/'+'output.slurm')
 
-        self.checkpoint()
+    def master_args(self):
+        """ Returns resources requested by master job
+        """
+        if PAR.MASTER == 'node':
+            return ('--ntasks-per-node=%d ' % 28
+                    + '--gres=gpu:%d ' % 4
+                    + '--nodes=%d ' % 1)
+        return super(tigergpu_lg, self).master_args()
 
-        if not exists(PATH.SCRATCH):
-            path = '/scratch/gpfs'+'/'+getuser()+'/'+'seisflows'+'/'+str(uuid4())
-            unix.mkdir(path)
-            unix.ln(path, PATH.SCRATCH)
 
-        call('sbatch '
-                + '%s ' % PAR.SLURMARGS
-                + '--job-name=%s ' % PAR.TITLE
-                + '--output=%s ' % (PATH.WORKDIR+'/'+'output.log')
-                + '--ntasks-per-node=%d ' % 28
-                + '--gres=gpu:%d ' % 4
-                + '--nodes=%d ' % 1
-                + '--time=%d ' % PAR.WALLTIME
-                + pkgpath('seisflows') +'/'+ 'system/wrappers/submit '
-                + PATH.OUTPUT)
-
-
-    def job_array_cmd(self, classname, method, hosts):
-        return ('sbatch '
-                + '%s ' % PAR.SLURMARGS
-                + '--job-name=%s ' % PAR.TITLE
-                + '--nodes=1 '
-                + '--ntasks-per-node=%s ' % PAR.NPROC
+    def resource_args(self, nproc=None):
+        """ Returns node shape and GPUs requested by each task
+        """
+        if nproc is None:
+            nproc = PAR.NPROC
+        return ('--nodes=1 '
+                + '--ntasks-per-node=%s ' % nproc
                 + '--gres=gpu:%d ' % PAR.NGPU
-                + '--ntasks=%d ' % PAR.NPROC
-                + '--time=%d ' % PAR.TASKTIME
-                + self.job_array_args(hosts)
-                + pkgpath('seisflows') +'/'+ 'system/wrappers/run '
-                + PATH.OUTPUT + ' '
-                + classname + ' '
-                + method + ' '
-                + PAR.ENVIRONS)
+                + '--ntasks=%d ' % nproc)
 
 
-    def mpiexec(self):
+    def mpiexec(self, nproc=None):
         """ Specifies MPI executable used to invoke solver
         """
-        return 'mpirun -np %d' % PAR.NPROC
+        if nproc is None:
+            nproc = PAR.NPROC
+        return 'mpirun -np %d' % nproc
 
@@ -7,6 +7,7 @@ from uuid import uuid4
 from seisflows.tools import unix
 from seisflows.tools.tools import call, pkgpath
 from seisflows.config import ParameterError, custom_import
+from seisflows.system.lib import inprocess, scheduler
 
 PAR = sys.modules['seisflows_parameters']
 PATH = sys.modules['seisflows_paths']
@@ -15,7 +16,7 @@ PATH = sys.modules['seisflows_paths']
 class tigergpu_sm(custom_import('system', 'slurm_sm')):
     """ Specially designed system interface for tigergpu.princeton.edu
 
-      See parent class for more information.
+      See parent class SLURM_SM for more information
     """
 
     def check(self):
@@ -32,6 +33,12 @@ class tigergpu_sm(custom_import('system', 'slurm_sm')):
         if 'SCRATCH' not in PATH:
             setattr(PATH, 'SCRATCH', PATH.WORKDIR+'/'+'scratch')
 
+        # tasks run within master rather than as separate tasks
+        inprocess.check(PAR)
+
+        # rate limit, timeout and retries of scheduler commands
+        scheduler.check(PAR)
+
         super(tigergpu_sm, self).check()
 
 
@@ -48,7 +55,7 @@ class tigergpu_sm(custom_import('system', 'slurm_sm')):
         self.checkpoint()
 
         # submit workflow
-        call('sbatch '
+        jobid = self.client().submit('sbatch '
                 + '%s ' %  PAR.SLURMARGS
                 + '--job-name=%s '%PAR.TITLE
                 + '--output=%s '%(PATH.WORKDIR +'/'+ 'output.log')
@@ -60,12 +67,21 @@ class tigergpu_sm(custom_import('system', 'slurm_sm')):
                 + pkgpath('seisflows') +'/'+ 'system/wrappers/submit '
                 + PATH.OUTPUT)
 
+        print('Submitted batch job %s' % jobid)
+
 
     def run(self, classname, method, hosts='all', **kwargs):
         """ Executes the following task:
               classname.method(*args, **kwargs)
         """
         self.checkpoint()
+
+        if hosts == 'head' and \
+           inprocess.selected(classname, method, PAR.INPROCESS):
+            # cheap task; run within master
+            inprocess.run(classname, method, kwargs, environs=PAR.ENVIRONS)
+            return
+
         self.save_kwargs(classname, method, kwargs)
 
         if hosts == 'all':
@@ -96,3 +112,7 @@ class tigergpu_sm(custom_import('system', 'slurm_sm')):
         return 'mpirun -np %d --mca plm isolated --mca ras simulator ' % PAR.NPROC
 
 
+    def client(self):
+        """ Returns client through which scheduler commands are issued
+        """
+        return scheduler.client(PAR.CMDRATE, PAR.CMDTIMEOUT, PAR.CMDRETRIES)
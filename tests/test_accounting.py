@@ -0,0 +1,48 @@
+
+import os
+import subprocess
+
+from seisflows.system.lib import accounting
+
+
+def run(cmd, taskid):
+    env = dict(os.environ, SEISFLOWS_TASK_ID=str(taskid))
+    return subprocess.call(cmd, shell=True, env=env)
+
+
+def test_stamps(tmpdir):
+    directory = str(tmpdir.join('stamps'))
+    prefix = accounting.stamp_cmd(directory)
+
+    assert run(prefix + 'true', 0) == 0
+    assert run(prefix + 'sh -c "exit 3"', 1) == 3
+
+    tasks = sorted(accounting.stamps(directory), key=lambda t: t['taskid'])
+    assert [(t['taskid'], t['state']) for t in tasks] == \
+        [(0, 'COMPLETED'), (1, 'FAILED')]
+    for task in tasks:
+        assert 0. <= task['end'] - task['start'] < 60.
+
+
+def test_incomplete_stamps_ignored(tmpdir):
+    with open(str(tmpdir.join('0.123.txt')), 'w') as f:
+        f.write('0 0 1.')
+
+    assert accounting.stamps(str(tmpdir)) == []
+
+
+def test_iteration():
+    assert accounting.iteration() is None
+
+
+def test_whole_nodes_charged():
+    # 20-core tasks each holding a 40-core node
+    stage = accounting.start('solver', 'eval_func', 'all', 1, ntask=2,
+                             cores=20, held=40)
+    tasks = [{'taskid': i, 'state': 'COMPLETED', 'start': 1., 'end': 3601.}
+             for i in range(2)]
+    stage = accounting.finish(stage, tasks)
+
+    assert stage['charged'] == 80.
+    assert stage['busy'] == 40.
+    assert stage['efficiency'] == 0.5
@@ -0,0 +1,50 @@
+
+import os
+import subprocess
+
+from seisflows.system.lib import arrays
+
+
+def test_split_within_limit():
+    assert arrays.split(100, 1000) == [(0, 100)]
+
+
+def test_split_into_even_sub_arrays():
+    chunks = arrays.split(2500, 1000)
+
+    assert chunks == [(0, 833), (833, 833), (1666, 834)]
+    assert all(count <= 1000 for offset, count in chunks)
+
+
+def test_task_ids_cover_all_tasks_once(monkeypatch):
+    taskids = []
+    for offset, count in arrays.split(2500, 1000):
+        if offset:
+            monkeypatch.setenv(arrays.OFFSET, str(offset))
+        else:
+            monkeypatch.delenv(arrays.OFFSET, raising=False)
+        taskids += [arrays.taskid(index) for index in range(count)]
+
+    assert taskids == list(range(2500))
+
+
+def test_shell_expansion_of_task_id():
+    env = dict(os.environ, SLURM_ARRAY_TASK_ID='5')
+    env.pop(arrays.OFFSET, None)
+    expand = lambda env: subprocess.check_output(
+        'echo ' + arrays.SLURM_TASKID, shell=True, env=env).strip()
+
+    assert expand(env) == b'5'
+    assert expand(dict(env, **{arrays.OFFSET: '833'})) == b'838'
+
+
+def test_slurm_limit():
+    class Client(object):
+        def __init__(self, output):
+            self.output = output
+
+        def cached(self, cmd, ttl):
+            return self.output
+
+    assert arrays.slurm_limit(Client('MaxArraySize = 4001\n')) == 4001
+    assert arrays.slurm_limit(Client('')) == arrays.SLURM_DEFAULT
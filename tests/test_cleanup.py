@@ -0,0 +1,175 @@
+
+import os
+import time
+
+from os.path import exists, join
+from uuid import uuid4
+from seisflows.system.lib import cleanup
+
+
+DAY = 86400.
+
+
+class Client(object):
+    """ Stands in for scheduler client, answering squeue with given jobs
+    """
+    def __init__(self, jobs=(), fail=False):
+        self.jobs = jobs
+        self.fail = fail
+
+    def call(self, cmd):
+        assert cmd.startswith('squeue')
+        if self.fail:
+            raise Exception('squeue failed')
+        return ''.join('%s\n' % job for job in self.jobs)
+
+
+def make_tree(root, workdir=None, jobid=None, age=0.):
+    """ Creates UUID scratch tree, marked as owned by workdir if given
+    """
+    tree = join(root, str(uuid4()))
+    os.makedirs(join(tree, 'solver'))
+    if workdir:
+        cleanup.mark(tree, workdir, jobid)
+        then = time.time() - age
+        os.utime(join(tree, cleanup.OWNER), (then, then))
+    return tree
+
+
+def make_workdir(path, tree):
+    os.makedirs(path)
+    cleanup.link(tree, path)
+    return path
+
+
+def test_orphaned_after_resubmission(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    workdir = str(tmpdir.join('workdir'))
+    old = make_tree(root, workdir, '100', age=8*DAY)
+    new = make_tree(root, workdir, '200')
+    make_workdir(workdir, old)
+
+    # submitting again points working directory at the new tree
+    cleanup.link(new, workdir)
+
+    assert cleanup.orphans(new, set(['200'])) == [old]
+
+
+def test_live_tree_of_other_workflow_is_kept(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    ours = make_tree(root)
+    theirs = make_tree(root, str(tmpdir.join('other')), '100', age=30*DAY)
+    make_workdir(str(tmpdir.join('other')), theirs)
+
+    assert cleanup.orphans(ours, set()) == []
+
+
+def test_tree_of_running_job_is_kept(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    workdir = str(tmpdir.join('workdir'))
+    ours = make_tree(root)
+    old = make_tree(root, workdir, '100', age=30*DAY)
+    make_workdir(workdir, ours)
+
+    assert cleanup.orphans(ours, set(['100'])) == []
+
+
+def test_recent_tree_is_kept(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    workdir = str(tmpdir.join('workdir'))
+    ours = make_tree(root)
+    old = make_tree(root, workdir, '100', age=DAY)
+    make_workdir(workdir, ours)
+
+    assert cleanup.orphans(ours, set()) == []
+    assert cleanup.orphans(ours, set(), minage=0.5*DAY) == [old]
+
+
+def test_unreadable_workdir_is_no_evidence(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    ours = make_tree(root)
+
+    # working directory missing, e.g. because it is not mounted
+    make_tree(root, str(tmpdir.join('unmounted')), '100', age=30*DAY)
+
+    assert cleanup.orphans(ours, set()) == []
+
+
+def test_unmarked_tree_is_kept(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    ours = make_tree(root)
+    make_tree(root)
+
+    assert cleanup.orphans(ours, set()) == []
+
+
+def test_unknown_jobs_keep_everything(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    workdir = str(tmpdir.join('workdir'))
+    ours = make_tree(root)
+    make_tree(root, workdir, '100', age=30*DAY)
+    make_workdir(workdir, ours)
+
+    assert cleanup.orphans(ours, None) == []
+    assert cleanup.active(Client(fail=True)) is None
+
+
+def test_link_leaves_real_directory(tmpdir):
+    workdir = str(tmpdir)
+    os.makedirs(join(workdir, 'scratch'))
+
+    cleanup.link(str(tmpdir.join('elsewhere')), workdir)
+
+    assert not os.path.islink(join(workdir, 'scratch'))
+
+
+def test_mark_keeps_creation_time(tmpdir):
+    tree = str(tmpdir)
+    cleanup.mark(tree, '/workdir')
+    created = cleanup._owner(tree)['created']
+    cleanup.mark(tree, '/workdir', '100')
+
+    assert cleanup._owner(tree) == \
+        {'workdir': '/workdir', 'jobid': '100', 'created': created}
+    assert cleanup.owner(tree) == '/workdir'
+
+
+def test_sweep_removes_orphans_and_stale_iterations(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    workdir = str(tmpdir.join('workdir'))
+    ours = make_tree(root, workdir, '200')
+    old = make_tree(root, workdir, '100', age=30*DAY)
+    make_workdir(workdir, ours)
+    for i in range(4):
+        os.makedirs(join(ours, 'kernels_%04d' % i))
+
+    cleaner = cleanup.Cleaner(ours, retain=2, minfree=0.,
+                              client=Client(['200']))
+    cleaner.sweep()
+
+    assert not exists(old)
+    assert sorted(os.listdir(ours)) == \
+        [cleanup.OWNER, 'kernels_0002', 'kernels_0003', 'solver']
+
+
+def test_sweep_without_client_keeps_other_trees(tmpdir):
+    root = str(tmpdir.mkdir('scratch'))
+    workdir = str(tmpdir.join('workdir'))
+    ours = make_tree(root, workdir, '200')
+    old = make_tree(root, workdir, '100', age=30*DAY)
+    make_workdir(workdir, ours)
+
+    cleanup.Cleaner(ours, minfree=0.).sweep()
+
+    assert exists(old)
+
+
+def test_remove(tmpdir):
+    tree = str(tmpdir.join('tree'))
+    for i in range(3):
+        os.makedirs(join(tree, str(i), 'sub'))
+        open(join(tree, str(i), 'sub', 'file'), 'w').close()
+
+    cleanup.remove(tree, nthreads=2)
+
+    assert os.listdir(str(tmpdir)) == []
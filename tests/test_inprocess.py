@@ -0,0 +1,67 @@
+
+import os
+import sys
+
+import pytest
+
+from seisflows.system.lib import inprocess
+
+
+class Dict(object):
+    """ Stands in for PAR
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+
+class Optimize(object):
+    """ Stands in for a workflow object whose task fails part way
+    """
+    def update_search(self, path):
+        os.chdir(path)
+        self.seen = os.environ['SEISFLOWS_TASK_ID'], os.environ['OMP_NUM_THREADS']
+        raise ValueError('line search failed')
+
+
+@pytest.fixture
+def optimize(monkeypatch):
+    obj = Optimize()
+    monkeypatch.setitem(sys.modules, 'seisflows_optimize', obj)
+    return obj
+
+
+def test_selected():
+    assert inprocess.selected('optimize', 'update_search', ['optimize.*'])
+    assert not inprocess.selected('solver', 'eval_func', ['optimize.*'])
+    assert not inprocess.selected('optimize', 'update_search', None)
+
+
+def test_failing_task_restores_master(tmpdir, optimize, monkeypatch):
+    monkeypatch.delenv('SEISFLOWS_TASK_ID', raising=False)
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+
+    with pytest.raises(ValueError):
+        inprocess.run('optimize', 'update_search', {'path': str(tmpdir)},
+                      environs='OMP_NUM_THREADS=4')
+
+    # task saw the environment of a task...
+    assert optimize.seen == ('0', '4')
+
+    # ...but the master's is as before
+    assert os.getcwd() == cwd
+    assert dict(os.environ) == environ
+
+
+def test_check():
+    par = Dict()
+    inprocess.check(par)
+    assert par.INPROCESS == []
+
+    par = Dict(INPROCESS=['optimize.*'])
+    inprocess.check(par)
+    assert par.INPROCESS == ['optimize.*']
@@ -0,0 +1,59 @@
+
+import gzip
+import sys
+
+from seisflows.system.lib import logs
+
+
+def test_extract_by_task(tmpdir):
+    filename = str(tmpdir.join('solver_eval_func.log'))
+    first = logs.TaskLog(filename, 0, jobid='100')
+    second = logs.TaskLog(filename, 1, jobid='100')
+
+    # interleaved chunks of two tasks
+    first.write(b'first 1')
+    first.flush()
+    second.write(b'second 1\n')
+    second.flush()
+    first.write(b'first 2\n')
+    first.close()
+    second.close()
+
+    assert logs.extract(filename, 0) == b'first 1\nfirst 2\n'
+    assert logs.extract(filename, 1) == b'second 1\n'
+    assert logs.extract(filename, 2) == b''
+
+
+def test_extract_by_job(tmpdir):
+    filename = str(tmpdir.join('solver_eval_func.log'))
+    for jobid, line in [('100', b'failed attempt'), ('101', b'retry')]:
+        log = logs.TaskLog(filename, 3, jobid=jobid)
+        log.write(line)
+        log.close()
+
+    assert logs.extract(filename, 3, '101') == b'retry\n'
+    assert logs.extract(filename, 3) == b'failed attempt\nretry\n'
+
+
+def test_compressed_chunks_are_gzip_members(tmpdir):
+    filename = str(tmpdir.join('solver_eval_func.log.gz'))
+    for taskid in range(2):
+        log = logs.TaskLog(filename, taskid, compress=True)
+        log.write(b'task %d' % taskid)
+        log.close()
+
+    assert logs.extract(filename, 1) == b'task 1\n'
+
+    # log as a whole reads as one gzip stream
+    with gzip.open(filename, 'rb') as f:
+        assert f.read() == b'[0] task 0\n[1] task 1\n'
+
+
+def test_run_keeps_exit_status(tmpdir):
+    filename = str(tmpdir.join('node.{host}.log'))
+    status = logs.run(filename, [sys.executable, '-c',
+        'import sys; print("output"); sys.exit(3)'], taskid=7)
+
+    assert status == 3
+    logfile = [str(f) for f in tmpdir.listdir() if f.ext == '.log'][0]
+    assert logs.extract(logfile, 7) == b'output\n'
@@ -0,0 +1,46 @@
+
+import pytest
+
+from seisflows.system.lib import master
+from seisflows.system.lib.scheduler import SchedulerError
+
+
+class Client(object):
+    def __init__(self, output=None, error=None):
+        self.output = output
+        self.error = error
+
+    def call(self, cmd, **kwargs):
+        if self.error:
+            raise SchedulerError(self.error)
+        return self.output
+
+
+def test_running_job(tmpdir):
+    master.record(str(tmpdir), jobid='42', log='output.log')
+    assert master.alive(str(tmpdir), Client('RUNNING\n'))
+
+
+def test_finished_job(tmpdir):
+    master.record(str(tmpdir), jobid='42', log='output.log')
+    assert not master.alive(str(tmpdir), Client(''))
+
+
+def test_purged_job(tmpdir):
+    master.record(str(tmpdir), jobid='42', log='output.log')
+    client = Client(error='Command failed with status 1: squeue\n'
+        'slurm_load_jobs error: Invalid job id specified')
+    assert not master.alive(str(tmpdir), client)
+
+
+def test_failed_query_is_not_taken_as_exited(tmpdir):
+    master.record(str(tmpdir), jobid='42', log='output.log')
+    client = Client(error='Timed out after 120s: squeue')
+
+    with pytest.raises(master.UnknownError):
+        master.alive(str(tmpdir), client)
+    assert master.describe(str(tmpdir), client).startswith('unknown')
+
+
+def test_nothing_recorded(tmpdir):
+    assert not master.alive(str(tmpdir), Client(error='not called'))
@@ -0,0 +1,71 @@
+
+import pytest
+
+from seisflows.system.lib import metrics
+
+
+class Dict(object):
+    """ Stands in for PAR
+    """
+    def __contains__(self, key):
+        return key in self.__dict__
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """ Empty set of metrics for each test
+    """
+    for name in ['_counters', '_gauges', '_histograms', '_help', '_tasks']:
+        monkeypatch.setattr(metrics, name, {})
+    monkeypatch.setattr(metrics, '_scratch', [None])
+
+
+def test_render_counters_and_gauges():
+    metrics.inc('seisflows_task_retries_total', help='Tasks resubmitted',
+                stage='solver.eval_func')
+    metrics.inc('seisflows_task_retries_total', stage='solver.eval_func')
+    metrics.gauge('seisflows_line_search_step', 3, stage='optimize "x"')
+
+    assert metrics.render() == '\n'.join([
+        '# HELP seisflows_line_search_step seisflows_line_search_step',
+        '# TYPE seisflows_line_search_step gauge',
+        'seisflows_line_search_step{stage="optimize \\"x\\""} 3.0',
+        '# HELP seisflows_task_retries_total Tasks resubmitted',
+        '# TYPE seisflows_task_retries_total counter',
+        'seisflows_task_retries_total{stage="solver.eval_func"} 2.0',
+        ''])
+
+
+def test_render_histogram():
+    metrics.observe('seisflows_poll_seconds', 0.2, help='Poll time')
+    metrics.observe('seisflows_poll_seconds', 400.)
+
+    lines = metrics.render().splitlines()
+
+    assert 'seisflows_poll_seconds_bucket{le="0.1"} 0.0' in lines
+    assert 'seisflows_poll_seconds_bucket{le="0.25"} 1.0' in lines
+    assert 'seisflows_poll_seconds_bucket{le="300"} 1.0' in lines
+    assert 'seisflows_poll_seconds_bucket{le="+Inf"} 2.0' in lines
+    assert 'seisflows_poll_seconds_sum 400.2' in lines
+    assert 'seisflows_poll_seconds_count 2.0' in lines
+
+
+def test_render_task_states():
+    metrics.stage('solver.eval_grad', 4)
+    metrics.task_states(['RUNNING', 'COMPLETED', 'FAILED'])
+
+    lines = metrics.render().splitlines()
+
+    for state, count in [('queued', 1), ('running', 1), ('completed', 1),
+                         ('failed', 1), ('unknown', 0)]:
+        assert ('seisflows_tasks{stage="solver.eval_grad",state="%s"} %.1f'
+                % (state, count)) in lines
+
+
+def test_served_on_loopback_by_default():
+    par = Dict()
+    metrics.check(par)
+
+    assert par.METRICSPORT == 0
+    assert par.METRICSADDR == '127.0.0.1'
+    assert par.METRICSFILE is None
@@ -0,0 +1,19 @@
+
+from seisflows.system.lib import planner
+
+
+def test_given():
+    for args in ['--partition=t1standard', '--partition t1standard',
+                 '-p t1standard', '-pt1standard', '--mem=4G -p debug']:
+        assert planner.given(args)
+
+
+def test_not_given():
+    for args in ['', None, '--mem=4G', '--comment=-p',
+                 '--partitions-are-not-a-flag']:
+        assert not planner.given(args)
+
+
+def test_shapes():
+    assert planner.shapes(48, 24) == [(2, 24), (3, 16), (4, 12)]
+    assert planner.shapes(20, 24) == [(1, 20), (2, 10)]
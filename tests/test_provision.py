@@ -0,0 +1,198 @@
+
+import os
+import pickle
+import sys
+
+import pytest
+
+from os.path import exists, join
+from seisflows.system.lib import provision
+
+
+class Dict(object):
+    """ Stands in for PAR and PATH
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+
+def make_source(path):
+    for name, data in [('bin/xspecfem3D', 'binary'),
+                       ('DATA/Par_file', 'parameters'),
+                       ('DATABASES_MPI/proc000000_vp.bin', 'mesh'),
+                       ('OUTPUT_FILES/output_solver.txt', 'output')]:
+        if not exists(join(path, os.path.dirname(name))):
+            os.makedirs(join(path, os.path.dirname(name)))
+        with open(join(path, name), 'w') as f:
+            f.write(data)
+    os.symlink('bin/xspecfem3D', join(path, 'solver'))
+    return path
+
+
+def inode(filename):
+    return os.stat(filename).st_ino
+
+
+def test_setup_links_only_readonly_files(tmpdir):
+    source = make_source(str(tmpdir.mkdir('source')))
+    scratch = str(tmpdir.mkdir('scratch'))
+    dirnames = [join(scratch, 'solver', str(i)) for i in range(3)]
+
+    provision.setup(source, scratch, dirnames, mode='hardlink')
+
+    template = join(scratch, 'template')
+    for dirname in dirnames:
+        assert inode(join(dirname, 'bin/xspecfem3D')) == \
+               inode(join(template, 'bin/xspecfem3D'))
+        for name in ['DATA/Par_file', 'DATABASES_MPI/proc000000_vp.bin',
+                     'OUTPUT_FILES/output_solver.txt']:
+            assert inode(join(dirname, name)) != inode(join(template, name))
+        assert os.readlink(join(dirname, 'solver')) == 'bin/xspecfem3D'
+
+
+def test_rewriting_mesh_leaves_template_and_other_tasks_intact(tmpdir):
+    source = make_source(str(tmpdir.mkdir('source')))
+    scratch = str(tmpdir.mkdir('scratch'))
+    dirnames = [join(scratch, 'solver', str(i)) for i in range(2)]
+
+    provision.setup(source, scratch, dirnames, mode='hardlink')
+
+    # solver rewrites files in place, as when updating the model
+    with open(join(dirnames[0], 'DATABASES_MPI/proc000000_vp.bin'), 'w') as f:
+        f.write('updated')
+
+    for path in [join(scratch, 'template'), dirnames[1]]:
+        with open(join(path, 'DATABASES_MPI/proc000000_vp.bin')) as f:
+            assert f.read() == 'mesh'
+
+
+def test_setup_keeps_existing_files(tmpdir):
+    source = make_source(str(tmpdir.mkdir('source')))
+    scratch = str(tmpdir.mkdir('scratch'))
+    dirnames = [join(scratch, 'solver', '0')]
+
+    provision.setup(source, scratch, dirnames)
+    with open(join(dirnames[0], 'DATA/Par_file'), 'w') as f:
+        f.write('edited')
+    provision.setup(source, scratch, dirnames)
+
+    with open(join(dirnames[0], 'DATA/Par_file')) as f:
+        assert f.read() == 'edited'
+
+
+def test_copies_by_default(tmpdir):
+    source = make_source(str(tmpdir.mkdir('source')))
+    scratch = str(tmpdir.mkdir('scratch'))
+    dirnames = [join(scratch, 'solver', '0')]
+
+    provision.setup(source, scratch, dirnames)
+
+    assert inode(join(dirnames[0], 'bin/xspecfem3D')) != \
+           inode(join(scratch, 'template', 'bin/xspecfem3D'))
+
+
+def test_bad_mode(tmpdir):
+    with pytest.raises(ValueError):
+        provision.fanout(str(tmpdir), [], mode='symlink')
+
+
+def test_check_defaults():
+    par = Dict()
+    path = Dict()
+    provision.check(par, path)
+
+    assert par.LINKMODE == 'copy'
+    assert par.WRITABLE == provision.WRITABLE
+    assert path.TEMPLATE is None
+
+
+def test_check_keeps_given_values():
+    par = Dict(LINKMODE='hardlink', WRITABLE=['DATA/*'])
+    path = Dict(TEMPLATE='/template')
+    provision.check(par, path)
+
+    assert par.LINKMODE == 'hardlink'
+    assert par.WRITABLE == ['DATA/*']
+    assert path.TEMPLATE == '/template'
+
+
+class Solver(object):
+    """ Stands in for a solver object, as far as its setup goes
+    """
+    source_prefix = 'CMTSOLUTION'
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self.source_name = '000000'
+        self.model_databases = join(cwd, 'OUTPUT_FILES/DATABASES_MPI')
+        self.kernel_databases = join(cwd, 'OUTPUT_FILES/DATABASES_MPI')
+        self.checked = False
+
+    def initialize_solver_directories(self):
+        raise Exception('solver copies files itself')
+
+    def check_solver_parameter_files(self):
+        self.checked = True
+
+
+def install(tmpdir, **kwargs):
+    source = make_source(str(tmpdir.mkdir('source')))
+    with open(join(source, 'DATA/CMTSOLUTION_000000'), 'w') as f:
+        f.write('source')
+    scratch = str(tmpdir.mkdir('scratch'))
+    solver = Solver(join(scratch, 'solver', '000000'))
+    par = Dict(**kwargs)
+    path = Dict(TEMPLATE=source, SCRATCH=scratch)
+    provision.check(par, path)
+
+    sys.modules['seisflows_solver'] = solver
+    try:
+        provision.install(par, path)
+    finally:
+        del sys.modules['seisflows_solver']
+    return solver
+
+
+def test_install_replaces_solver_copy(tmpdir):
+    cwd = os.getcwd()
+    solver = install(tmpdir)
+    try:
+        solver.initialize_solver_directories()
+    finally:
+        os.chdir(cwd)
+
+    for name in ['bin/xspecfem3D', 'DATABASES_MPI/proc000000_vp.bin',
+                 'traces/obs', 'OUTPUT_FILES/DATABASES_MPI']:
+        assert exists(join(solver.cwd, name))
+    with open(join(solver.cwd, 'DATA/CMTSOLUTION')) as f:
+        assert f.read() == 'source'
+    assert solver.checked
+
+
+def test_installed_initializer_is_checkpointed(tmpdir):
+    solver = install(tmpdir)
+
+    solver = pickle.loads(pickle.dumps(solver, 2))
+
+    assert isinstance(solver.initialize_solver_directories,
+                      provision.Initializer)
+    assert solver.initialize_solver_directories.solver is solver
+
+
+def test_install_without_template(tmpdir):
+    solver = Solver(str(tmpdir))
+    par = Dict()
+    path = Dict(SCRATCH=str(tmpdir))
+    provision.check(par, path)
+
+    sys.modules['seisflows_solver'] = solver
+    try:
+        provision.install(par, path)
+    finally:
+        del sys.modules['seisflows_solver']
+
+    assert 'initialize_solver_directories' not in vars(solver)
+    assert not exists(join(str(tmpdir), 'template'))
@@ -0,0 +1,118 @@
+
+import os
+
+import pytest
+
+from os.path import exists, join
+
+np = pytest.importorskip('numpy')
+
+from seisflows.system.lib import reduction
+
+
+def test_reduce_ignores_leftovers_of_killed_tasks(tmpdir):
+    path = str(tmpdir.join('reduce', 'gradient'))
+    for taskid in range(3):
+        reduction.contribute(path, taskid, np.ones(4))
+
+    # temporary file of a task killed while writing
+    with open(join(path, '000003.npy.1234.tmp'), 'wb') as f:
+        np.save(f, 100.*np.ones(4))
+
+    dst = str(tmpdir.join('gradient.npy'))
+    reduction.merge(reduction.contributions(path), dst, nthreads=2)
+
+    assert np.all(np.load(dst) == 3.)
+
+
+def test_retried_contribution_counted_once(tmpdir):
+    path = str(tmpdir.join('reduce', 'gradient'))
+    reduction.contribute(path, 0, np.ones(4))
+    reduction.contribute(path, 1, np.ones(4))
+    reduction.contribute(path, 1, np.ones(4))
+
+    assert len(reduction.contributions(path)) == 2
+
+
+def test_contributions_of_missing_directory(tmpdir):
+    assert reduction.contributions(str(tmpdir.join('missing'))) == []
+
+
+def test_node_alone(tmpdir):
+    local = str(tmpdir.join('local'))
+    shared = str(tmpdir.join('shared'))
+    dst = str(tmpdir.join('gradient.npy'))
+    for taskid in range(3):
+        reduction.contribute(join(local, 'gradient'), taskid,
+            (taskid+1.)*np.ones(4))
+
+    reduction.node('gradient', 0, 1, local, shared, dst)
+
+    assert np.all(np.load(dst) == 6.)
+    assert not exists(join(local, 'gradient'))
+
+
+def test_node_with_nothing_to_reduce(tmpdir):
+    with pytest.raises(Exception):
+        reduction.node('gradient', 0, 1, str(tmpdir.join('local')),
+            str(tmpdir.join('shared')), str(tmpdir.join('gradient.npy')))
+
+
+def test_tree_clears_stale_handoffs(tmpdir):
+    shared = str(tmpdir)
+    for name in ['gradient.1.npy', 'gradient.2.empty', 'kernel.1.npy']:
+        open(join(shared, name), 'w').close()
+
+    assert reduction.tree([], 'gradient', '/dev/null', shared, 'dst') == []
+
+    assert os.listdir(shared) == ['kernel.1.npy']
+
+
+def test_merge_of_nothing(tmpdir):
+    with pytest.raises(Exception):
+        reduction.merge([], str(tmpdir.join('dst.npy')))
+
+
+def test_merge_across_filesystems(tmpdir, monkeypatch):
+    import errno
+    path = str(tmpdir.join('reduce', 'gradient'))
+    for taskid in range(2):
+        reduction.contribute(path, taskid, np.ones(4))
+    dst = str(tmpdir.join('gradient.npy'))
+
+    rename = os.rename
+    def cross_device(src, target):
+        if target == dst and not src.endswith('.tmp'):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        rename(src, target)
+    monkeypatch.setattr(reduction.os, 'rename', cross_device)
+
+    reduction.merge(reduction.contributions(path), dst)
+
+    assert np.all(np.load(dst) == 2.)
+    assert reduction.contributions(path) == []
+
+
+def test_reset_once_per_process(tmpdir, monkeypatch):
+    monkeypatch.setattr(reduction, '_reset', set())
+    path = str(tmpdir.join('reduce'))
+    reduction.contribute(join(path, 'gradient'), 0, np.ones(4))
+
+    # left by an earlier master
+    reduction.reset(path)
+    assert not exists(path)
+
+    # awaiting reduction after a later stage
+    reduction.contribute(join(path, 'gradient'), 0, np.ones(4))
+    reduction.reset(path)
+    assert len(reduction.contributions(join(path, 'gradient'))) == 1
+
+
+def test_discard_keeps_current_job(tmpdir):
+    path = str(tmpdir)
+    for jobid in ['41', '42']:
+        reduction.contribute(join(path, jobid, 'gradient'), 0, np.ones(4))
+
+    reduction.discard(path, join(path, '42'))
+
+    assert os.listdir(path) == ['42']
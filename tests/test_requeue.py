@@ -0,0 +1,100 @@
+
+import pytest
+
+from seisflows.system.lib import requeue
+
+
+HOUR = 3600.
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Master started at time zero, with clock advanced by tests
+    """
+    now = [0.]
+    monkeypatch.setattr(requeue.time, 'time', lambda: now[0])
+    monkeypatch.setattr(requeue, '_requested', [False])
+    monkeypatch.setattr(requeue, '_started', [0.])
+    monkeypatch.setattr(requeue, '_current', [None, None])
+    return now
+
+
+def test_hands_over_only_between_iterations(clock):
+    assert not requeue.due(1, 10*HOUR)
+    requeue._requested[0] = True
+
+    # later stages of the same iteration
+    clock[0] = 1*HOUR
+    assert not requeue.due(1, 10*HOUR)
+
+    clock[0] = 2*HOUR
+    assert requeue.due(2, 10*HOUR)
+
+
+def test_hands_over_when_next_iteration_would_not_fit(clock):
+    assert not requeue.due(1, 10*HOUR)
+
+    clock[0] = 3*HOUR
+    assert not requeue.due(2, 10*HOUR)
+
+    clock[0] = 8*HOUR
+    assert requeue.due(3, 10*HOUR)
+
+
+def test_first_iteration_always_runs(clock):
+    requeue._requested[0] = True
+    clock[0] = 9*HOUR
+    assert not requeue.due(5, 10*HOUR)
+
+
+def test_workflow_without_iterations(clock):
+    requeue._requested[0] = True
+    assert not requeue.due(None, 10*HOUR)
+    assert not requeue.due(None, 10*HOUR)
+
+
+def test_resubmit_appends_output(tmpdir):
+    class Client(object):
+        def submit(self, cmd):
+            self.cmd = cmd
+            return '42'
+
+    client = Client()
+    requeue.save(str(tmpdir), 'sbatch --job-name=test submit')
+
+    assert requeue.resubmit(str(tmpdir), client) == '42'
+    assert client.cmd == 'sbatch --open-mode=append --job-name=test submit'
+
+
+def test_continuation_waits_for_master(tmpdir):
+    class Client(object):
+        def submit(self, cmd):
+            self.cmd = cmd
+            return '43'
+
+    client = Client()
+    requeue.save(str(tmpdir), 'sbatch submit')
+
+    requeue.resubmit(str(tmpdir), client, after='42')
+    assert client.cmd == \
+        'sbatch --open-mode=append --dependency=afterany:42 submit'
+
+
+def test_resubmit_without_command(tmpdir):
+    class Client(object):
+        def submit(self, cmd):
+            raise AssertionError('nothing to submit')
+
+    with pytest.raises(Exception) as e:
+        requeue.resubmit(str(tmpdir), Client())
+    assert 'Cannot requeue' in str(e.value)
+
+
+def test_check_disabled_by_default():
+    class Dict(object):
+        def __contains__(self, key):
+            return key in self.__dict__
+
+    par = Dict()
+    requeue.check(par)
+    assert par.REQUEUE == 0
@@ -0,0 +1,55 @@
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from seisflows.system.lib import scaling
+
+
+def test_fit_recovers_curve():
+    model = dict(serial=10., parallel=1000., comm=0.5)
+    timings = dict((nproc, scaling.runtime(model, nproc))
+                   for nproc in [8, 16, 24, 48])
+
+    fitted = scaling.fit(timings)
+
+    for name in model:
+        assert abs(fitted[name] - model[name]) < 1e-6
+
+
+def test_single_timing_scales_perfectly():
+    assert scaling.fit({16: 100.}) == \
+        dict(serial=0., parallel=1600., comm=0.)
+
+
+def test_choose_penalizes_idle_cores():
+    # perfect scaling, so only idle cores on each node make a difference
+    model = dict(serial=0., parallel=1000., comm=0.)
+
+    # with 40 cores per node, 16-core tasks leave 8 cores idle
+    result = scaling.choose(model, [16, 20], ntask=48, nodesize=40)
+
+    assert result['nproc'] == 20
+    assert [c['nodes'] for c in result['candidates']] == [24, 24]
+
+
+def test_partitions_of_mesh(tmpdir):
+    for rank in range(4):
+        for name in ['vp', 'vs']:
+            tmpdir.join('proc%06d_%s.bin' % (rank, name)).write('')
+    tmpdir.join('mesh_info.txt').write('')
+
+    assert scaling.partitions(str(tmpdir)) == 4
+
+
+def test_partitions_without_mesh(tmpdir):
+    assert scaling.partitions(str(tmpdir)) is None
+
+
+def test_probe_jobs_recorded(tmpdir):
+    path = str(tmpdir.join('probe'))
+    assert scaling.jobs(path) == []
+
+    scaling.submitted(path, ['101', '102'])
+
+    assert scaling.jobs(path) == ['101', '102']
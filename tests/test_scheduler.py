@@ -0,0 +1,123 @@
+
+import os
+import stat
+
+import pytest
+
+from os.path import join
+from seisflows.system.lib import scheduler
+
+
+def make_command(path, name, script):
+    filename = join(path, name)
+    with open(filename, 'w') as f:
+        f.write('#!/bin/sh\n' + script)
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def bindir(tmpdir, monkeypatch):
+    """ Directory of fake scheduler commands, put first on PATH
+    """
+    path = str(tmpdir.mkdir('bin'))
+    monkeypatch.setenv('PATH', path + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('CALLS', str(tmpdir.join('calls')))
+    return path
+
+
+def calls():
+    try:
+        with open(os.environ['CALLS']) as f:
+            return f.read().splitlines()
+    except IOError:
+        return []
+
+
+def client():
+    return scheduler.Client(rate=100., timeout=5., retries=2, backoff=0.)
+
+
+def test_failed_sbatch_that_went_through_is_not_resubmitted(bindir):
+    # job is queued, but sbatch reports failure
+    make_command(bindir, 'sbatch',
+        'echo "sbatch $*" >> $CALLS\n'
+        'echo "$1" | sed "s/--comment=//" > $CALLS.comment\n'
+        'exit 1\n')
+    make_command(bindir, 'squeue',
+        'echo "41 other"\n'
+        'echo "42 $(cat $CALLS.comment)"\n')
+
+    assert client().submit('sbatch job.sh') == '42'
+    assert len(calls()) == 1
+    assert calls()[0].startswith('sbatch --comment=seisflows-')
+
+
+def test_failed_sbatch_is_retried(bindir):
+    make_command(bindir, 'sbatch',
+        'echo "sbatch $*" >> $CALLS\n'
+        'test $(wc -l < $CALLS) -lt 2 && exit 1\n'
+        'echo "Submitted batch job 43"\n')
+    make_command(bindir, 'squeue', 'true\n')
+
+    assert client().submit('sbatch job.sh') == '43'
+    assert len(calls()) == 2
+
+
+def test_sbatch_not_retried_if_queue_unknown(bindir):
+    make_command(bindir, 'sbatch', 'echo "sbatch $*" >> $CALLS; exit 1\n')
+    make_command(bindir, 'squeue', 'exit 1\n')
+
+    with pytest.raises(scheduler.SchedulerError):
+        client().submit('sbatch job.sh')
+    assert len(calls()) == 1
+
+
+def test_other_submissions_not_retried(bindir):
+    make_command(bindir, 'qsub', 'echo "qsub $*" >> $CALLS; exit 1\n')
+    make_command(bindir, 'sbatch', 'echo "sbatch $*" >> $CALLS; exit 1\n')
+
+    with pytest.raises(scheduler.SchedulerError):
+        client().submit('qsub job.sh')
+    with pytest.raises(scheduler.SchedulerError):
+        client().submit('sbatch --comment=mine job.sh')
+    assert calls() == ['qsub job.sh', 'sbatch --comment=mine job.sh']
+
+
+def test_queries_are_retried(bindir):
+    make_command(bindir, 'sacct',
+        'echo "sacct $*" >> $CALLS\n'
+        'test $(wc -l < $CALLS) -lt 3 && exit 1\n'
+        'echo COMPLETED\n')
+
+    assert client().call('sacct -j 1').strip() == 'COMPLETED'
+    assert len(calls()) == 3
+
+
+def test_check_keeps_given_values():
+    class Dict(object):
+        def __contains__(self, key):
+            return key in self.__dict__
+
+    par = Dict()
+    par.CMDRETRIES = 0
+    scheduler.check(par)
+
+    assert (par.CMDRATE, par.CMDTIMEOUT, par.CMDRETRIES) == (1., 120., 0)
+
+
+def test_state_of_long_job_ids(bindir):
+    # widths beyond sacct's fixed-width columns
+    make_command(bindir, 'sacct',
+        'echo "sacct $*" >> $CALLS\n'
+        'echo "12345678_999|COMPLETED"\n'
+        'echo "12345678_999.batch|COMPLETED"\n'
+        'echo "12345678_1000|OUT_OF_MEMORY"\n'
+        'echo "12345678_1001|CANCELLED by 4321"\n'
+        'echo "12345678_[1002-1999]|PENDING"\n')
+
+    c = client()
+    assert c.state('12345678_999') == 'COMPLETED'
+    assert c.state('12345678_1000') == 'OUT_OF_MEMORY'
+    assert c.state('12345678_1001') == 'CANCELLED'
+    assert c.state('12345678_1500') == 'PENDING'
+    assert calls() == ['sacct -n -P -o JobID,State -j 12345678']
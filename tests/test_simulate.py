@@ -0,0 +1,53 @@
+
+from seisflows.system.lib import simulate
+
+
+PROFILE = {'nodes': 100, 'nodesize': 40, 'gpus': 0}
+
+# one stage of four tasks, each taking 100 s at 20 cores
+STAGES = [{'stage': 'solver.eval_func', 'hosts': 'all', 'work': 2000.,
+           'serial': 0.}]
+
+
+def run(flavor, **kwargs):
+    return simulate.simulate(PROFILE, flavor, STAGES, ntask=4, nproc=20,
+        tasks=simulate.TaskModel(overhead=0., jitter=0.),
+        queue=simulate.QueueModel(wait=0., pernode=0., share=1.), **kwargs)
+
+
+def test_lg_charges_whole_nodes():
+    result = run('lg')
+
+    # tasks run at once and are noticed at the next poll
+    assert result['makespan'] == 100.
+    assert result['busy'] == 4*20*100./3600.
+    # four 40-core task nodes and the master's node
+    assert result['charged'] == (4*40*100. + 40*100.)/3600.
+
+
+def test_dsh_charges_whole_nodes():
+    result = run('dsh')
+
+    assert result['makespan'] == 100.
+    assert result['busy'] == 4*20*100./3600.
+    assert result['charged'] == 2*40*100./3600.
+
+
+def test_ntaskmax_serializes_tasks():
+    assert run('lg', ntaskmax=1)['makespan'] == 400.
+
+
+def test_configuration_too_large():
+    assert simulate.simulate(PROFILE, 'sm', STAGES, ntask=400, nproc=20) \
+        is None
+
+
+def test_sweep_and_report():
+    results = simulate.sweep(['tigercpu_lg', 'tigercpu_dsh'], STAGES, 4,
+        [20, 40], replicates=2)
+
+    assert [(r['system'], r['nproc']) for r in results] == [
+        ('tigercpu_lg', 20), ('tigercpu_lg', 40),
+        ('tigercpu_dsh', 20), ('tigercpu_dsh', 40)]
+    assert all(r['feasible'] for r in results)
+    assert 'tigercpu_dsh' in simulate.report(results, 'cost')
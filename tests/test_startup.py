@@ -0,0 +1,78 @@
+
+import os
+
+from os.path import join
+from seisflows.system.lib import startup
+
+
+class Dict(object):
+    """ Stands in for PAR and PATH
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+
+def test_check_keeps_given_values():
+    par = Dict(SNAPSHOT=True)
+    startup.check(par)
+
+    assert par.SNAPSHOT is True
+    assert par.STARTUPTIMES is False
+    assert par.PYTHON == 'python'
+
+
+def test_snapshot_is_opt_in():
+    par = Dict()
+    startup.check(par)
+
+    assert par.SNAPSHOT is False
+
+
+def test_update_rewrites_snapshot_only_when_changed(tmpdir):
+    par = Dict(SNAPSHOT=True, NPROC=4)
+    path = Dict(OUTPUT=str(tmpdir))
+    filename = join(path.OUTPUT, startup.SNAPSHOT)
+
+    startup.update(par, path)
+    inode = os.stat(filename).st_ino
+    startup.update(par, path)
+    assert os.stat(filename).st_ino == inode
+
+    par.NPROC = 8
+    startup.update(par, path)
+    assert os.stat(filename).st_ino != inode
+
+
+def test_update_without_snapshot(tmpdir):
+    startup.update(Dict(SNAPSHOT=False), Dict(OUTPUT=str(tmpdir)))
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_cached_copy_follows_replaced_file(tmpdir):
+    cache = str(tmpdir.join('cache'))
+    filename = str(tmpdir.join('snapshot.p'))
+    for data in ['old', 'new']:
+        with open(filename + '.tmp', 'w') as f:
+            f.write(data)
+        os.rename(filename + '.tmp', filename)
+
+        copy = startup.cached(filename, cache)
+        with open(copy) as f:
+            assert f.read() == data
+
+    # copy of earlier version removed
+    assert os.listdir(cache) == [os.path.basename(copy)]
+
+
+def test_task_cmd_from_snapshot():
+    par = Dict(SNAPSHOT=True, ENVIRONS='A=1', PYTHON='python3')
+    path = Dict(OUTPUT='/output')
+
+    cmd = startup.task_cmd(par, path, 'solver', 'eval_func')
+
+    assert cmd.endswith(' python3 -m seisflows.system.lib.startup run '
+                        '/output solver eval_func A=1')
@@ -0,0 +1,99 @@
+
+import socket
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from seisflows.system.lib import worker
+
+
+class Parameters(object):
+    pass
+
+
+def test_reload_rebinds_module_aliases():
+    old, new = Parameters(), Parameters()
+    module = types.ModuleType('seisflows.test_worker_module')
+    module.PAR = old
+    sys.modules['seisflows_parameters'] = old
+    sys.modules[module.__name__] = module
+
+    def load(output):
+        sys.modules['seisflows_parameters'] = new
+
+    try:
+        worker._reload('output', load)
+        assert module.PAR is new
+    finally:
+        del sys.modules[module.__name__]
+        del sys.modules['seisflows_parameters']
+
+
+def test_request_times_out(tmpdir):
+    # worker that accepts connections but never replies
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    path = str(tmpdir)
+    worker._advertise(path, 'node', sock.getsockname()[1], '')
+    with open(str(tmpdir.join('node'))) as f:
+        line = f.read().replace('node', '127.0.0.1', 1)
+    with open(str(tmpdir.join('node')), 'w') as f:
+        f.write(line)
+
+    try:
+        started = time.time()
+        with pytest.raises(socket.error):
+            worker._request(path, 'node', {'action': 'ping'}, timeout=0.5)
+        assert time.time() - started < 5.
+
+        statuses = worker.dispatch(path,
+            [('node', 'solver', 'eval_func', 0, '')], timeout=0.5)
+        assert statuses == [-1]
+    finally:
+        sock.close()
+
+
+def test_one_connection_per_host(tmpdir, monkeypatch):
+    # worker that reports its tasks in reverse order, failing odd ones
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(8)
+    path = str(tmpdir)
+    with open(str(tmpdir.join('node')), 'w') as f:
+        f.write('127.0.0.1 %d  0\n' % sock.getsockname()[1])
+
+    requests = []
+    def serve():
+        conn = sock.accept()[0]
+        request = worker._recv(conn)
+        requests.append(request)
+        for task in reversed(request['tasks']):
+            worker._send(conn, {'taskid': task['taskid'],
+                                'status': task['taskid'] % 2})
+        conn.close()
+    thread = threading.Thread(target=serve)
+    thread.start()
+
+    reads = []
+    token = worker._token
+    monkeypatch.setattr(worker, '_token',
+        lambda path: reads.append(path) or token(path))
+
+    try:
+        timings = []
+        statuses = worker.dispatch(path,
+            [('node', 'solver', 'eval_func', taskid, '') for taskid in range(4)],
+            timings, timeout=5.)
+        thread.join()
+    finally:
+        sock.close()
+
+    assert statuses == [0, 1, 0, 1]
+    assert len(timings) == 4
+    assert len(requests) == 1
+    assert [task['taskid'] for task in requests[0]['tasks']] == [0, 1, 2, 3]
+    assert len(reads) == 1